@@ -0,0 +1,142 @@
+import db
+
+# Rollups are maintained inside the checkout transaction, so reports never scan order_lines.
+# Buckets are UTC: an hour bucket is created_at // 3600 * 3600, a day bucket created_at // 86400 * 86400.
+PERIODS = {"hour": ("sales_hourly", 3600), "day": ("sales_daily", 86400)}
+TOP_SELLER_ORDER = {"units": "units", "revenue": "revenue", "margin": "revenue - cost"}
+
+
+def init_schema(conn):
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS sales_hourly (
+            bucket INTEGER PRIMARY KEY,
+            orders INTEGER NOT NULL DEFAULT 0,
+            units INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0.0,
+            cost REAL NOT NULL DEFAULT 0.0
+        );
+        CREATE TABLE IF NOT EXISTS sales_daily (
+            bucket INTEGER PRIMARY KEY,
+            orders INTEGER NOT NULL DEFAULT 0,
+            units INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0.0,
+            cost REAL NOT NULL DEFAULT 0.0
+        );
+        CREATE TABLE IF NOT EXISTS product_sales (
+            barcode TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            manufacturer_code TEXT,
+            units INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0.0,
+            cost REAL NOT NULL DEFAULT 0.0,
+            last_sold_at INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS manufacturer_sales (
+            manufacturer_code TEXT PRIMARY KEY,
+            units INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0.0,
+            cost REAL NOT NULL DEFAULT 0.0
+        );
+        CREATE INDEX IF NOT EXISTS idx_product_sales_units ON product_sales(units);
+        CREATE INDEX IF NOT EXISTS idx_product_sales_revenue ON product_sales(revenue);
+    ''')
+
+
+def record_sale(conn, created_at, lines):
+    """Fold one order into the rollups. lines: dicts with barcode, name, manufacturer_code,
+    quantity, revenue and cost. Must run inside the caller's checkout transaction."""
+    units = sum(line['quantity'] for line in lines)
+    revenue = sum(line['revenue'] for line in lines)
+    cost = sum(line['cost'] for line in lines)
+    for table, size in PERIODS.values():
+        conn.execute(f'''
+            INSERT INTO {table} (bucket, orders, units, revenue, cost) VALUES (?, 1, ?, ?, ?)
+            ON CONFLICT(bucket) DO UPDATE SET orders = orders + 1, units = units + excluded.units,
+                revenue = revenue + excluded.revenue, cost = cost + excluded.cost
+        ''', (created_at // size * size, units, revenue, cost))
+    conn.executemany('''
+        INSERT INTO product_sales (barcode, name, manufacturer_code, units, revenue, cost, last_sold_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(barcode) DO UPDATE SET name = excluded.name, manufacturer_code = excluded.manufacturer_code,
+            units = units + excluded.units, revenue = revenue + excluded.revenue, cost = cost + excluded.cost,
+            last_sold_at = excluded.last_sold_at
+    ''', [(line['barcode'], line['name'], line['manufacturer_code'], line['quantity'], line['revenue'], line['cost'], created_at)
+          for line in lines])
+    by_manufacturer = {}
+    for line in lines:
+        totals = by_manufacturer.setdefault(line['manufacturer_code'] or "", [0, 0.0, 0.0])
+        totals[0] += line['quantity']
+        totals[1] += line['revenue']
+        totals[2] += line['cost']
+    conn.executemany('''
+        INSERT INTO manufacturer_sales (manufacturer_code, units, revenue, cost) VALUES (?, ?, ?, ?)
+        ON CONFLICT(manufacturer_code) DO UPDATE SET units = units + excluded.units,
+            revenue = revenue + excluded.revenue, cost = cost + excluded.cost
+    ''', [(code, *totals) for code, totals in by_manufacturer.items()])
+
+
+def rebuild(conn):
+    """Recompute every rollup from order_lines, costing lines at the products' current buy_price."""
+    with db.transaction(conn):
+        for table in ("sales_hourly", "sales_daily", "product_sales", "manufacturer_sales"):
+            conn.execute(f"DELETE FROM {table}")
+        for table, size in PERIODS.values():
+            conn.execute(f'''
+                INSERT INTO {table} (bucket, orders, units, revenue, cost)
+                SELECT o.created_at / {size} * {size}, COUNT(DISTINCT o.id), SUM(l.quantity), SUM(l.total),
+                       SUM(l.quantity * COALESCE(p.buy_price, 0))
+                FROM orders o JOIN order_lines l ON l.order_id = o.id LEFT JOIN products p ON p.barcode = l.barcode
+                GROUP BY 1
+            ''')
+        conn.execute('''
+            INSERT INTO product_sales (barcode, name, manufacturer_code, units, revenue, cost, last_sold_at)
+            SELECT l.barcode, MAX(l.name), p.manufacturer_code, SUM(l.quantity), SUM(l.total),
+                   SUM(l.quantity * COALESCE(p.buy_price, 0)), MAX(l.created_at)
+            FROM order_lines l LEFT JOIN products p ON p.barcode = l.barcode
+            GROUP BY l.barcode
+        ''')
+        conn.execute('''
+            INSERT INTO manufacturer_sales (manufacturer_code, units, revenue, cost)
+            SELECT COALESCE(manufacturer_code, ''), SUM(units), SUM(revenue), SUM(cost)
+            FROM product_sales GROUP BY 1
+        ''')
+
+
+def needs_backfill(conn):
+    has_orders = conn.execute("SELECT 1 FROM orders LIMIT 1").fetchone()
+    has_rollups = conn.execute("SELECT 1 FROM sales_daily LIMIT 1").fetchone()
+    return bool(has_orders) and not has_rollups
+
+
+def _with_margin(row):
+    result = dict(row)
+    result['revenue'] = round(result['revenue'], 2)
+    result['cost'] = round(result['cost'], 2)
+    result['margin'] = round(result['revenue'] - result['cost'], 2)
+    result['margin_pct'] = round(result['margin'] / result['revenue'] * 100, 2) if result['revenue'] else 0.0
+    return result
+
+
+def top_sellers(conn, limit=10, by="units"):
+    rows = conn.execute(f'''
+        SELECT barcode, name, manufacturer_code, units, revenue, cost, last_sold_at
+        FROM product_sales ORDER BY {TOP_SELLER_ORDER[by]} DESC LIMIT ?
+    ''', (limit,))
+    return [_with_margin(row) for row in rows]
+
+
+def revenue_by_period(conn, period="day", since=None, until=None):
+    table, _ = PERIODS[period]
+    rows = conn.execute(f'''
+        SELECT bucket, orders, units, revenue, cost FROM {table}
+        WHERE bucket >= ? AND bucket < ? ORDER BY bucket
+    ''', (since or 0, until if until is not None else 2**62))
+    return [_with_margin(row) for row in rows]
+
+
+def margin_by_manufacturer(conn, manufacturer_code=None):
+    if manufacturer_code is not None:
+        rows = conn.execute("SELECT * FROM manufacturer_sales WHERE manufacturer_code = ?", (manufacturer_code,))
+    else:
+        rows = conn.execute("SELECT * FROM manufacturer_sales ORDER BY revenue - cost DESC")
+    return [_with_margin(row) for row in rows]
@@ -0,0 +1,146 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import events
+from services import MAX_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# The bundled certificate is self-signed, so the till skips verification like it always has
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+API_WORKERS = 4
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = 15
+RETRIES = 2
+
+
+class ApiWorker:
+    """Runs HTTP calls for the Tk GUI on a thread pool over one keep-alive session.
+
+    Results are handed back on the Tk thread via root.after, so callbacks may touch widgets.
+    Only idempotent methods are retried; a checkout POST is never sent twice.
+    """
+
+    def __init__(self, root, base_url, workers=API_WORKERS):
+        self.root = root
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.verify = False
+        retry = Retry(total=RETRIES, backoff_factor=0.2, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(["GET", "PUT", "DELETE"]))
+        # One extra connection for the long-lived event stream
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers + 1, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api")
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def call(self, method, path, **kwargs):
+        """Blocking request with timeouts; raises for HTTP errors. Use from worker threads only."""
+        kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+        response = self.session.request(method, self.url(path), **kwargs)
+        if response.status_code >= 400 and response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+    def submit(self, func, *args, on_success=None, on_error=None):
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(lambda f: self.root.after(0, self._deliver, f, on_success, on_error))
+        return future
+
+    def request(self, method, path, on_success=None, on_error=None, **kwargs):
+        return self.submit(lambda: self.call(method, path, **kwargs), on_success=on_success, on_error=on_error)
+
+    def _deliver(self, future, on_success, on_error):
+        error = future.exception()
+        if error is not None:
+            if on_error:
+                on_error(error)
+            else:
+                logger.error("API call failed: %s", error)
+        elif on_success:
+            on_success(future.result())
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+
+class RemoteBackend:
+    """Till backend that talks to a server over HTTP; same interface as services.LocalBackend.
+
+    Methods block, so call them through ApiWorker.submit.
+    """
+
+    def __init__(self, api):
+        self.api = api
+
+    def products(self, etag=None):
+        headers = {"If-None-Match": etag} if etag else {}
+        params = {"limit": MAX_PAGE_SIZE}
+        products = []
+        while True:
+            response = self.api.call("GET", "/api/products", params=params, headers=headers)
+            if response.status_code == 304:
+                return None, etag
+            products.extend(response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+            params["after"] = cursor
+            headers = {}
+        return products, response.headers.get("ETag")
+
+    def search(self, query, limit=20):
+        return self.api.call("GET", "/api/products/search", params={"q": query, "limit": limit}).json()
+
+    def add_product(self, data):
+        return self.api.call("POST", "/api/products", json=data).json()
+
+    def update_product(self, id, data):
+        return self.api.call("PUT", f"/api/products/{id}", json=data).json()
+
+    def delete_product(self, id):
+        return self.api.call("DELETE", f"/api/products/{id}").json()
+
+    def get_cart(self, cart_id):
+        return self.api.call("GET", f"/api/carts/{cart_id}").json()
+
+    def add_to_cart(self, cart_id, barcode, quantity=1):
+        return self.api.call("POST", f"/api/carts/{cart_id}/items", json={"barcode": barcode, "quantity": quantity}).json()
+
+    def remove_from_cart(self, cart_id, barcode):
+        return self.api.call("DELETE", f"/api/carts/{cart_id}/items/{barcode}").json()
+
+    def discard_cart(self, cart_id):
+        self.api.call("DELETE", f"/api/carts/{cart_id}")
+
+    def checkout(self, items=None, cart_id=None):
+        return self.api.call("POST", "/api/transaction", json={"items": items, "cart_id": cart_id}).json()
+
+    def payment_qr(self, qr_url):
+        return self.api.call("GET", qr_url).content
+
+    def orders(self, limit=50, before=None):
+        params = {"limit": limit}
+        if before is not None:
+            params["before"] = before
+        response = self.api.call("GET", "/api/orders", params=params)
+        cursor = response.headers.get("X-Next-Cursor")
+        return response.json(), int(cursor) if cursor else None
+
+    def events(self, last_id=None):
+        headers = {"Accept": "text/event-stream"}
+        if last_id is not None:
+            headers["Last-Event-ID"] = str(last_id)
+        with self.api.call("GET", "/api/events", headers=headers, stream=True,
+                           timeout=(CONNECT_TIMEOUT, events.HEARTBEAT_SECONDS * 2)) as response:
+            yield from events.parse_sse(response.iter_lines(decode_unicode=True))
@@ -1,31 +1,48 @@
-import sqlite3
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 import logging
 import threading
 import tkinter as tk
 from tkinter import ttk, messagebox
-import requests
-import qrcode
 from io import BytesIO
-from base64 import b64encode, b64decode
 from PIL import Image, ImageTk
 from datetime import datetime
+import argparse
+import os
 import socket
+import time
+import uuid
+import db
+import events
+import cache
+import carts
+import payment_qr
+import promotions
+import analytics
+import catalog_io
+import services
+import server
+import metrics
+import logs
+import replication
+import reservations
+from profiler import profiler
+from virtual_table import VirtualTable
+from api_client import ApiWorker, RemoteBackend
 
 app = Flask(__name__)
 CORS(app)
+db.init_app(app)
+metrics.init_app(app)
 
-# Logging setup
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
-    logging.FileHandler("supermarket.log"),
-    logging.StreamHandler()
-])
+# Logging setup: queued, rotating, JSON file records tagged with the request id
+logs.configure()
+logs.init_app(app)
 logger = logging.getLogger(__name__)
 
 # Database setup
 def init_db():
-    conn = sqlite3.connect("supermarket.db", check_same_thread=False)
+    conn = db.get_db()
     c = conn.cursor()
     # Products table with additional fields
     c.execute('''
@@ -42,48 +59,162 @@ def init_db():
             stock INTEGER NOT NULL DEFAULT 0
         )
     ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
+    # One orders row per checkout, its lines in order_lines; timestamps are Unix epoch seconds
+    c.executescript('''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at INTEGER NOT NULL,
+            total REAL NOT NULL,
+            item_count INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS order_lines (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
             barcode TEXT NOT NULL,
             name TEXT NOT NULL,
             quantity INTEGER NOT NULL,
+            unit_price REAL NOT NULL,
             total REAL NOT NULL,
-            timestamp TEXT NOT NULL
-        )
+            created_at INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at);
+        CREATE INDEX IF NOT EXISTS idx_order_lines_order ON order_lines(order_id);
+        CREATE INDEX IF NOT EXISTS idx_order_lines_barcode ON order_lines(barcode, created_at);
+        CREATE INDEX IF NOT EXISTS idx_order_lines_created_at ON order_lines(created_at);
+    ''')
+    migrate_legacy_transactions(conn)
+    analytics.init_schema(conn)
+    if analytics.needs_backfill(conn):
+        analytics.rebuild(conn)
+        logger.info("Analytics rollups rebuilt from order history")
+    # Offline scanners tag each sale with a client-generated id so replays are recorded once
+    order_columns = [row[1] for row in c.execute("PRAGMA table_info(orders)")]
+    if "client_txn_id" not in order_columns:
+        c.execute("ALTER TABLE orders ADD COLUMN client_txn_id TEXT")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_client_txn ON orders(client_txn_id)")
+    # Catalog change tracking: every product write bumps a global version, stamped on the row
+    # (or on a tombstone for deletes), which backs ETags and updated_since deltas
+    columns = [row[1] for row in c.execute("PRAGMA table_info(products)")]
+    if "version" not in columns:
+        c.execute("ALTER TABLE products ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    c.executescript('''
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO catalog_version (id, value) VALUES (1, 0);
+        CREATE TABLE IF NOT EXISTS product_tombstones (
+            id INTEGER PRIMARY KEY,
+            barcode TEXT NOT NULL,
+            version INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_products_version ON products(version);
+        CREATE INDEX IF NOT EXISTS idx_products_type ON products(product_type);
+        CREATE INDEX IF NOT EXISTS idx_products_manufacturer ON products(manufacturer_code);
+        CREATE INDEX IF NOT EXISTS idx_products_name ON products(name);
+        CREATE INDEX IF NOT EXISTS idx_tombstones_version ON product_tombstones(version);
+        CREATE TRIGGER IF NOT EXISTS products_versioned_insert AFTER INSERT ON products BEGIN
+            UPDATE catalog_version SET value = value + 1 WHERE id = 1;
+            UPDATE products SET version = (SELECT value FROM catalog_version WHERE id = 1) WHERE id = NEW.id;
+            DELETE FROM product_tombstones WHERE barcode = NEW.barcode;
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_versioned_update
+        AFTER UPDATE OF barcode, product_type, manufacturer_code, product_code, name, buy_price, sell_price, discount, stock
+        ON products BEGIN
+            UPDATE catalog_version SET value = value + 1 WHERE id = 1;
+            UPDATE products SET version = (SELECT value FROM catalog_version WHERE id = 1) WHERE id = NEW.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_versioned_delete AFTER DELETE ON products BEGIN
+            UPDATE catalog_version SET value = value + 1 WHERE id = 1;
+            INSERT OR REPLACE INTO product_tombstones (id, barcode, version)
+            VALUES (OLD.id, OLD.barcode, (SELECT value FROM catalog_version WHERE id = 1));
+        END;
     ''')
-    conn.commit()
-    conn.close()
+    init_search_index(c)
+    replication.init_schema(conn)
+    reservations.init_schema(conn)
+    promotions.init_schema(conn)
+    db.release_db()
     logger.info("Database initialized")
 
-# Decode barcode (simple logic, extendable with GS1 lookup)
-def decode_barcode(barcode):
-    barcode = str(barcode).strip()
-    if len(barcode) == 13:  # EAN-13
-        prefix = barcode[:3]
-        manufacturer_code = barcode[3:7]
-        product_code = barcode[7:12]
-        product_type = "General" if prefix.startswith("50") else "Unknown"  # Example: UK prefix
-        name = f"Product {product_code}"  # Placeholder name
-    elif len(barcode) == 12:  # UPC-A
-        prefix = barcode[0]
-        manufacturer_code = barcode[1:6]
-        product_code = barcode[6:11]
-        product_type = "General" if prefix == "0" else "Unknown"
-        name = f"Item {product_code}"
-    else:
-        manufacturer_code = barcode[:len(barcode)//2]
-        product_code = barcode[len(barcode)//2:]
-        product_type = "Unknown"
-        name = f"Unknown {barcode}"
-    return {
-        "product_type": product_type,
-        "manufacturer_code": manufacturer_code,
-        "product_code": product_code,
-        "name": name,
-        "buy_price": 1.0,  # Default buy price (logic can be refined)
-        "stock": 10        # Default stock
-    }
+def init_search_index(c):
+    # FTS5 index over the searchable product columns, maintained by triggers so every write path
+    # (routes, till, bulk import, checkout) keeps it current; prefix indexes make type-ahead cheap
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone()
+    c.executescript('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, barcode, manufacturer_code, product_code,
+            content='products', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+        );
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name, barcode, manufacturer_code, product_code)
+            VALUES (NEW.id, NEW.name, NEW.barcode, NEW.manufacturer_code, NEW.product_code);
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, barcode, manufacturer_code, product_code)
+            VALUES ('delete', OLD.id, OLD.name, OLD.barcode, OLD.manufacturer_code, OLD.product_code);
+        END;
+        CREATE TRIGGER IF NOT EXISTS products_fts_update
+        AFTER UPDATE OF name, barcode, manufacturer_code, product_code ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, barcode, manufacturer_code, product_code)
+            VALUES ('delete', OLD.id, OLD.name, OLD.barcode, OLD.manufacturer_code, OLD.product_code);
+            INSERT INTO products_fts (rowid, name, barcode, manufacturer_code, product_code)
+            VALUES (NEW.id, NEW.name, NEW.barcode, NEW.manufacturer_code, NEW.product_code);
+        END;
+    ''')
+    if not exists:
+        c.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+        logger.info("Product search index built")
+
+def migrate_legacy_transactions(conn):
+    # Databases from before the orders schema kept one transactions row per line with a TEXT timestamp.
+    # Lines written by the same checkout share a timestamp, so each distinct timestamp becomes one order.
+    legacy = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transactions'").fetchone()
+    if not legacy:
+        return
+    with db.transaction(conn):
+        conn.execute('''
+            INSERT INTO orders (created_at, total, item_count)
+            SELECT CAST(strftime('%s', timestamp) AS INTEGER), SUM(total), SUM(quantity)
+            FROM transactions GROUP BY timestamp ORDER BY MIN(id)
+        ''')
+        conn.execute('''
+            INSERT INTO order_lines (order_id, barcode, name, quantity, unit_price, total, created_at)
+            SELECT o.id, t.barcode, t.name, t.quantity, t.total / MAX(t.quantity, 1), t.total, o.created_at
+            FROM transactions t JOIN orders o ON o.created_at = CAST(strftime('%s', t.timestamp) AS INTEGER)
+            ORDER BY t.id
+        ''')
+        conn.execute("ALTER TABLE transactions RENAME TO transactions_legacy")
+    logger.info("Migrated legacy transactions table to orders/order_lines")
+
+def warm_cache():
+    count = cache.products.warm(db.get_db())
+    db.release_db()
+    logger.info("Product cache warmed with %d products", count)
+
+def cache_metric(key):
+    return lambda: cache.products.stats()[key]
+
+metrics.callback("pos_product_cache_hits_total", "Barcode lookups served from the product cache", cache_metric("hits"), type="counter")
+metrics.callback("pos_product_cache_misses_total", "Barcode lookups that went to SQLite", cache_metric("misses"), type="counter")
+metrics.callback("pos_product_cache_evictions_total", "Products evicted from the cache", cache_metric("evictions"), type="counter")
+metrics.callback("pos_product_cache_hit_ratio", "Cache hits over lookups since start", cache_metric("hit_rate"))
+metrics.callback("pos_product_cache_size", "Products held in the cache", cache_metric("size"))
+metrics.callback("pos_db_connections", "Pooled SQLite connections by state",
+                 lambda: [(("open",), db.pool.stats()["open"]), (("idle",), db.pool.stats()["idle"])], labels=("state",))
+metrics.callback("pos_event_subscribers", "Open event streams", events.bus.subscriber_count)
+metrics.callback("pos_stock_reservations", "Carts holding stock, units held and units sold but not yet flushed",
+                 lambda: [((key,), value) for key, value in reservations.ledger.stats().items()], labels=("kind",))
+metrics.callback("pos_open_carts", "Server-side carts in memory", lambda: len(carts.store))
+metrics.callback("pos_qr_cached_renders", "Payment QR renders held in memory", payment_qr.cached_renders)
+
+LOW_STOCK_SUMMARY_ITEMS = 10
+SEARCH_DELAY_MS = 150  # typing pause before the inventory search runs
+INVENTORY_SEARCH_LIMIT = 200
+QR_WAIT_TIMEOUT = 10
+
+def service_error(e):
+    return jsonify({"error": str(e)}), e.status
 
 @app.route('/api/server-ip', methods=['GET'])
 def get_server_ip():
@@ -95,151 +226,395 @@ def get_server_ip():
         s.close()
         return jsonify({"ip": ip_address}), 200
     except Exception as e:
-        logger.error(f"Error detecting IP: {str(e)}")
+        logger.error("Error detecting IP: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/products', methods=['POST'])
 def add_product():
     try:
-        data = request.get_json()
-        if not data or 'barcode' not in data:
-            return jsonify({"error": "Barcode required"}), 400
-        barcode = data['barcode']
-        conn = sqlite3.connect("supermarket.db")
-        c = conn.cursor()
-        c.execute("SELECT * FROM products WHERE barcode = ?", (barcode,))
-        if c.fetchone():
-            conn.close()
-            return jsonify({"message": "Product exists"}), 409
-
-        # Decode barcode for initial data
-        decoded = decode_barcode(barcode)
-        name = data.get('name', decoded['name'])
-        buy_price = float(data.get('buy_price', decoded['buy_price']))
-        sell_price = float(data.get('sell_price', 5.0))  # Default to 0, user will set
-        discount = float(data.get('discount', 0.0))      # Default to 0
-        stock = int(data.get('stock', decoded['stock']))
-        
-        c.execute("""
-            INSERT INTO products (barcode, product_type, manufacturer_code, product_code, name, buy_price, sell_price, discount, stock)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (barcode, decoded['product_type'], decoded['manufacturer_code'], decoded['product_code'], name, buy_price, sell_price, discount, stock))
-        conn.commit()
-        conn.close()
-        logger.info(f"Added product: {barcode}")
-        return jsonify({"message": "Product added", "barcode": barcode}), 201
+        product = services.add_product(request.get_json())
+        return jsonify({"message": "Product added", "barcode": product['barcode']}), 201
+    except services.Conflict as e:
+        return jsonify({"message": str(e)}), 409
+    except services.ServiceError as e:
+        return service_error(e)
     except Exception as e:
-        logger.error(f"Error adding product: {str(e)}")
+        logger.error("Error adding product: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/products', methods=['GET'])
 def get_products():
+    # Keyset-paginated catalog listing. The next page cursor is returned in X-Next-Cursor and the
+    # catalog version in ETag, so unchanged catalogs answer 304 Not Modified.
+    try:
+        args = request.args
+        version = services.catalog_version()
+        etag = f"v{version}"
+        if request.if_none_match.contains(etag):
+            return "", 304, {"ETag": f'"{etag}"', "X-Catalog-Version": str(version)}
+
+        fields = [f.strip() for f in args['fields'].split(',') if f.strip()] if args.get('fields') else None
+        low_stock = None
+        if 'low_stock' in args:
+            low_stock = int(args['low_stock']) if args['low_stock'].isdigit() else services.LOW_STOCK_THRESHOLD
+        products, next_cursor = services.list_products(
+            fields=fields, limit=args.get('limit', services.DEFAULT_PAGE_SIZE, type=int),
+            after=args.get('after', type=int), updated_since=args.get('updated_since', type=int), low_stock=low_stock,
+            product_type=args.get('product_type'), manufacturer_code=args.get('manufacturer_code'),
+            name_prefix=args.get('name_prefix'))
+
+        response = jsonify(products)
+        response.set_etag(etag)
+        response.headers["X-Catalog-Version"] = str(version)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = str(next_cursor)
+        return response, 200
+    except services.ServiceError as e:
+        return service_error(e)
+    except Exception as e:
+        logger.error("Error fetching products: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/products/search', methods=['GET'])
+def search_products():
+    # Type-ahead search; every word of q prefix-matches name, barcode, manufacturer or product code
     try:
-        conn = sqlite3.connect("supermarket.db")
-        c = conn.cursor()
-        c.execute("SELECT * FROM products")
-        rows = c.fetchall()
-        conn.close()
-        keys = ["id", "barcode", "product_type", "manufacturer_code", "product_code", "name", "buy_price", "sell_price", "discount", "stock"]
-        return jsonify([dict(zip(keys, row)) for row in rows]), 200
+        args = request.args
+        fields = [f.strip() for f in args['fields'].split(',') if f.strip()] if args.get('fields') else None
+        products, next_cursor = services.search_products(args.get('q', ''), fields=fields,
+                                                         limit=args.get('limit', services.SEARCH_PAGE_SIZE, type=int),
+                                                         after=args.get('after', type=int))
+        response = jsonify(products)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = str(next_cursor)
+        return response, 200
+    except services.ServiceError as e:
+        return service_error(e)
     except Exception as e:
-        logger.error(f"Error fetching products: {str(e)}")
+        logger.error("Error searching products: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/products/<int:id>', methods=['PUT'])
 def update_product(id):
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "No data provided"}), 400
-        conn = sqlite3.connect("supermarket.db")
-        c = conn.cursor()
-        c.execute("""
-            UPDATE products SET name = ?, buy_price = ?, sell_price = ?, discount = ?, stock = ?
-            WHERE id = ?
-        """, (data['name'], float(data['buy_price']), float(data['sell_price']), float(data.get('discount', 0.0)), int(data['stock']), id))
-        if c.rowcount == 0:
-            conn.close()
-            return jsonify({"error": "Product not found"}), 404
-        conn.commit()
-        conn.close()
-        logger.info(f"Updated product ID: {id}")
+        services.update_product(id, request.get_json())
         return jsonify({"message": "Product updated"}), 200
+    except services.ServiceError as e:
+        return service_error(e)
     except Exception as e:
-        logger.error(f"Error updating product: {str(e)}")
+        logger.error("Error updating product: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/products/<int:id>', methods=['DELETE'])
 def delete_product(id):
     try:
-        conn = sqlite3.connect("supermarket.db")
-        c = conn.cursor()
-        c.execute("DELETE FROM products WHERE id = ?", (id,))
-        if c.rowcount == 0:
-            conn.close()
-            return jsonify({"error": "Product not found"}), 404
-        conn.commit()
-        conn.close()
-        logger.info(f"Deleted product ID: {id}")
+        services.delete_product(id)
         return jsonify({"message": "Product deleted"}), 200
+    except services.ServiceError as e:
+        return service_error(e)
     except Exception as e:
-        logger.error(f"Error deleting product: {str(e)}")
+        logger.error("Error deleting product: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/products/barcode/<barcode>', methods=['GET'])
 def get_product_by_barcode(barcode):
     try:
-        conn = sqlite3.connect("supermarket.db")
-        c = conn.cursor()
-        c.execute("SELECT * FROM products WHERE barcode = ?", (barcode,))
-        row = c.fetchone()
-        conn.close()
-        if row:
-            keys = ["id", "barcode", "product_type", "manufacturer_code", "product_code", "name", "buy_price", "sell_price", "discount", "stock"]
-            return jsonify(dict(zip(keys, row))), 200
-        return jsonify({"error": "Product not found"}), 404
+        return jsonify(services.get_product(barcode)), 200
+    except services.ServiceError as e:
+        return service_error(e)
+    except Exception as e:
+        logger.error("Error fetching product by barcode: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/products/import', methods=['POST'])
+def import_products():
+    # Streaming bulk upsert: send the file raw (text/csv, application/x-ndjson) or as multipart field "file"
+    try:
+        upload = request.files.get('file')
+        stream = upload.stream if upload else request.stream
+        fmt = catalog_io.detect_format(request.args.get('format'), upload.mimetype if upload else request.mimetype,
+                                       upload.filename if upload else None)
+        report = catalog_io.import_products(stream, fmt)
+        return jsonify(report), 200
+    except services.ServiceError as e:
+        return service_error(e)
     except Exception as e:
-        logger.error(f"Error fetching product by barcode: {str(e)}")
+        logger.error("Error importing products: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/products/export', methods=['GET'])
+def export_products():
+    try:
+        fmt = catalog_io.detect_format(request.args.get('format'), None)
+    except services.ServiceError as e:
+        return service_error(e)
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return Response(catalog_io.export_products(fmt), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=products.{fmt}"})
+
+@app.route('/api/products/barcodes', methods=['POST'])
+def get_products_by_barcodes():
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('barcodes'), list):
+            return jsonify({"error": "Barcodes list required"}), 400
+        results, not_found = services.get_products_by_barcodes(data['barcodes'])
+        return jsonify({"results": results, "not_found": not_found}), 200
+    except services.ServiceError as e:
+        return service_error(e)
+    except Exception as e:
+        logger.error("Error fetching products by barcodes: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/transaction', methods=['POST'])
 def record_transaction():
     try:
         data = request.get_json()
-        if not data or 'items' not in data:
+        if not data or ('items' not in data and 'cart_id' not in data):
+            return jsonify({"error": "Items or cart_id required"}), 400
+        result = services.record_transaction(data.get('items'), data.get('client_txn_id'), data.get('cart_id'))
+        return jsonify({"message": "Transaction recorded", "total": result['total'], "transaction_id": result['transaction_id'],
+                        "qr_url": f"/api/qr/{result['qr_token']}"}), 200 if result['replayed'] else 201
+    except services.ServiceError as e:
+        return service_error(e)
+    except Exception as e:
+        logger.error("Error recording transaction: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/carts', methods=['POST'])
+def create_cart():
+    try:
+        data = request.get_json(silent=True) or {}
+        return jsonify(services.create_cart(data.get('cart_id'))), 201
+    except services.ServiceError as e:
+        return service_error(e)
+
+@app.route('/api/carts/<cart_id>', methods=['GET'])
+def get_cart(cart_id):
+    try:
+        return jsonify(services.get_cart(cart_id)), 200
+    except services.ServiceError as e:
+        return service_error(e)
+
+@app.route('/api/carts/<cart_id>/items', methods=['POST'])
+def add_cart_item(cart_id):
+    # Scan into a cart: {"barcode": ..., "quantity": 1}; returns only the changed line and the new totals
+    try:
+        data = request.get_json()
+        if not data or not data.get('barcode'):
+            return jsonify({"error": "Barcode required"}), 400
+        return jsonify(services.add_to_cart(cart_id, data['barcode'], data.get('quantity', 1))), 200
+    except services.ServiceError as e:
+        return service_error(e)
+    except Exception as e:
+        logger.error("Error adding to cart: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/carts/<cart_id>/items/<barcode>', methods=['DELETE'])
+def remove_cart_item(cart_id, barcode):
+    try:
+        return jsonify(services.remove_from_cart(cart_id, barcode)), 200
+    except services.ServiceError as e:
+        return service_error(e)
+    except Exception as e:
+        logger.error("Error removing from cart: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/carts/<cart_id>', methods=['DELETE'])
+def discard_cart(cart_id):
+    try:
+        services.discard_cart(cart_id)
+        return jsonify({"message": "Cart cleared"}), 200
+    except services.ServiceError as e:
+        return service_error(e)
+
+@app.route('/api/reservations/<cart_id>', methods=['PUT'])
+def reserve_stock(cart_id):
+    # Set the cart's holds: {"items": [{"barcode": ..., "quantity": n}]}, quantity 0 releases
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('items'), list):
             return jsonify({"error": "Items required"}), 400
-        conn = sqlite3.connect("supermarket.db")
-        c = conn.cursor()
-        total = 0
-        for item in data['items']:
-            barcode = item['barcode']
-            quantity = int(item['quantity'])
-            c.execute("SELECT name, sell_price, discount, stock FROM products WHERE barcode = ?", (barcode,))
-            row = c.fetchone()
-            if not row or row[3] < quantity:
-                conn.close()
-                return jsonify({"error": f"Insufficient stock or invalid product: {barcode}"}), 400
-            name, sell_price, discount, stock = row
-            discounted_price = sell_price * (1 - discount / 100)  # Apply discount as percentage
-            total += discounted_price * quantity
-            c.execute("UPDATE products SET stock = stock - ? WHERE barcode = ?", (quantity, barcode))
-            c.execute("INSERT INTO transactions (barcode, name, quantity, total, timestamp) VALUES (?, ?, ?, ?, datetime('now'))",
-                      (barcode, name, quantity, discounted_price * quantity))
-        conn.commit()
-        conn.close()
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(f"Payment: ${total:.2f}|TransactionID:{c.lastrowid}")
-        qr.make(fit=True)
-        img = qr.make_image(fill='black', back_color='white')
-        buffer = BytesIO()
-        img.save(buffer, format="PNG")
-        qr_base64 = b64encode(buffer.getvalue()).decode('utf-8')
-        logger.info(f"Transaction recorded, total: ${total:.2f}")
-        return jsonify({"message": "Transaction recorded", "total": total, "qr_code": qr_base64}), 201
+        items = {item['barcode']: item['quantity'] for item in data['items']}
+        return jsonify(services.reserve(cart_id, items)), 200
+    except services.ServiceError as e:
+        return service_error(e)
+    except (KeyError, TypeError):
+        return jsonify({"error": "Each item needs a barcode and quantity"}), 400
+    except Exception as e:
+        logger.error("Error reserving stock: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/reservations/<cart_id>', methods=['GET'])
+def get_reservation(cart_id):
+    return jsonify({"cart_id": cart_id, "holds": reservations.ledger.holds(cart_id)}), 200
+
+@app.route('/api/reservations/<cart_id>', methods=['DELETE'])
+def release_reservation(cart_id):
+    services.release_cart(cart_id)
+    return jsonify({"message": "Reservation released"}), 200
+
+@app.route('/api/promotions', methods=['GET'])
+def list_promotions():
+    return jsonify(services.list_promotions()), 200
+
+@app.route('/api/promotions', methods=['POST'])
+def add_promotions():
+    # One promotion object, or a list of them created all or nothing
+    try:
+        return jsonify(services.add_promotions(request.get_json())), 201
+    except services.ServiceError as e:
+        return service_error(e)
+    except Exception as e:
+        logger.error("Error adding promotions: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/promotions/<int:id>', methods=['PUT'])
+def update_promotion(id):
+    try:
+        return jsonify(services.update_promotion(id, request.get_json())), 200
+    except services.ServiceError as e:
+        return service_error(e)
+    except Exception as e:
+        logger.error("Error updating promotion: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/promotions/<int:id>', methods=['DELETE'])
+def delete_promotion(id):
+    try:
+        services.delete_promotion(id)
+        return jsonify({"message": "Promotion deleted"}), 200
+    except services.ServiceError as e:
+        return service_error(e)
+
+@app.route('/api/orders', methods=['GET'])
+def get_orders():
+    # Newest first, keyset-paginated on order id; pass X-Next-Cursor back as ?before= for older orders
+    try:
+        args = request.args
+        orders, next_cursor = services.list_orders(args.get('limit', services.HISTORY_PAGE_SIZE, type=int),
+                                                   before=args.get('before', type=int),
+                                                   since=args.get('since', type=int), until=args.get('until', type=int))
+        response = jsonify(orders)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = str(next_cursor)
+        return response, 200
+    except services.ServiceError as e:
+        return service_error(e)
+    except Exception as e:
+        logger.error("Error fetching orders: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/orders/<int:id>', methods=['GET'])
+def get_order(id):
+    try:
+        return jsonify(services.get_order(id)), 200
+    except services.ServiceError as e:
+        return service_error(e)
+    except Exception as e:
+        logger.error("Error fetching order: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/analytics/top-sellers', methods=['GET'])
+def get_top_sellers():
+    try:
+        by = request.args.get('by', 'units')
+        if by not in analytics.TOP_SELLER_ORDER:
+            return jsonify({"error": f"by must be one of: {', '.join(analytics.TOP_SELLER_ORDER)}"}), 400
+        limit = min(request.args.get('limit', 10, type=int), services.MAX_HISTORY_PAGE_SIZE)
+        return jsonify(analytics.top_sellers(db.get_db(), limit, by)), 200
+    except Exception as e:
+        logger.error("Error fetching top sellers: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/analytics/revenue', methods=['GET'])
+def get_revenue():
+    try:
+        period = request.args.get('period', 'day')
+        if period not in analytics.PERIODS:
+            return jsonify({"error": f"period must be one of: {', '.join(analytics.PERIODS)}"}), 400
+        return jsonify(analytics.revenue_by_period(db.get_db(), period, since=request.args.get('since', type=int),
+                                                   until=request.args.get('until', type=int))), 200
     except Exception as e:
-        logger.error(f"Error recording transaction: {str(e)}")
+        logger.error("Error fetching revenue: %s", e)
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/analytics/margin', methods=['GET'])
+def get_margin():
+    try:
+        return jsonify(analytics.margin_by_manufacturer(db.get_db(), request.args.get('manufacturer_code'))), 200
+    except Exception as e:
+        logger.error("Error fetching margin: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/qr/<token>', methods=['GET'])
+def get_payment_qr(token):
+    try:
+        payload = payment_qr.payload_for(token)
+    except ValueError:
+        return jsonify({"error": "Invalid QR token"}), 400
+    try:
+        if request.args.get('format') == 'svg':
+            body, mimetype = payment_qr.render_svg(payload), "image/svg+xml"
+        else:
+            body, mimetype = payment_qr.get_png(payload, timeout=QR_WAIT_TIMEOUT), "image/png"
+        return Response(body, mimetype=mimetype, headers={"Cache-Control": "private, max-age=86400, immutable"})
+    except Exception as e:
+        logger.error("Error rendering payment QR: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(cache.products.stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/api/profiler', methods=['GET'])
+def get_profile():
+    # Collapsed stacks for flamegraph.pl/speedscope; ?format=json for the profiler's status
+    if request.args.get('format') == 'json':
+        return jsonify(profiler.status()), 200
+    return Response(profiler.collapsed(request.args.get('limit', type=int)), mimetype="text/plain")
+
+@app.route('/api/profiler/start', methods=['POST'])
+def start_profiler():
+    data = request.get_json(silent=True) or {}
+    try:
+        interval_ms = float(data.get('interval_ms', profiler.interval * 1000))
+        duration = float(data['duration']) if data.get('duration') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "interval_ms and duration must be numbers"}), 400
+    if not profiler.start(interval_ms / 1000, duration):
+        return jsonify({"error": "Profiler already running"}), 409
+    return jsonify(profiler.status()), 200
+
+@app.route('/api/profiler/stop', methods=['POST'])
+def stop_profiler():
+    profiler.stop()
+    return jsonify(profiler.status()), 200
+
+@app.route('/api/sync/changes', methods=['GET'])
+def get_sync_changes():
+    # NDJSON change log after ?since=<seq>, for followers; X-Log-Head tells them how far behind they are
+    since = request.args.get('since', 0, type=int)
+    limit = min(max(request.args.get('limit', replication.CHANGES_PAGE, type=int), 1), replication.CHANGES_PAGE)
+    conn = db.get_db()
+    headers = {"X-Node-Id": replication.node_id(conn), "X-Log-Head": str(replication.head(conn))}
+    return Response(replication.stream_changes(since, limit), mimetype="application/x-ndjson", headers=headers)
+
+@app.route('/api/sync/status', methods=['GET'])
+def get_sync_status():
+    return jsonify(replication.status(db.get_db())), 200
+
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    last_id = int(last_id) if last_id and last_id.isdigit() else None
+    return Response(stream_with_context(events.bus.stream(last_id)), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route('/')
 def serve_scanner():
     return send_from_directory('static', 'scanner.html')
@@ -283,24 +658,46 @@ class SupermarketPOS:
                                    relief="sunken", anchor="w", padx=10)
         self.status_bar.pack(fill="x", pady=5)
 
+        # The till shares this process with the server, so it calls the service layer directly unless
+        # pointed at a remote server; either way blocking calls run on the worker pool, off the Tk thread
+        self.api = ApiWorker(self.root, API_BASE_URL)
+        self.backend = RemoteBackend(self.api) if REMOTE_API else services.LocalBackend()
+        self.products_etag = None
+        self.checkout_pending = False
+        self.cart_id = uuid.uuid4().hex[:12]  # phones scan into the till's cart with /?cart=<id>
         self.create_inventory_tab()
         self.create_checkout_tab()
         self.create_history_tab()
 
-        self.cart = []
+        self.cart = {}  # barcode -> line, mirrored from the server-side cart
+        self.cart_version = 0
         self.processed_barcodes = set()
         self.is_polling = True
-        self.start_polling()
+        self.last_event_id = None
+        self.start_event_listener()
 
     def create_inventory_tab(self):
         frame = tk.Frame(self.inventory_tab, bg="#ffffff")
         frame.pack(fill="both", expand=True, padx=10, pady=10)
 
-        self.inv_tree = ttk.Treeview(frame, columns=("ID", "Barcode", "Name", "Buy Price", "Sell Price", "Discount", "Stock"), show="headings")
-        for col in ("ID", "Barcode", "Name", "Buy Price", "Sell Price", "Discount", "Stock"):
-            self.inv_tree.heading(col, text=col)
-            self.inv_tree.column(col, width=100 if col == "ID" else 150)
-        self.inv_tree.pack(fill="both", expand=True)
+        search_frame = tk.Frame(frame, bg="#ffffff")
+        search_frame.pack(fill="x", pady=(0, 5))
+        tk.Label(search_frame, text="Search:", font=("Arial", 11), bg="#ffffff", fg="#212529").pack(side="left")
+        self.search_var = tk.StringVar()
+        tk.Entry(search_frame, textvariable=self.search_var, font=("Arial", 11), width=40).pack(side="left", padx=5)
+        self.search_var.trace_add("write", lambda *args: self.schedule_search())
+        self.search_job = None
+        self.search_seq = 0
+        self.inventory_rows = []
+
+        self.inv_table = VirtualTable(frame, ("ID", "Barcode", "Name", "Buy Price", "Sell Price", "Discount", "Stock"), widths={"ID": 100})
+        self.inv_table.pack(fill="both", expand=True)
+
+        # Low-stock items are summarized here instead of one blocking popup per product
+        self.low_stock_var = tk.StringVar(value="")
+        self.low_stock_label = tk.Label(frame, textvariable=self.low_stock_var, font=("Arial", 11), bg="#ffffff", fg="#dc3545",
+                                        anchor="w", justify="left", wraplength=1100)
+        self.low_stock_label.pack(fill="x", pady=(5, 0))
 
         button_frame = tk.Frame(frame, bg="#ffffff")
         button_frame.pack(pady=10)
@@ -316,16 +713,14 @@ class SupermarketPOS:
 
         tk.Label(frame, text="Checkout", font=("Arial", 20, "bold"), fg="#007bff", bg="#ffffff").pack(pady=5)
 
-        self.cart_tree = ttk.Treeview(frame, columns=("Barcode", "Name", "Price", "Discount", "Quantity", "Subtotal"), show="headings")
-        for col in ("Barcode", "Name", "Price", "Discount", "Quantity", "Subtotal"):
-            self.cart_tree.heading(col, text=col)
-            self.cart_tree.column(col, width=150)
-        self.cart_tree.pack(fill="both", expand=True)
+        self.cart_table = VirtualTable(frame, ("Barcode", "Name", "Price", "Discount", "Quantity", "Subtotal"))
+        self.cart_table.pack(fill="both", expand=True)
 
         total_frame = tk.Frame(frame, bg="#ffffff")
         total_frame.pack(fill="x", pady=10)
         self.total_var = tk.StringVar(value="Total: $0.00")
         tk.Label(total_frame, textvariable=self.total_var, font=("Arial", 16, "bold"), fg="#212529", bg="#ffffff").pack(side="left", padx=10)
+        tk.Label(total_frame, text=f"Cart {self.cart_id}", font=("Arial", 11), fg="#6c757d", bg="#ffffff").pack(side="right", padx=10)
 
         button_frame = tk.Frame(frame, bg="#ffffff")
         button_frame.pack(pady=10)
@@ -337,59 +732,116 @@ class SupermarketPOS:
         frame = tk.Frame(self.history_tab, bg="#ffffff")
         frame.pack(fill="both", expand=True, padx=10, pady=10)
 
-        self.hist_tree = ttk.Treeview(frame, columns=("ID", "Barcode", "Name", "Quantity", "Total", "Timestamp"), show="headings")
-        for col in ("ID", "Barcode", "Name", "Quantity", "Total", "Timestamp"):
-            self.hist_tree.heading(col, text=col)
-            self.hist_tree.column(col, width=100 if col == "ID" else 150)
-        self.hist_tree.pack(fill="both", expand=True)
+        self.hist_table = VirtualTable(frame, ("Order", "Barcode", "Name", "Quantity", "Total", "Timestamp"), widths={"Order": 100})
+        self.hist_table.pack(fill="both", expand=True)
 
-        tk.Button(frame, text="Refresh", command=self.refresh_history, bg="#007bff", fg="white", font=("Arial", 11)).pack(pady=10)
+        button_frame = tk.Frame(frame, bg="#ffffff")
+        button_frame.pack(pady=10)
+        tk.Button(button_frame, text="Refresh", command=self.refresh_history, bg="#007bff", fg="white", font=("Arial", 11)).pack(side="left", padx=5)
+        tk.Button(button_frame, text="Load Older", command=self.load_older_history, bg="#6c757d", fg="white", font=("Arial", 11)).pack(side="left", padx=5)
+        self.history_cursor = None
 
         self.refresh_history()
 
     def refresh_products(self):
-        try:
-            for item in self.inv_tree.get_children():
-                self.inv_tree.delete(item)
-            response = requests.get("https://127.0.0.1:5000/api/products", verify=False)
-            if response.status_code == 200:
-                for product in response.json():
-                    self.inv_tree.insert("", "end", values=(product["id"], product["barcode"], product["name"],
-                                                            product["buy_price"], product["sell_price"], 
-                                                            product["discount"], product["stock"]))
-                    if product["stock"] < 5:
-                        messagebox.showwarning("Low Stock", f"{product['name']} has only {product['stock']} items left!")
+        self.api.submit(self.backend.products, self.products_etag, on_success=self.show_products,
+                        on_error=lambda e: self.show_error(e, "Error refreshing products", popup=False))
+
+    def show_products(self, result):
+        products, etag = result
+        if products is not None:
+            self.products_etag = etag
+            self.inventory_rows = [self.inventory_row(product) for product in products]
+            if self.search_var.get().strip():
+                self.run_search()
+            else:
+                self.inv_table.set_rows(self.inventory_rows)
+            low_stock = [p for p in products if p["stock"] < services.LOW_STOCK_THRESHOLD]
+            self.show_low_stock(low_stock)
+        self.status_var.set("Inventory refreshed")
+        self.status_bar.config(bg="#28a745", fg="white")
+
+    @staticmethod
+    def inventory_row(product):
+        return (product["id"], (product["id"], product["barcode"], product["name"], product["buy_price"],
+                                product["sell_price"], product["discount"], product["stock"]))
+
+    def schedule_search(self):
+        # Debounced so a burst of keystrokes sends one query
+        if self.search_job is not None:
+            self.root.after_cancel(self.search_job)
+        self.search_job = self.root.after(SEARCH_DELAY_MS, self.run_search)
+
+    def run_search(self):
+        self.search_job = None
+        self.search_seq += 1
+        seq = self.search_seq
+        query = self.search_var.get().strip()
+        if not query:
+            self.inv_table.set_rows(self.inventory_rows)
             self.status_var.set("Inventory refreshed")
+            return
+
+        def found(products):
+            if seq != self.search_seq:
+                return  # A newer query is in flight
+            self.inv_table.set_rows(self.inventory_row(product) for product in products)
+            self.status_var.set(f"{len(products)} products match '{query}'")
             self.status_bar.config(bg="#28a745", fg="white")
-        except Exception as e:
-            logger.error(f"Error refreshing products: {str(e)}")
-            self.status_var.set(f"Error: {str(e)}")
-            self.status_bar.config(bg="#dc3545", fg="white")
+
+        self.api.submit(self.backend.search, query, INVENTORY_SEARCH_LIMIT, on_success=found,
+                        on_error=lambda e: self.show_error(e, "Error searching products", popup=False))
+
+    def show_error(self, error, prefix="Error", popup=True):
+        logger.error("%s: %s", prefix, error)
+        if popup:
+            messagebox.showerror("Error", str(error))
+        self.status_var.set(f"{prefix}: {str(error)}")
+        self.status_bar.config(bg="#dc3545", fg="white")
+
+    def show_low_stock(self, products):
+        if not products:
+            self.low_stock_var.set("")
+            return
+        shown = ", ".join(f"{p['name']} ({p['stock']})" for p in products[:LOW_STOCK_SUMMARY_ITEMS])
+        more = f" and {len(products) - LOW_STOCK_SUMMARY_ITEMS} more" if len(products) > LOW_STOCK_SUMMARY_ITEMS else ""
+        self.low_stock_var.set(f"Low stock ({len(products)}): {shown}{more}")
 
     def refresh_history(self):
-        try:
-            for item in self.hist_tree.get_children():
-                self.hist_tree.delete(item)
-            conn = sqlite3.connect("supermarket.db")
-            c = conn.cursor()
-            c.execute("SELECT * FROM transactions ORDER BY timestamp DESC")
-            for row in c.fetchall():
-                self.hist_tree.insert("", "end", values=row)
-            conn.close()
+        self.history_cursor = None
+        self.load_history_page(replace=True)
+
+    def load_older_history(self):
+        if self.history_cursor is None:
+            self.status_var.set("No older transactions")
+            return
+        self.load_history_page()
+
+    def load_history_page(self, replace=False):
+        def loaded(result):
+            orders, self.history_cursor = result
+            rows = []
+            for order in orders:
+                timestamp = datetime.fromtimestamp(order['created_at']).strftime("%Y-%m-%d %H:%M:%S")
+                for i, line in enumerate(order['lines']):
+                    rows.append(((order['id'], i), (order['id'], line['barcode'], line['name'], line['quantity'],
+                                                    f"{line['total']:.2f}", timestamp)))
+            if replace:
+                self.hist_table.set_rows(rows)
+            else:
+                self.hist_table.append_rows(rows)
             self.status_var.set("History refreshed")
             self.status_bar.config(bg="#28a745", fg="white")
-        except Exception as e:
-            logger.error(f"Error refreshing history: {str(e)}")
-            self.status_var.set(f"Error: {str(e)}")
-            self.status_bar.config(bg="#dc3545", fg="white")
+
+        self.api.submit(self.backend.orders, services.HISTORY_PAGE_SIZE, self.history_cursor, on_success=loaded,
+                        on_error=lambda e: self.show_error(e, "Error loading history", popup=False))
 
     def update_product(self):
-        selected = self.inv_tree.selection()
-        if not selected:
+        id = self.inv_table.selected_key()
+        if id is None:
             messagebox.showwarning("Warning", "Select a product to update.")
             return
-        item = self.inv_tree.item(selected[0])["values"]
-        id = item[0]
+        item = self.inv_table.values[id]
 
         popup = tk.Toplevel(self.root)
         popup.title("Update Product")
@@ -413,75 +865,85 @@ class SupermarketPOS:
                     "discount": float(entries["Discount (%)"].get() or 0),
                     "stock": int(entries["Stock"].get())
                 }
-                response = requests.put(f"https://127.0.0.1:5000/api/products/{id}", json=data, verify=False)
-                response.raise_for_status()
+            except ValueError as e:
+                self.show_error(e)
+                return
+
+            def saved(response):
                 messagebox.showinfo("Success", "Product updated!")
                 self.refresh_products()
                 popup.destroy()
                 self.status_var.set("Product updated")
                 self.status_bar.config(bg="#28a745", fg="white")
-            except Exception as e:
-                messagebox.showerror("Error", str(e))
-                self.status_var.set(f"Error: {str(e)}")
-                self.status_bar.config(bg="#dc3545", fg="white")
+
+            self.api.submit(self.backend.update_product, id, data, on_success=saved, on_error=self.show_error)
 
         tk.Button(popup, text="Save", command=save, bg="#007bff", fg="white", font=("Arial", 11)).grid(row=5, column=0, columnspan=2, pady=10)
 
     def delete_product(self):
-        selected = self.inv_tree.selection()
-        if not selected:
+        id = self.inv_table.selected_key()
+        if id is None:
             messagebox.showwarning("Warning", "Select a product to delete.")
             return
-        item = self.inv_tree.item(selected[0])["values"]
-        id = item[0]
+        item = self.inv_table.values[id]
+
+        def deleted(response):
+            messagebox.showinfo("Success", "Product deleted!")
+            self.refresh_products()
+            self.status_var.set("Product deleted")
+            self.status_bar.config(bg="#28a745", fg="white")
 
         if messagebox.askyesno("Confirm", f"Delete '{item[1]}'?"):
-            try:
-                response = requests.delete(f"https://127.0.0.1:5000/api/products/{id}", verify=False)
-                response.raise_for_status()
-                messagebox.showinfo("Success", "Product deleted!")
-                self.refresh_products()
-                self.status_var.set("Product deleted")
-                self.status_bar.config(bg="#28a745", fg="white")
-            except Exception as e:
-                messagebox.showerror("Error", str(e))
-                self.status_var.set(f"Error: {str(e)}")
-                self.status_bar.config(bg="#dc3545", fg="white")
-
-    def start_polling(self):
-        def poll():
-            if not self.is_polling:
-                self.root.after(1000, poll)
-                return
-            try:
-                response = requests.get("https://127.0.0.1:5000/api/products", timeout=2, verify=False)
-                if response.status_code == 200:
-                    products = response.json()
-                    if products:
-                        latest_product = products[-1]
-                        barcode = latest_product["barcode"]
-                        if barcode not in self.processed_barcodes and barcode not in [item["barcode"] for item in self.cart]:
-                            product_response = requests.get(f"https://127.0.0.1:5000/api/products/barcode/{barcode}", verify=False)
-                            if product_response.status_code == 200:
-                                product = product_response.json()
-                                if product["sell_price"] == 0.0:  # New product needing price
-                                    self.processed_barcodes.add(barcode)
-                                    self.show_product_details_popup(barcode)
-                                else:
-                                    self.add_to_cart(product)
-                                    self.status_var.set(f"Added {product['name']} to cart")
-                                    self.status_bar.config(bg="#28a745", fg="white")
-                                    self.processed_barcodes.add(barcode)
-            except Exception as e:
-                logger.error(f"Polling error: {str(e)}")
-                self.status_var.set(f"Polling error: {str(e)}")
-                self.status_bar.config(bg="#dc3545", fg="white")
-            self.root.after(1000, poll)
-        self.root.after(1000, poll)
+            self.api.submit(self.backend.delete_product, id, on_success=deleted, on_error=self.show_error)
+
+    def start_event_listener(self):
+        # Product events come from the in-process bus (or SSE for a remote server); the reader thread
+        # hands each one to the Tk loop
+        def listen():
+            while True:
+                try:
+                    for event in self.backend.events(self.last_event_id):
+                        self.last_event_id = event["id"]
+                        self.root.after(0, self.handle_event, event)
+                except Exception as e:
+                    logger.error("Event stream error: %s", e)
+                time.sleep(2)
+        threading.Thread(target=listen, daemon=True).start()
+
+    def handle_event(self, event):
+        if event["type"].startswith("cart."):
+            if event["data"]["cart_id"] == self.cart_id:
+                self.handle_cart_event(event)
+            return
+        if event["type"] != "product.created":
+            return
+        if not self.is_polling:
+            self.root.after(500, self.handle_event, event)  # Retry once the details popup is closed
+            return
+        product = event["data"]
+        barcode = product["barcode"]
+        if barcode in self.processed_barcodes or barcode in self.cart:
+            return
+        self.processed_barcodes.add(barcode)
+        if product["sell_price"] == 0.0:  # New product needing price
+            self.show_product_details_popup(barcode)
+        else:
+            self.add_to_cart(product)
+            self.status_var.set(f"Added {product['name']} to cart")
+            self.status_bar.config(bg="#28a745", fg="white")
+
+    def handle_cart_event(self, event):
+        # Scans from phones sharing this cart, and echoes of the till's own changes
+        if event["type"] == "cart.updated":
+            self.apply_cart_change(event["data"])
+        elif event["type"] == "cart.checked_out":
+            self.show_cart(event["data"])
+        elif event["type"] == "cart.cleared":
+            self.show_cart({"lines": [], "subtotal": 0.0, "version": 0})
 
     def show_product_details_popup(self, barcode):
         self.is_polling = False
-        decoded = decode_barcode(barcode)
+        decoded = services.decode_barcode(barcode)
         popup = tk.Toplevel(self.root)
         popup.title("Add Product Details")
         popup.geometry("400x400")
@@ -505,6 +967,19 @@ class SupermarketPOS:
             entries[label].grid(row=i, column=1, padx=10, pady=5)
             entries[label].insert(0, default)
 
+        def failed(error):
+            messagebox.showerror("Error", str(error))
+            self.is_polling = True
+
+        def saved(response, data):
+            messagebox.showinfo("Success", "Product saved!")
+            self.refresh_products()
+            self.add_to_cart(data)
+            popup.destroy()
+            self.is_polling = True
+            self.status_var.set("Product added")
+            self.status_bar.config(bg="#28a745", fg="white")
+
         def save():
             try:
                 sell_price = float(entries["Sell Price"].get())
@@ -521,108 +996,159 @@ class SupermarketPOS:
                     "discount": float(entries["Discount (%)"].get() or 0),
                     "stock": int(entries["Stock"].get())
                 }
-                response = requests.post("https://127.0.0.1:5000/api/products", json=data, verify=False)
-                response.raise_for_status()
-                messagebox.showinfo("Success", "Product saved!")
-                self.refresh_products()
-                self.add_to_cart(data)
-                popup.destroy()
-                self.is_polling = True
-                self.status_var.set("Product added")
-                self.status_bar.config(bg="#28a745", fg="white")
-            except Exception as e:
-                messagebox.showerror("Error", str(e))
-                self.is_polling = True
+            except ValueError as e:
+                failed(e)
+                return
+            self.api.submit(self.backend.add_product, data, on_success=lambda product: saved(product, data), on_error=failed)
 
         tk.Button(popup, text="Save", command=save, bg="#007bff", fg="white", font=("Arial", 11)).grid(row=9, column=0, columnspan=2, pady=10)
         popup.protocol("WM_DELETE_WINDOW", lambda: [popup.destroy(), setattr(self, 'is_polling', True)])
 
     def add_to_cart(self, product):
-        for item in self.cart:
-            if item["barcode"] == product["barcode"]:
-                item["quantity"] += 1
-                self.update_cart_display()
-                return
-        self.cart.append({
-            "barcode": product["barcode"],
-            "name": product["name"],
-            "price": product["sell_price"],
-            "discount": product["discount"],
-            "quantity": 1
-        })
-        self.update_cart_display()
-
-    def update_cart_display(self):
-        for item in self.cart_tree.get_children():
-            self.cart_tree.delete(item)
-        total = 0
-        for item in self.cart:
-            discounted_price = item["price"] * (1 - item["discount"] / 100)
-            subtotal = discounted_price * item["quantity"]
-            total += subtotal
-            self.cart_tree.insert("", "end", values=(item["barcode"], item["name"], item["price"], item["discount"], item["quantity"], f"{subtotal:.2f}"))
-        self.total_var.set(f"Total: ${total:.2f}")
+        # The server prices the line and holds the stock; only the changed line comes back
+        self.api.submit(self.backend.add_to_cart, self.cart_id, product["barcode"], on_success=self.apply_cart_change,
+                        on_error=lambda e: self.show_error(e, f"Could not add {product['name']}", popup=False))
+
+    @staticmethod
+    def cart_row(line):
+        return (line["barcode"], line["name"], line["price"], line["discount"], line["quantity"], f"{line['total']:.2f}")
+
+    def apply_cart_change(self, change):
+        if change["version"] <= self.cart_version:
+            return
+        self.cart_version = change["version"]
+        line = change["line"]
+        if line["quantity"] > 0:
+            self.cart[line["barcode"]] = line
+            self.cart_table.upsert(line["barcode"], self.cart_row(line))
+        else:
+            self.cart.pop(line["barcode"], None)
+            self.cart_table.remove(line["barcode"])
+        for other in change.get("repriced", ()):  # lines a bundle promotion ties to this one
+            self.cart[other["barcode"]] = other
+            self.cart_table.upsert(other["barcode"], self.cart_row(other))
+        self.total_var.set(f"Total: ${change['subtotal']:.2f}")
+
+    def show_cart(self, cart):
+        # An empty cart (cleared or checked out) always applies; a snapshot older than what is shown does not
+        if cart["lines"] and cart["version"] < self.cart_version:
+            return
+        self.cart_version = max(self.cart_version, cart["version"])
+        self.cart = {line["barcode"]: line for line in cart["lines"]}
+        self.cart_table.set_rows((barcode, self.cart_row(line)) for barcode, line in self.cart.items())
+        self.total_var.set(f"Total: ${cart['subtotal']:.2f}")
+
+    def refresh_cart(self):
+        empty = {"lines": [], "subtotal": 0.0, "version": 0}
+        self.api.submit(self.backend.get_cart, self.cart_id, on_success=self.show_cart, on_error=lambda e: self.show_cart(empty))
 
     def remove_cart_item(self, event=None):
-        selected = self.cart_tree.selection()
-        if not selected:
+        barcode = self.cart_table.selected_key()
+        if barcode is None or barcode not in self.cart:
             messagebox.showwarning("Warning", "Select an item to remove.")
             return
-        item = self.cart_tree.item(selected[0])["values"]
-        barcode = item[0]
-        self.cart = [i for i in self.cart if i["barcode"] != barcode]
-        self.update_cart_display()
-        self.status_var.set(f"Removed {item[1]} from cart")
-        self.status_bar.config(bg="#ffc107", fg="#212529")
+        name = self.cart[barcode]["name"]
+
+        def removed(change):
+            self.apply_cart_change(change)
+            self.status_var.set(f"Removed {name} from cart")
+            self.status_bar.config(bg="#ffc107", fg="#212529")
+
+        self.api.submit(self.backend.remove_from_cart, self.cart_id, barcode, on_success=removed,
+                        on_error=lambda e: self.show_error(e, "Remove error"))
 
     def clear_cart(self):
-        self.cart = []
-        self.update_cart_display()
-        self.status_var.set("Cart cleared")
-        self.status_bar.config(bg="#ffc107", fg="#212529")
+        def cleared(_):
+            self.show_cart({"lines": [], "subtotal": 0.0, "version": 0})
+            self.status_var.set("Cart cleared")
+            self.status_bar.config(bg="#ffc107", fg="#212529")
+
+        self.api.submit(self.backend.discard_cart, self.cart_id, on_success=cleared,
+                        on_error=lambda e: self.show_error(e, "Clear error"))
 
     def checkout(self):
         if not self.cart:
             messagebox.showwarning("Warning", "Cart is empty!")
             return
-        try:
-            response = requests.post("https://127.0.0.1:5000/api/transaction", json={"items": self.cart}, verify=False)
-            response.raise_for_status()
-            data = response.json()
-            self.show_payment_qr(data["qr_code"], data["total"])
-            self.cart = []
-            self.update_cart_display()
+        if self.checkout_pending:
+            return
+
+        def completed(data):
+            self.checkout_pending = False
+            self.show_payment_qr(data["qr_url"], data["total"])
+            # Anything scanned while the sale was in flight is still in the server-side cart
+            self.refresh_cart()
             self.refresh_products()
             self.refresh_history()
             self.status_var.set("Checkout completed")
             self.status_bar.config(bg="#28a745", fg="white")
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-            self.status_var.set(f"Checkout error: {str(e)}")
-            self.status_bar.config(bg="#dc3545", fg="white")
 
-    def show_payment_qr(self, qr_base64, total):
+        def failed(error):
+            self.checkout_pending = False
+            self.show_error(error, "Checkout error")
+
+        self.checkout_pending = True
+        self.status_var.set("Checking out...")
+        self.api.submit(self.backend.checkout, None, self.cart_id, on_success=completed, on_error=failed)
+
+    def show_payment_qr(self, qr_url, total):
         popup = tk.Toplevel(self.root)
         popup.title("Payment QR Code")
         popup.geometry("300x400")
         popup.configure(bg="#f0f4f8")
 
         tk.Label(popup, text=f"Total: ${total:.2f}", font=("Arial", 16), bg="#f0f4f8", fg="#212529").pack(pady=10)
-        img_data = BytesIO(b64decode(qr_base64))
-        img = Image.open(img_data)
-        photo = ImageTk.PhotoImage(img)
-        tk.Label(popup, image=photo, bg="#f0f4f8").pack(pady=10)
-        popup.image = photo
+        qr_label = tk.Label(popup, text="Loading QR code...", font=("Arial", 11), bg="#f0f4f8", fg="#212529")
+        qr_label.pack(pady=10)
+
+        def loaded(png):
+            if not popup.winfo_exists():
+                return
+            photo = ImageTk.PhotoImage(Image.open(BytesIO(png)))
+            qr_label.config(image=photo, text="")
+            popup.image = photo
+
+        self.api.submit(self.backend.payment_qr, qr_url, on_success=loaded, on_error=lambda e: qr_label.config(text=f"QR error: {str(e)}"))
         tk.Label(popup, text="Scan with payment app", font=("Arial", 11), bg="#f0f4f8", fg="#212529").pack(pady=5)
         tk.Button(popup, text="Close", command=popup.destroy, bg="#007bff", fg="white", font=("Arial", 11)).pack(pady=10)
 
-def run_flask():
-    logger.info("Starting Flask server on 0.0.0.0:5000 with HTTPS")
-    app.run(host="0.0.0.0", port=5000, debug=False, use_reloader=False, ssl_context=('cert.pem', 'key.pem'))
+REMOTE_API = os.environ.get("SUPERMARKET_API_URL")
+API_BASE_URL = REMOTE_API or "https://127.0.0.1:5000"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Supermarket POS server and till")
+    parser.add_argument("--headless", action="store_true", help="serve the API only, without the Tk till")
+    parser.add_argument("--server", choices=server.SERVER_MODES, default=os.environ.get("SUPERMARKET_SERVER", "dev"))
+    parser.add_argument("--host", default=server.HOST)
+    parser.add_argument("--port", type=int, default=server.PORT)
+    parser.add_argument("--workers", type=int, default=server.WORKERS, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=server.THREADS, help="request threads per worker")
+    parser.add_argument("--follow", action="append", metavar="URL",
+                        default=[url for url in os.environ.get("SUPERMARKET_FOLLOW", "").split(",") if url],
+                        help="pull and apply another node's change log (repeatable)")
+    args = parser.parse_args()
+    if args.server == "gunicorn" and not args.headless:
+        parser.error("--server gunicorn needs the main thread, use it with --headless")
+    if args.follow and args.server == "gunicorn" and args.workers > 1:
+        parser.error("--follow runs in the serving process, use it with --workers 1")
+    return args
 
 if __name__ == "__main__":
+    args = parse_args()
     init_db()
-    threading.Thread(target=run_flask, daemon=True).start()
-    root = tk.Tk()
-    app = SupermarketPOS(root)
-    root.mainloop()
\ No newline at end of file
+    db.release_db()
+
+    def start_worker():
+        warm_cache()
+        replication.start_followers(args.follow)
+
+    if args.headless:
+        server.serve_forever(app, args.server, args.host, args.port, args.workers, args.threads, on_worker_start=start_worker)
+    else:
+        start_worker()
+        http_server = server.start(app, args.server, args.host, args.port, args.threads)
+        root = tk.Tk()
+        pos = SupermarketPOS(root)
+        root.mainloop()
+        pos.api.shutdown()
+        server.stop(http_server)
@@ -0,0 +1,328 @@
+import re
+from bisect import bisect_right
+from functools import lru_cache
+
+# Symbology decoders keyed on QuaggaJS format names, so a scanner can pass codeResult.format as a hint.
+# GTIN symbologies are check-digit validated; a misread that fails the check is rejected rather than
+# turned into a product. Code 128 carries its checksum in the symbol only, so printable text passes,
+# but an all-digit code of a non-GTIN length is taken for a truncated misread unless the scanner
+# says it read Code 128.
+
+MAX_CODE128_LENGTH = 64
+
+# GS1 prefix ranges on the first three digits of the GTIN-13 form; the table is parsed once at import
+# into parallel sorted arrays and searched with bisect. Ranges not listed are unassigned.
+GS1_PREFIXES = """
+000-019 USA & Canada
+020-029 In-store
+030-039 USA & Canada
+040-049 In-store
+050-059 Coupon
+060-139 USA & Canada
+200-299 In-store
+300-379 France
+380-380 Bulgaria
+383-383 Slovenia
+385-385 Croatia
+387-387 Bosnia and Herzegovina
+389-389 Montenegro
+400-440 Germany
+450-459 Japan
+460-469 Russia
+470-470 Kyrgyzstan
+471-471 Taiwan
+474-474 Estonia
+475-475 Latvia
+476-476 Azerbaijan
+477-477 Lithuania
+478-478 Uzbekistan
+479-479 Sri Lanka
+480-480 Philippines
+481-481 Belarus
+482-482 Ukraine
+484-484 Moldova
+485-485 Armenia
+486-486 Georgia
+487-487 Kazakhstan
+488-488 Tajikistan
+489-489 Hong Kong
+490-499 Japan
+500-509 United Kingdom
+520-521 Greece
+528-528 Lebanon
+529-529 Cyprus
+530-530 Albania
+531-531 North Macedonia
+535-535 Malta
+539-539 Ireland
+540-549 Belgium & Luxembourg
+560-560 Portugal
+569-569 Iceland
+570-579 Denmark
+590-590 Poland
+594-594 Romania
+599-599 Hungary
+600-601 South Africa
+603-603 Ghana
+604-604 Senegal
+608-608 Bahrain
+609-609 Mauritius
+611-611 Morocco
+613-613 Algeria
+615-615 Nigeria
+616-616 Kenya
+618-618 Cote d'Ivoire
+619-619 Tunisia
+620-620 Tanzania
+621-621 Syria
+622-622 Egypt
+624-624 Libya
+625-625 Jordan
+626-626 Iran
+627-627 Kuwait
+628-628 Saudi Arabia
+629-629 United Arab Emirates
+640-649 Finland
+690-699 China
+700-709 Norway
+729-729 Israel
+730-739 Sweden
+740-740 Guatemala
+741-741 El Salvador
+742-742 Honduras
+743-743 Nicaragua
+744-744 Costa Rica
+745-745 Panama
+746-746 Dominican Republic
+750-750 Mexico
+754-755 Canada
+759-759 Venezuela
+760-769 Switzerland
+770-771 Colombia
+773-773 Uruguay
+775-775 Peru
+777-777 Bolivia
+778-779 Argentina
+780-780 Chile
+784-784 Paraguay
+786-786 Ecuador
+789-790 Brazil
+800-839 Italy
+840-849 Spain
+850-850 Cuba
+858-858 Slovakia
+859-859 Czech Republic
+860-860 Serbia
+865-865 Mongolia
+867-867 North Korea
+868-869 Turkey
+870-879 Netherlands
+880-880 South Korea
+884-884 Cambodia
+885-885 Thailand
+888-888 Singapore
+890-890 India
+893-893 Vietnam
+896-896 Pakistan
+899-899 Indonesia
+900-919 Austria
+930-939 Australia
+940-949 New Zealand
+950-950 GS1 Global Office
+955-955 Malaysia
+958-958 Macau
+960-969 GS1 Global Office
+977-977 Periodical
+978-979 Book
+980-980 Refund receipt
+981-984 Coupon
+990-999 Coupon
+"""
+
+# Regions that describe what the code is rather than where it was issued
+PRODUCT_TYPES = {"In-store": "In-store", "Coupon": "Coupon", "Periodical": "Periodical", "Book": "Book",
+                 "Refund receipt": "Refund receipt"}
+
+_DIGITS = re.compile(r"\d+")
+_PRINTABLE = re.compile(r"[\x20-\x7e]+")
+
+
+class InvalidBarcode(ValueError):
+    pass
+
+
+def _load_prefixes(table):
+    starts, ends, regions = [], [], []
+    for line in table.strip().splitlines():
+        span, region = line.split(" ", 1)
+        start, end = span.split("-")
+        starts.append(int(start))
+        ends.append(int(end))
+        regions.append(region)
+    return starts, ends, regions
+
+
+_PREFIX_STARTS, _PREFIX_ENDS, _PREFIX_REGIONS = _load_prefixes(GS1_PREFIXES)
+
+
+@lru_cache(maxsize=1000)
+def gs1_region(prefix):
+    """Region (or code class) for a three-digit GS1 prefix string; None if unassigned."""
+    value = int(prefix)
+    i = bisect_right(_PREFIX_STARTS, value) - 1
+    if i >= 0 and value <= _PREFIX_ENDS[i]:
+        return _PREFIX_REGIONS[i]
+    return None
+
+
+def check_digit(body):
+    """GS1 mod-10 check digit: weights 3, 1, 3, ... from the rightmost body digit."""
+    odd = sum(map(int, body[-1::-2]))
+    even = sum(map(int, body[-2::-2]))
+    return (10 - (odd * 3 + even) % 10) % 10
+
+
+def has_valid_check_digit(code):
+    return check_digit(code[:-1]) == int(code[-1])
+
+
+def upce_to_upca(code):
+    """Expand an 8-digit UPC-E code (number system, six digits, check) to its 12-digit UPC-A form."""
+    ns, d, check = code[0], code[1:7], code[7]
+    last = d[5]
+    if last in "012":
+        body = d[0:2] + last + "0000" + d[2:5]
+    elif last == "3":
+        body = d[0:3] + "00000" + d[3:5]
+    elif last == "4":
+        body = d[0:4] + "00000" + d[4]
+    else:
+        body = d[0:5] + "0000" + last
+    return ns + body + check
+
+
+def _gtin(symbology, prefix, manufacturer_code, product_code, name):
+    region = gs1_region(prefix)
+    return {
+        "symbology": symbology,
+        "gs1_prefix": prefix,
+        "region": region,
+        "product_type": PRODUCT_TYPES.get(region, "General" if region else "Unknown"),
+        "manufacturer_code": manufacturer_code,
+        "product_code": product_code,
+        "name": name,
+    }
+
+
+def _require_gtin(barcode, length, symbology):
+    if len(barcode) != length or not _DIGITS.fullmatch(barcode):
+        raise InvalidBarcode(f"{symbology} needs {length} digits: {barcode}")
+    if not has_valid_check_digit(barcode):
+        raise InvalidBarcode(f"Invalid check digit: {barcode}")
+
+
+DECODERS = {}
+
+
+def decoder(symbology):
+    """Register a decoder taking the stripped barcode string and returning the decoded fields."""
+    def register(func):
+        DECODERS[symbology] = func
+        return func
+    return register
+
+
+@decoder("ean_13")
+def decode_ean13(barcode):
+    _require_gtin(barcode, 13, "EAN-13")
+    return _gtin("ean_13", barcode[:3], barcode[3:7], barcode[7:12], f"Product {barcode[7:12]}")
+
+
+@decoder("upc_a")
+def decode_upca(barcode):
+    _require_gtin(barcode, 12, "UPC-A")
+    return _gtin("upc_a", "0" + barcode[:2], barcode[1:6], barcode[6:11], f"Item {barcode[6:11]}")
+
+
+@decoder("upc_e")
+def decode_upce(barcode):
+    if len(barcode) != 8 or not _DIGITS.fullmatch(barcode) or barcode[0] not in "01":
+        raise InvalidBarcode(f"UPC-E needs 8 digits starting 0 or 1: {barcode}")
+    upca = upce_to_upca(barcode)
+    if not has_valid_check_digit(upca):
+        raise InvalidBarcode(f"Invalid check digit: {barcode}")
+    return dict(decode_upca(upca), symbology="upc_e")
+
+
+@decoder("ean_8")
+def decode_ean8(barcode):
+    _require_gtin(barcode, 8, "EAN-8")
+    return _gtin("ean_8", barcode[:3], barcode[:3], barcode[3:7], f"Product {barcode[3:7]}")
+
+
+@decoder("gtin_14")
+def decode_gtin14(barcode):
+    # Indicator digit (packaging level) followed by the GTIN-13 body
+    _require_gtin(barcode, 14, "GTIN-14")
+    return _gtin("gtin_14", barcode[1:4], barcode[4:8], barcode[8:13], f"Case {barcode[8:13]}")
+
+
+@decoder("code_128")
+def decode_code128(barcode):
+    if not barcode or len(barcode) > MAX_CODE128_LENGTH or not _PRINTABLE.fullmatch(barcode):
+        raise InvalidBarcode(f"Code 128 needs 1-{MAX_CODE128_LENGTH} printable characters: {barcode!r}")
+    half = len(barcode) // 2
+    return {
+        "symbology": "code_128",
+        "gs1_prefix": None,
+        "region": None,
+        "product_type": "Unknown",
+        "manufacturer_code": barcode[:half],
+        "product_code": barcode[half:],
+        "name": f"Unknown {barcode}",
+    }
+
+
+GTIN_BY_LENGTH = {13: decode_ean13, 12: decode_upca, 14: decode_gtin14}
+
+
+def detect(barcode):
+    """Pick a decoder from the shape of the code: all-digit GTIN lengths are validated as GTINs,
+    other all-digit codes are rejected as likely misreads, and text is treated as Code 128.
+    An all-digit Code 128 is accepted only when the scanner names that symbology."""
+    if _DIGITS.fullmatch(barcode):
+        gtin = GTIN_BY_LENGTH.get(len(barcode))
+        if gtin:
+            return gtin
+        if len(barcode) == 8:
+            # EAN-8 and UPC-E share a length; take whichever check digit holds
+            if has_valid_check_digit(barcode) or barcode[0] not in "01":
+                return decode_ean8
+            return decode_upce
+        raise InvalidBarcode(f"{len(barcode)} digits is not a GTIN length; pass symbology code_128 if it is one: {barcode}")
+    return decode_code128
+
+
+def decode(barcode, symbology=None):
+    """Decode one barcode, raising InvalidBarcode on a bad check digit or unknown symbology."""
+    barcode = str(barcode).strip()
+    if symbology:
+        func = DECODERS.get(symbology)
+        if func is None:
+            raise InvalidBarcode(f"Unsupported symbology: {symbology}")
+        return func(barcode)
+    return detect(barcode)(barcode)
+
+
+def decode_many(barcodes, symbologies=None):
+    """Bulk decode for imports: one result per input, an InvalidBarcode instance in place of a
+    failure so a bad row never aborts the batch. symbologies, if given, holds a hint (or None)
+    per barcode."""
+    results = []
+    append = results.append
+    for barcode, symbology in zip(barcodes, symbologies or [None] * len(barcodes)):
+        try:
+            append(decode(barcode, symbology))
+        except InvalidBarcode as e:
+            append(e)
+    return results
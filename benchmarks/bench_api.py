@@ -0,0 +1,264 @@
+"""Concurrent lane load test with per-endpoint p50/p99 latency and throughput.
+
+Each lane is a thread replaying what a scanner does: scan 1-30 items (batched lookups for phone
+lanes, single-barcode lookups for till lanes, popular products scanned most), now and then search
+or pull a catalog delta, and check out the basket with a client_txn_id. Lanes drive the Flask app
+through its test client (in-process service cost), over real sockets to a server started here, or
+against a running server given by --url.
+
+    python benchmarks/bench_api.py [--products 10000] [--orders 2000] [--lanes 8] [--duration 10]
+    python benchmarks/bench_api.py --target socket --lanes 32
+    python benchmarks/bench_api.py --url https://till-server:5000 --lanes 16
+    python benchmarks/bench_api.py --compare benchmarks/baseline.json   # exit 1 on regression
+    python benchmarks/bench_api.py --save benchmarks/baseline.json      # record a new baseline
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAX_BASKET = 30
+MAX_LOOKUP_BATCH = 3      # detections scanner.js collects into one batched lookup
+SEARCH_RATE = 0.1         # per basket
+SYNC_RATE = 0.05          # per basket; scanner.js syncs every 30 s
+SYNC_FIELDS = "id,barcode,name,sell_price,discount,stock"
+SEARCH_TERMS = ("mi", "bre", "chee", "cof", "juice 1l", "sha", "tom", "ric")
+DEFAULT_TOLERANCE = 0.25
+
+
+class ClientTarget:
+    """In-process requests through Flask's test client, one client per lane thread."""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, json=None):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=json)
+        response.close()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class HttpTarget:
+    """Real HTTP with one keep-alive session per lane thread."""
+
+    def __init__(self, base_url):
+        import requests
+        import urllib3
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        self.requests = requests
+        self.base_url = base_url.rstrip("/")
+        self._local = threading.local()
+        self._sessions = []
+
+    def request(self, method, path, json=None):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self.requests.Session()
+            self._sessions.append(session)
+        # verify per request: a session-level False is overridden by REQUESTS_CA_BUNDLE
+        response = session.request(method, self.base_url + path, json=json, timeout=30, verify=False)
+        response.content  # read the body so the connection goes back to the pool
+        return response.status_code
+
+    def close(self):
+        for session in self._sessions:
+            session.close()
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, name, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds * 1000)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self, elapsed):
+        result = {}
+        for name, timings in sorted(self.latencies.items()):
+            timings.sort()
+            result[name] = {
+                "count": len(timings),
+                "errors": self.errors.get(name, 0),
+                "rps": round(len(timings) / elapsed, 1),
+                "mean_ms": round(statistics.mean(timings), 3),
+                "p50_ms": round(percentile(timings, 0.50), 3),
+                "p99_ms": round(percentile(timings, 0.99), 3),
+            }
+        return result
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def timed(stats, target, name, method, path, json=None, ok=(200, 201)):
+    start = time.perf_counter()
+    try:
+        status = target.request(method, path, json)
+    except Exception:
+        status = None
+    stats.record(name, time.perf_counter() - start, status in ok)
+    return status
+
+
+def run_lane(lane, target, codes, stats, deadline, seed):
+    rng = random.Random(seed * 1000 + lane)
+    phone = lane % 2 == 0
+
+    def pick():
+        return codes[int(len(codes) * rng.random() ** 3)]
+
+    while time.monotonic() < deadline:
+        basket = {}
+        remaining = rng.randint(1, MAX_BASKET)
+        while remaining > 0:
+            if phone:
+                batch = [pick() for _ in range(min(remaining, rng.randint(1, MAX_LOOKUP_BATCH)))]
+                timed(stats, target, "lookup_batch", "POST", "/api/products/barcodes", {"barcodes": batch})
+            else:
+                batch = [pick()]
+                timed(stats, target, "lookup", "GET", f"/api/products/barcode/{batch[0]}")
+            for barcode in batch:
+                basket[barcode] = basket.get(barcode, 0) + 1
+            remaining -= len(batch)
+        if rng.random() < SEARCH_RATE:
+            timed(stats, target, "search", "GET", f"/api/products/search?q={rng.choice(SEARCH_TERMS)}&limit=20")
+        if rng.random() < SYNC_RATE:
+            timed(stats, target, "sync", "GET", f"/api/products?fields={SYNC_FIELDS}&limit=2000&updated_since=0")
+        items = [{"barcode": barcode, "quantity": quantity} for barcode, quantity in basket.items()]
+        timed(stats, target, "checkout", "POST", "/api/transaction", {"client_txn_id": uuid.uuid4().hex, "items": items})
+
+
+def fetch_barcodes(target, limit):
+    # Against a remote server the catalog is whatever it holds; page through it for barcodes
+    import requests
+    codes, after = [], 0
+    while len(codes) < limit:
+        response = requests.get(f"{target.base_url}/api/products", params={"fields": "barcode", "limit": 5000, "after": after},
+                                verify=False, timeout=30)
+        response.raise_for_status()
+        codes.extend(p["barcode"] for p in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        after = cursor
+    return codes[:limit]
+
+
+def compare(report, baseline, tolerance):
+    """Endpoints whose p99 rose or throughput fell by more than tolerance against the baseline."""
+    regressions = []
+    for name, base in baseline["endpoints"].items():
+        current = report.get(name)
+        if current is None:
+            continue
+        if current["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {current['p99_ms']:.2f} ms vs {base['p99_ms']:.2f} ms")
+        if current["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {current['rps']:.1f} req/s vs {base['rps']:.1f} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", choices=("client", "socket"), default="client")
+    parser.add_argument("--url", help="benchmark a running server instead of a seeded local one")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--orders", type=int, default=2000, help="sales history to seed")
+    parser.add_argument("--lanes", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write the results as a baseline JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to check against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    http_server = None
+    if args.url:
+        target = HttpTarget(args.url)
+        codes = fetch_barcodes(target, args.products)
+    else:
+        workdir = tempfile.mkdtemp(prefix="pos-bench-")
+        os.environ["SUPERMARKET_DB"] = os.path.join(workdir, "bench.db")
+        os.environ["SUPERMARKET_LOG_FILE"] = os.path.join(workdir, "supermarket.log")
+        os.environ.setdefault("SUPERMARKET_LOG_LEVEL", "WARNING")
+        import seed
+        codes = seed.seed(args.products, args.orders)
+        import app as pos
+        pos.warm_cache()
+        if args.target == "socket":
+            import server
+            server.TLS_CERT = os.path.join(ROOT, server.TLS_CERT)
+            server.TLS_KEY = os.path.join(ROOT, server.TLS_KEY)
+            http_server = server.start(pos.app, "dev", "127.0.0.1", 0)
+            target = HttpTarget(f"https://127.0.0.1:{http_server.server.server_port}")
+        else:
+            target = ClientTarget(pos.app)
+    if not codes:
+        parser.error("No products to scan")
+
+    stats = Stats()
+    deadline = time.monotonic() + args.duration
+    start = time.perf_counter()
+    lanes = [threading.Thread(target=run_lane, args=(lane, target, codes, stats, deadline, args.seed))
+             for lane in range(args.lanes)]
+    for lane in lanes:
+        lane.start()
+    for lane in lanes:
+        lane.join()
+    elapsed = time.perf_counter() - start
+    target.close()
+    if http_server is not None:
+        import server
+        server.stop(http_server)
+
+    report = stats.report(elapsed)
+    print(f"{args.lanes} lanes, {len(codes)} products, {elapsed:.1f}s, target {args.url or args.target}")
+    print(f"{'endpoint':<14} {'count':>8} {'errors':>7} {'req/s':>9} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, row in report.items():
+        print(f"{name:<14} {row['count']:>8} {row['errors']:>7} {row['rps']:>9.1f} {row['mean_ms']:>9.2f} "
+              f"{row['p50_ms']:>9.2f} {row['p99_ms']:>9.2f}")
+
+    config = {"target": "url" if args.url else args.target, "products": len(codes), "orders": args.orders,
+              "lanes": args.lanes, "duration": args.duration}
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"config": config, "machine": f"{platform.python_implementation()} {platform.python_version()} "
+                       f"{platform.machine()}, {os.cpu_count()} CPUs", "endpoints": report}, f, indent=2)
+            f.write("\n")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            print(f"Warning: baseline was recorded with {baseline['config']}")
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
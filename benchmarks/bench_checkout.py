@@ -0,0 +1,60 @@
+"""Checkout latency by basket size.
+
+Seeds a throwaway database, then posts baskets of 1-500 lines to /api/transaction
+through the Flask test client and prints per-size latency.
+
+    python benchmarks/bench_checkout.py [--products 5000] [--rounds 20]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASKET_SIZES = (1, 10, 50, 100, 250, 500)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pos-bench-")
+    os.environ["SUPERMARKET_DB"] = os.path.join(workdir, "bench.db")
+    os.chdir(workdir)  # keep supermarket.log out of the repo
+    sys.path.insert(0, ROOT)
+    import app as pos
+    import db
+    import services
+    import logging
+    logging.getLogger().setLevel(logging.WARNING)
+
+    pos.init_db()
+    barcodes = [f"50{i:011d}" for i in range(args.products)]
+    with db.transaction(db.get_db()) as conn:
+        conn.executemany(services.INSERT_PRODUCT, [
+            (b, "General", b[3:7], b[7:12], f"Product {b[7:12]}", 1.0, 2.5, 10.0, 10**9) for b in barcodes
+        ])
+    db.release_db()
+    client = pos.app.test_client()
+
+    print(f"{'lines':>6} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'ms/line':>9}")
+    for size in BASKET_SIZES:
+        basket = {"items": [{"barcode": barcodes[(size * 7 + i) % len(barcodes)], "quantity": 1} for i in range(size)]}
+        timings = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            response = client.post("/api/transaction", json=basket)
+            timings.append((time.perf_counter() - start) * 1000)
+            assert response.status_code == 201, response.get_json()
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        mean = statistics.mean(timings)
+        print(f"{size:>6} {mean:>9.2f} {statistics.median(timings):>9.2f} {p99:>9.2f} {mean / size:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Seed a database with a synthetic catalog and sales history.
+
+Products get valid EAN-13 barcodes, skewed name words (for search) and effectively unlimited
+stock; orders are spread over the last --days days and the analytics rollups rebuilt from them.
+Generators use fixed seeds, so every run with the same sizes builds the same data.
+
+    python benchmarks/seed.py --db /tmp/pos.db --products 100000 --orders 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORDS = ("milk", "bread", "cheese", "butter", "yogurt", "coffee", "tea", "rice", "pasta", "sauce", "chicken",
+         "beef", "juice", "water", "soda", "chips", "cookie", "apple", "banana", "orange", "tomato", "potato",
+         "onion", "garlic", "flour", "sugar", "salt", "pepper", "oil", "vinegar", "soap", "shampoo")
+SIZES = ("100g", "250g", "500g", "1kg", "330ml", "500ml", "1l", "2l", "6pk", "12pk")
+CHUNK = 10000
+STOCK = 10**9  # checkouts in a benchmark never run out
+
+
+def seed_products(conn, count, rng_seed=1):
+    """Insert count products; returns their barcodes in id order."""
+    import db
+    import services
+    from barcodes import check_digit
+    rng = random.Random(rng_seed)
+    codes = []
+    for start in range(0, count, CHUNK):
+        rows = []
+        for i in range(start, min(start + CHUNK, count)):
+            body = f"50{i:010d}"
+            barcode = body + str(check_digit(body))
+            codes.append(barcode)
+            buy = round(rng.uniform(0.2, 20), 2)
+            name = f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {rng.choice(SIZES)}"
+            rows.append((barcode, "General", barcode[3:7], barcode[7:12], name, buy, round(buy * rng.uniform(1.1, 1.8), 2),
+                         rng.choice((0.0, 0.0, 0.0, 5.0, 10.0)), STOCK))
+        with db.transaction(conn):
+            conn.executemany(services.INSERT_PRODUCT, rows)
+    return codes
+
+
+def seed_sales(conn, codes, orders, days=30, rng_seed=2):
+    """Insert orders of 1-30 lines spread over the past `days` days, then rebuild the analytics rollups."""
+    import analytics
+    import db
+    import services
+    rng = random.Random(rng_seed)
+    prices = {row['barcode']: (row['name'], row['sell_price']) for row in conn.execute("SELECT barcode, name, sell_price FROM products")}
+    now = int(time.time())
+    for start in range(0, orders, CHUNK // 10):
+        with db.transaction(conn):
+            for _ in range(start, min(start + CHUNK // 10, orders)):
+                created_at = now - rng.randrange(days * 86400)
+                lines = {}
+                for _ in range(rng.randint(1, 30)):
+                    barcode = codes[int(len(codes) * rng.random() ** 3)]  # popular products sell most
+                    lines[barcode] = lines.get(barcode, 0) + 1
+                total = sum(prices[b][1] * q for b, q in lines.items())
+                order_id = conn.execute(services.INSERT_ORDER, (created_at, total, sum(lines.values()), None)).lastrowid
+                conn.executemany(services.INSERT_ORDER_LINE, [
+                    (order_id, b, prices[b][0], q, prices[b][1], prices[b][1] * q, created_at) for b, q in lines.items()
+                ])
+    analytics.rebuild(conn)
+
+
+def seed(products, orders=0, days=30):
+    """Create the schema in SUPERMARKET_DB and fill it. Returns the product barcodes."""
+    import app as pos
+    import db
+    pos.init_db()
+    conn = db.get_db()
+    codes = seed_products(conn, products)
+    if orders:
+        seed_sales(conn, codes, orders, days)
+    db.release_db()
+    return codes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", required=True, help="database file to create (must not exist)")
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--orders", type=int, default=0)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+    if os.path.exists(args.db):
+        parser.error(f"{args.db} already exists")
+
+    os.environ["SUPERMARKET_DB"] = os.path.abspath(args.db)
+    os.environ.setdefault("SUPERMARKET_LOG_FILE", os.path.abspath(args.db) + ".log")
+    sys.path.insert(0, ROOT)
+    start = time.perf_counter()
+    seed(args.products, args.orders, args.days)
+    print(f"Seeded {args.products} products and {args.orders} orders in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
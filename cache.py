@@ -0,0 +1,71 @@
+import os
+import threading
+from collections import OrderedDict
+
+CACHE_SIZE = int(os.environ.get("SUPERMARKET_CACHE_SIZE", "10000"))
+
+
+class ProductCache:
+    """Bounded LRU of product rows keyed by barcode. Callers write through after commit."""
+
+    def __init__(self, capacity=CACHE_SIZE):
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, barcode):
+        with self._lock:
+            product = self._items.get(barcode)
+            if product is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(barcode)
+            self.hits += 1
+            return dict(product)
+
+    def put(self, product):
+        with self._lock:
+            self._put(product)
+
+    def _put(self, product):
+        barcode = product["barcode"]
+        self._items[barcode] = dict(product)
+        self._items.move_to_end(barcode)
+        while len(self._items) > self.capacity:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, barcode):
+        with self._lock:
+            self._items.pop(barcode, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def warm(self, conn, limit=None):
+        # Most recently added products first, so the newest SKUs survive when the catalog exceeds capacity
+        limit = min(limit or self.capacity, self.capacity)
+        rows = conn.execute("SELECT * FROM products ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        with self._lock:
+            for row in reversed(rows):
+                self._put(dict(row))
+        return len(rows)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+products = ProductCache()
@@ -0,0 +1,111 @@
+import itertools
+import threading
+import time
+import uuid
+
+import pricing
+import reservations
+
+# Server-side carts shared by phones and tills: any client that knows a cart id can scan into it.
+# Each cart keeps its priced lines and a running subtotal, adjusted by the difference a change
+# makes to the lines it touches (the one scanned, plus any a bundle promotion ties to it), so a
+# scan costs the same in a 100-line basket as in an empty one. Carts live in this process, like
+# the stock holds they share their id with, and are dropped after the reservation TTL without
+# activity. Lines are priced at scan time; checkout reprices the whole basket, so a promotion that
+# starts or ends while the cart is open applies as it stands at the sale.
+
+SWEEP_INTERVAL = 60  # seconds between sweeps for idle carts
+
+# Shared by all carts, so a cart recreated under the same id never goes back to an old version
+_versions = itertools.count(1)
+
+
+class Cart:
+    def __init__(self, cart_id):
+        self.id = cart_id
+        self.lock = threading.Lock()  # held across reserve-then-price so concurrent scans do not interleave
+        self.lines = {}               # barcode -> priced line, in scan order
+        self.products = {}            # barcode -> product row its line was priced from
+        self.subtotal = 0.0
+        self.item_count = 0
+        self.version = 0              # raised per change, so clients can drop stale updates
+        self.touched = time.monotonic()
+
+    def set_line(self, product, quantity):
+        """Set one line to quantity (0 removes it) and reprice it with the lines a bundle links it
+        to. Returns (line, repriced): the new line and any other line whose total moved.
+        Caller holds the lock."""
+        barcode = product["barcode"]
+        old = self.lines.get(barcode)
+        self.item_count += quantity - (old["quantity"] if old else 0)
+        self.products[barcode] = product
+        quantities = {b: self.lines[b]["quantity"] for b in pricing.linked(barcode, self.lines) if b in self.lines}
+        quantities[barcode] = quantity
+        priced, _ = pricing.price_basket(self.products, quantities)
+        line, repriced = None, []
+        for new in priced:
+            b = new["barcode"]
+            previous = self.lines.get(b)
+            self.subtotal += new["total"] - (previous["total"] if previous else 0.0)
+            if b == barcode:
+                line = new
+            elif new["total"] != previous["total"]:
+                repriced.append(new)
+            self.lines[b] = new  # an existing line keeps its place
+        if quantity <= 0:
+            del self.lines[barcode], self.products[barcode]
+        if not self.lines:
+            self.subtotal = 0.0  # drop float drift once the cart is empty
+        self.version = next(_versions)
+        self.touched = time.monotonic()
+        return line, repriced
+
+    def quantities(self):
+        return {barcode: line["quantity"] for barcode, line in self.lines.items()}
+
+    def totals(self):
+        return {"cart_id": self.id, "version": self.version, "subtotal": self.subtotal, "item_count": self.item_count}
+
+    def snapshot(self):
+        return dict(self.totals(), lines=[dict(line) for line in self.lines.values()])
+
+
+class CartStore:
+    def __init__(self, ttl=reservations.RESERVATION_TTL):
+        self.enabled = True  # off in multi-worker servers, where each worker would see only its own carts
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._carts = {}
+        self._swept = time.monotonic()
+
+    def create(self, cart_id=None):
+        self._sweep()
+        with self._lock:
+            cart_id = cart_id or uuid.uuid4().hex[:12]
+            cart = self._carts.get(cart_id)
+            if cart is None:
+                cart = self._carts[cart_id] = Cart(cart_id)
+            return cart
+
+    def get(self, cart_id):
+        with self._lock:
+            return self._carts.get(cart_id)
+
+    def discard(self, cart_id):
+        with self._lock:
+            return self._carts.pop(cart_id, None)
+
+    def _sweep(self):
+        now = time.monotonic()
+        if now - self._swept < SWEEP_INTERVAL:
+            return
+        with self._lock:
+            self._swept = now
+            for cart_id in [cart_id for cart_id, cart in self._carts.items() if now - cart.touched > self.ttl]:
+                del self._carts[cart_id]
+
+    def __len__(self):
+        return len(self._carts)
+
+
+store = CartStore()
@@ -0,0 +1,190 @@
+import csv
+import io
+import json
+import logging
+
+import cache
+import db
+import events
+import reservations
+from services import DEFAULT_SELL_PRICE, ServiceError, decode_barcodes
+
+logger = logging.getLogger(__name__)
+
+# Supplier catalogs are parsed row by row from the upload stream and written IMPORT_CHUNK rows per
+# transaction, so a 100k-SKU file never sits in memory and other writers get the lock between chunks.
+FORMATS = ("csv", "ndjson")
+IMPORT_COLUMNS = ["barcode", "product_type", "manufacturer_code", "product_code", "name",
+                  "buy_price", "sell_price", "discount", "stock"]
+NUMERIC_COLUMNS = {"buy_price": float, "sell_price": float, "discount": float, "stock": int}
+IMPORT_CHUNK = 1000
+EXPORT_CHUNK = 500
+MAX_REPORTED_ERRORS = 1000
+MAX_BARCODE_LENGTH = 64
+
+
+def upsert_sql(columns):
+    # Columns missing from the file keep their stored value on update and take decoded defaults on insert
+    updates = ", ".join(f"{c} = excluded.{c}" for c in IMPORT_COLUMNS if c in columns and c != "barcode")
+    return f'''
+        INSERT INTO products ({", ".join(IMPORT_COLUMNS)}) VALUES ({", ".join("?" * len(IMPORT_COLUMNS))})
+        ON CONFLICT(barcode) DO {"UPDATE SET " + updates if updates else "NOTHING"}
+    '''
+
+
+def detect_format(fmt, content_type, filename=None):
+    if fmt:
+        if fmt not in FORMATS:
+            raise ServiceError(f"format must be one of: {', '.join(FORMATS)}")
+        return fmt
+    if "ndjson" in (content_type or "") or (filename or "").endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    return "csv"
+
+
+def read_rows(stream, fmt):
+    """Yield (line_number, dict) from a binary upload stream without reading it whole."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, e
+                continue
+            yield line_number, row
+
+
+def row_barcode(row):
+    return str(row.get("barcode") or "").strip() if isinstance(row, dict) else ""
+
+
+def normalize(row, barcode, decoded):
+    """Validate one input row against its decoded barcode (a dict, or the InvalidBarcode raised
+    decoding it). Returns (present_columns, values tuple) or raises ValueError."""
+    if not isinstance(row, dict):
+        raise ValueError("Row must be an object")
+    if not barcode or len(barcode) > MAX_BARCODE_LENGTH:
+        raise ValueError("Missing or invalid barcode")
+    if isinstance(decoded, Exception):
+        raise decoded
+    present = {"barcode"}
+    values = dict(decoded, barcode=barcode, sell_price=DEFAULT_SELL_PRICE, discount=0.0)
+    for column in IMPORT_COLUMNS[1:]:
+        value = row.get(column)
+        if value is None or value == "":
+            continue
+        if column in NUMERIC_COLUMNS:
+            try:
+                value = NUMERIC_COLUMNS[column](value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid {column}: {value!r}")
+            if value < 0 or (column == "discount" and value > 100):
+                raise ValueError(f"{column} out of range: {value}")
+        else:
+            value = str(value).strip()
+        values[column] = value
+        present.add(column)
+    return frozenset(present), tuple(values[c] for c in IMPORT_COLUMNS)
+
+
+def import_products(stream, fmt="csv"):
+    """Upsert products on barcode from a CSV/NDJSON stream. Returns counts and per-row errors."""
+    report = {"rows": 0, "upserted": 0, "unchanged": 0, "failed": 0, "errors": []}
+    batch = []  # (line_number, row) read but not yet decoded
+    barcodes = set()  # barcodes in pending
+    pending = {}  # present columns -> value tuples; one executemany per column set
+
+    def fail(line_number, barcode, error):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": line_number, "barcode": barcode, "error": str(error)})
+
+    def decode_batch():
+        # Barcodes are decoded a chunk at a time rather than per row
+        codes = [row_barcode(row) for _, row in batch]
+        # An optional symbology column lets in-house all-digit Code 128 codes through
+        symbologies = [(row.get("symbology") or None) if isinstance(row, dict) else None for _, row in batch]
+        for (line_number, row), barcode, decoded in zip(batch, codes, decode_barcodes(codes, symbologies)):
+            try:
+                columns, values = normalize(row, barcode, decoded)
+            except ValueError as e:
+                fail(line_number, row.get("barcode") if isinstance(row, dict) else None, e)
+                continue
+            if values[0] in barcodes:
+                # Column sets are written one after another, so a repeated barcode waits for the
+                # rows before it to land, keeping the file's last row the one that sticks
+                write()
+            pending.setdefault(columns, []).append(values)
+            barcodes.add(values[0])
+        batch.clear()
+
+    def write():
+        if not pending:
+            return
+        # Imported stock is absolute, so sales still pending are applied first
+        written = 0
+        with db.pool.connection() as conn, reservations.ledger.settling(conn):
+            for columns, rows in pending.items():
+                # Rows an ON CONFLICT DO NOTHING skipped are not in rowcount
+                written += conn.executemany(upsert_sql(columns), rows).rowcount
+        report["upserted"] += written
+        report["unchanged"] += sum(len(rows) for rows in pending.values()) - written
+        pending.clear()
+        for barcode in barcodes:
+            cache.products.invalidate(barcode)
+        barcodes.clear()
+
+    def flush():
+        decode_batch()
+        write()
+
+    try:
+        for line_number, row in read_rows(stream, fmt):
+            report["rows"] += 1
+            if isinstance(row, Exception):
+                fail(line_number, None, f"Invalid JSON: {row}")
+                continue
+            batch.append((line_number, row))
+            if len(batch) >= IMPORT_CHUNK:
+                flush()
+        flush()
+    except (UnicodeDecodeError, csv.Error) as e:
+        flush()
+        raise ServiceError(f"Unreadable {fmt} after {report['rows']} rows: {e}")
+
+    if report["upserted"]:
+        events.bus.publish("catalog.imported", {"upserted": report["upserted"], "failed": report["failed"]})
+    logger.info("Catalog import: %d upserted, %d unchanged, %d failed of %d rows",
+                report['upserted'], report['unchanged'], report['failed'], report['rows'])
+    return report
+
+
+def export_products(fmt="csv"):
+    """Generator of export chunks; holds its own pooled connection for the life of the stream."""
+    with db.pool.connection() as conn:
+        cursor = conn.execute(f"SELECT {', '.join(IMPORT_COLUMNS)} FROM products ORDER BY id")
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(IMPORT_COLUMNS)
+            while True:
+                writer.writerows(cursor.fetchmany(EXPORT_CHUNK))
+                chunk = buffer.getvalue()
+                if not chunk:
+                    break
+                yield chunk
+                buffer.seek(0)
+                buffer.truncate()
+        else:
+            while True:
+                rows = cursor.fetchmany(EXPORT_CHUNK)
+                if not rows:
+                    break
+                yield "".join(json.dumps(dict(row)) + "\n" for row in rows)
@@ -0,0 +1,151 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+DB_PATH = os.environ.get("SUPERMARKET_DB", "supermarket.db")
+
+# Applied to every new connection. WAL lets barcode lookups keep reading while a
+# checkout commits; NORMAL sync is durable across app crashes in WAL mode.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",      # ~16 MB page cache per connection
+    "PRAGMA mmap_size=268435456",    # 256 MB memory-mapped reads
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+)
+
+POOL_SIZE = int(os.environ.get("SUPERMARKET_DB_POOL", "16"))
+STATEMENT_CACHE = 256  # prepared statements kept per connection, keyed on SQL text
+BUSY_TIMEOUT = 5.0
+
+
+class TimedConnection(sqlite3.Connection):
+    """Records execute()/executemany() time per statement kind. Rows fetched lazily after
+    execute returns are not included, so large SELECTs read as their time to first row."""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.db_queries.observe(time.perf_counter() - start, statement_kind(sql))
+
+    def executemany(self, sql, parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            metrics.db_queries.observe(time.perf_counter() - start, statement_kind(sql))
+
+
+def statement_kind(sql):
+    return sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+
+
+class ConnectionPool:
+    def __init__(self, path=DB_PATH, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = set()
+
+    def _connect(self):
+        # Autocommit mode: writes go through transaction() so we control BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                               isolation_level=None, cached_statements=STATEMENT_CACHE,
+                               factory=TimedConnection if metrics.ENABLED else sqlite3.Connection)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        with self._lock:
+            self._open.add(conn)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            self._discard(conn)
+
+    def _discard(self, conn):
+        with self._lock:
+            self._open.discard(conn)
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            return {"open": len(self._open), "idle": self._idle.qsize(), "size": self.size}
+
+    def close_all(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            leftover, self._open = self._open, set()
+        for conn in leftover:
+            conn.close()
+
+
+pool = ConnectionPool()
+
+_local = threading.local()
+
+
+def get_db():
+    """Connection for the current request/thread, reused until release_db()."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = pool.acquire()
+    return conn
+
+
+def release_db(exc=None):
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _local.conn = None
+        pool.release(conn)
+
+
+@contextmanager
+def transaction(conn=None):
+    """Run a block inside BEGIN IMMEDIATE so the write lock is taken up front."""
+    conn = conn or get_db()
+    conn.execute("BEGIN IMMEDIATE")
+    start = time.perf_counter()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        metrics.db_transactions.observe(time.perf_counter() - start)
+
+
+def init_app(app):
+    app.teardown_appcontext(release_db)
@@ -0,0 +1,98 @@
+import itertools
+import json
+import queue
+import threading
+from collections import deque
+
+HEARTBEAT_SECONDS = 15
+BACKLOG = 256            # recent events kept for clients reconnecting with Last-Event-ID
+SUBSCRIBER_QUEUE = 1024  # slow subscribers drop events rather than block publishers
+
+
+class EventBus:
+    def __init__(self, backlog=BACKLOG):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._history = deque(maxlen=backlog)
+        self._subscribers = set()
+
+    def publish(self, event_type, data):
+        with self._lock:
+            event = {"id": next(self._ids), "type": event_type, "data": data}
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass
+        return event
+
+    def subscribe(self, last_id=None):
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        with self._lock:
+            if last_id is not None:
+                for event in self._history:
+                    if event["id"] > last_id:
+                        q.put_nowait(event)
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def close(self):
+        # Wake every subscriber with a None sentinel so open streams end during shutdown
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(None)
+            except queue.Full:
+                pass
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stream(self, last_id=None, heartbeat=HEARTBEAT_SECONDS):
+        # Server-Sent Events framing; the comment line keeps idle proxies from closing the socket
+        q = self.subscribe(last_id)
+        try:
+            yield "retry: 2000\n\n"
+            while True:
+                try:
+                    event = q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    return
+                yield format_sse(event)
+        finally:
+            self.unsubscribe(q)
+
+
+def format_sse(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+def parse_sse(lines):
+    """Turn an iterable of SSE text lines into event dicts (used by the Tk client)."""
+    event = {}
+    for line in lines:
+        if not line:
+            if "data" in event:
+                yield {"id": int(event["id"]) if event.get("id") else None,
+                       "type": event.get("event", "message"),
+                       "data": json.loads(event["data"])}
+            event = {}
+        elif line.startswith(":"):
+            continue
+        else:
+            field, _, value = line.partition(":")
+            event[field] = value[1:] if value.startswith(" ") else value
+
+
+bus = EventBus()
@@ -0,0 +1,139 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+
+# Request threads only put records on a queue; a QueueListener thread formats them and writes the
+# rotating file and console. Records carry the id of the request that logged them, and access logs
+# for successful requests are sampled, so a busy lane no longer turns into a poll line per second.
+
+LOG_FILE = os.environ.get("SUPERMARKET_LOG_FILE", "supermarket.log")
+LOG_LEVEL = os.environ.get("SUPERMARKET_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("SUPERMARKET_LOG_FORMAT", "json")   # file format: json or text
+MAX_BYTES = int(os.environ.get("SUPERMARKET_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+BACKUPS = int(os.environ.get("SUPERMARKET_LOG_BACKUPS", "5"))
+ROTATE_WHEN = os.environ.get("SUPERMARKET_LOG_ROTATE_WHEN")      # e.g. "midnight" rotates by time instead of size
+ACCESS_SAMPLE = float(os.environ.get("SUPERMARKET_ACCESS_LOG_SAMPLE", "0.05"))
+SLOW_REQUEST = float(os.environ.get("SUPERMARKET_SLOW_REQUEST", "1.0"))  # seconds; slower requests are always logged
+QUEUE_SIZE = 10000  # records beyond this are dropped rather than blocking a request
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+request_id = contextvars.ContextVar("request_id", default="-")
+access_logger = logging.getLogger("access")
+
+# Attributes every LogRecord has; anything else on a record came from extra= and goes into the JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+_listener = None
+
+
+class RequestIdFilter(logging.Filter):
+    # Runs in the thread that logged, before the record is queued, so the context var is still set
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def file_handler():
+    if ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(LOG_FILE, when=ROTATE_WHEN, backupCount=BACKUPS,
+                                                            encoding="utf-8")
+    else:
+        handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=MAX_BYTES, backupCount=BACKUPS,
+                                                       encoding="utf-8")
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+def configure():
+    """Route the root logger through the queue. Safe to call again, e.g. in a forked worker."""
+    global _listener
+    shutdown()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    log_queue = queue.Queue(QUEUE_SIZE)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(RequestIdFilter())
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    # Werkzeug's per-request lines are replaced by the sampled access log
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    _listener = logging.handlers.QueueListener(log_queue, file_handler(), console, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(shutdown)
+
+
+def init_app(app):
+    from flask import g, request
+
+    @app.before_request
+    def assign_request_id():
+        g.log_start = time.perf_counter()
+        g.log_token = request_id.set((request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16])[:64])
+
+    @app.after_request
+    def log_access(response):
+        start = g.pop("log_start", None)
+        if start is not None:
+            duration = time.perf_counter() - start
+            response.headers["X-Request-ID"] = request_id.get()
+            if response.status_code >= 400 or duration >= SLOW_REQUEST or random.random() < ACCESS_SAMPLE:
+                access_logger.info("%s %s %s %.1fms", request.method, request.path, response.status_code,
+                                   duration * 1000, extra={"method": request.method, "path": request.path,
+                                                           "status": response.status_code,
+                                                           "duration_ms": round(duration * 1000, 2)})
+        return response
+
+    @app.teardown_request
+    def clear_request_id(exc=None):
+        token = g.pop("log_token", None)
+        if token is not None:
+            request_id.reset(token)
@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# In-process metrics in the Prometheus text format. Recording is a lock plus a few list updates, so
+# the request, query and render paths can afford it; gauges are read from callbacks at scrape time.
+# Each process keeps its own numbers, so scrape every gunicorn worker (or run one).
+
+ENABLED = os.environ.get("SUPERMARKET_METRICS", "1") != "0"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.label_names, label_values)} {value}"
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [per-bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def samples(self):
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        for label_values, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_labels(self.label_names, label_values, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, label_values)} {total}"
+            yield f"{self.name}_count{_labels(self.label_names, label_values)} {cumulative}"
+
+
+class Callback:
+    """Metric read at scrape time. func returns a number, or (label values, number) pairs."""
+
+    def __init__(self, name, help, func, labels=(), type="gauge"):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.type = type
+        self.func = func
+
+    def samples(self):
+        value = self.func()
+        if isinstance(value, (int, float)):
+            yield f"{self.name} {value}"
+            return
+        for label_values, number in value:
+            yield f"{self.name}{_labels(self.label_names, label_values)} {number}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name, help, labels=()):
+    return registry.register(Counter(name, help, labels))
+
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    return registry.register(Histogram(name, help, labels, buckets))
+
+
+def callback(name, help, func, labels=(), type="gauge"):
+    return registry.register(Callback(name, help, func, labels, type))
+
+
+http_requests = counter("pos_http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_latency = histogram("pos_http_request_seconds", "Time to build the response, by route", ("method", "route"))
+db_queries = histogram("pos_db_query_seconds", "SQLite execute() time by statement kind", ("statement",), QUERY_BUCKETS)
+db_transactions = histogram("pos_db_transaction_seconds", "Time write transactions hold the lock", buckets=QUERY_BUCKETS)
+qr_renders = histogram("pos_qr_render_seconds", "Payment QR PNG render time")
+
+
+def init_app(app):
+    if not ENABLED:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            # The URL rule, not the path, keeps barcodes and ids out of the label set
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            http_latency.observe(time.perf_counter() - start, request.method, route)
+            http_requests.inc(request.method, route, response.status_code)
+        return response
@@ -0,0 +1,121 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+
+import qrcode
+import qrcode.image.svg
+
+import metrics
+
+QR_WORKERS = 2
+CACHE_SIZE = 512
+MAX_PAYLOAD = 256
+SIGNATURE_BYTES = 16
+# Shared by every worker forked from this process; set it to keep QR links valid across restarts and nodes
+SECRET = os.environ.get("SUPERMARKET_QR_SECRET", "").encode("utf-8") or secrets.token_bytes(32)
+
+_executor = ThreadPoolExecutor(max_workers=QR_WORKERS, thread_name_prefix="qr")
+_lock = threading.Lock()
+_renders = OrderedDict()  # payload -> Future[bytes], doubles as the PNG cache
+
+
+def _build(payload):
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr
+
+
+def render_png(payload):
+    with metrics.qr_renders.time():
+        img = _build(payload).make_image(fill='black', back_color='white')
+        buffer = BytesIO()
+        img.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def render_svg(payload):
+    img = _build(payload).make_image(image_factory=qrcode.image.svg.SvgPathImage)
+    buffer = BytesIO()
+    img.save(buffer)
+    return buffer.getvalue()
+
+
+def _b64(data):
+    return urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _unb64(text):
+    return urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(data):
+    return hmac.new(SECRET, data, hashlib.sha256).digest()[:SIGNATURE_BYTES]
+
+
+# The token is the payload plus its HMAC, so any worker process can render it without shared state,
+# and the server only renders payloads it issued itself
+def token_for(payload):
+    data = payload.encode("utf-8")
+    return f"{_b64(data)}.{_b64(_sign(data))}"
+
+
+def payload_for(token):
+    body, _, signature = token.partition(".")
+    try:
+        data, signature = _unb64(body), _unb64(signature)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid QR token")
+    if not hmac.compare_digest(signature, _sign(data)):
+        raise ValueError("Invalid QR token")
+    payload = data.decode("utf-8")
+    if not payload or len(payload) > MAX_PAYLOAD:
+        raise ValueError("Invalid QR payload")
+    return payload
+
+
+def submit(payload):
+    """Queue a PNG render in the background and return the token used to fetch it."""
+    _future(payload)
+    return token_for(payload)
+
+
+def _future(payload):
+    with _lock:
+        future = _renders.get(payload)
+        if future is None:
+            future = _renders[payload] = _executor.submit(render_png, payload)
+            while len(_renders) > CACHE_SIZE:
+                _renders.popitem(last=False)
+        else:
+            _renders.move_to_end(payload)
+    return future
+
+
+def get_png(payload, timeout=None):
+    future = _future(payload)
+    try:
+        return future.result(timeout)
+    except Exception:
+        if future.done():
+            with _lock:
+                if _renders.get(payload) is future:
+                    del _renders[payload]
+        raise
+
+
+def cached_renders():
+    with _lock:
+        return len(_renders)
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
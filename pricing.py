@@ -0,0 +1,112 @@
+from datetime import datetime
+
+import promotions
+
+# The one place catalog prices become what the customer pays. Carts, checkout and the till all
+# price through here, so a line never shows one amount on screen and rings up another.
+#
+# Promotions come on top of the product's own discount. Bundles are taken first, best saving per
+# set first, and only as far as they beat the line promotions they displace; each line's remaining
+# units then get the single line promotion (percent off or buy N pay M, by barcode, manufacturer or
+# product type) that saves the most. Promotions do not stack beyond that. Only bundles tie lines
+# together, which is what lets a cart reprice just the lines linked to the one that changed.
+
+
+def unit_price(product):
+    """Sell price after the product's percentage discount."""
+    return product["sell_price"] * (1 - product["discount"] / 100)
+
+
+def clock(at=None):
+    at = at or datetime.now()
+    return at.timestamp(), at.weekday(), at.hour * 60 + at.minute
+
+
+def best_rule(rules, product, unit, quantity):
+    best, saving = None, 0.0
+    for rule in rules.line_rules(product):
+        amount = rule.savings(unit, quantity)
+        if amount > saving:
+            best, saving = rule, amount
+    return best, saving
+
+
+def apply_bundles(rules, products, units, remaining):
+    """Take bundles out of remaining ({barcode: quantity}, updated in place). A bundle is taken as
+    many times as saves the most over the line promotions its units would otherwise get.
+    Returns {barcode: [savings, names]}, each bundle's saving split in cents by the members' share."""
+    candidates = {}
+    for barcode in remaining:
+        for rule in rules.bundles.get(barcode, ()):
+            if rule.id not in candidates and rules.live(rule) and all(b in units for b, _ in rule.items):
+                full = sum(units[b] * n for b, n in rule.items)
+                if full > rule.price:
+                    candidates[rule.id] = (full - rule.price, full, rule)
+
+    def line_saving(barcode, quantity):
+        return best_rule(rules, products[barcode], units[barcode], quantity)[1] if quantity else 0.0
+
+    bundled = {}
+    for saving, full, rule in sorted(candidates.values(), key=lambda c: -c[0]):
+        kept = {b: line_saving(b, remaining[b]) for b, _ in rule.items}
+        sets, gain = 0, 0.0
+        for k in range(1, min(remaining[b] // n for b, n in rule.items) + 1):
+            lost = sum(kept[b] - line_saving(b, remaining[b] - n * k) for b, n in rule.items)
+            if saving * k - lost > gain:
+                sets, gain = k, saving * k - lost
+        if not sets:
+            continue
+        left = round(saving * sets, 2)
+        for i, (barcode, n) in enumerate(rule.items):
+            share = left if i == len(rule.items) - 1 else round(saving * sets * units[barcode] * n / full, 2)
+            left -= share
+            remaining[barcode] -= n * sets
+            entry = bundled.setdefault(barcode, [0.0, []])
+            entry[0] += share
+            entry[1].append(rule.name)
+    return bundled
+
+
+def price_basket(products, quantities, at=None):
+    """Price {barcode: quantity} against {barcode: product} with the promotions running at `at`
+    (default now). Products need barcode, name, sell_price, discount, manufacturer_code and
+    product_type. Returns (lines, total), lines in the order of quantities."""
+    rules = promotions.current().at(clock(at))
+    units = {barcode: unit_price(products[barcode]) for barcode in quantities}
+    remaining = dict(quantities)
+    bundled = apply_bundles(rules, products, units, remaining) if rules.bundles else {}
+    lines, total = [], 0.0
+    for barcode, quantity in quantities.items():
+        product, unit = products[barcode], units[barcode]
+        saving, names = bundled.get(barcode, (0.0, []))
+        rule, rule_saving = best_rule(rules, product, unit, remaining[barcode]) if remaining[barcode] else (None, 0.0)
+        if rule:
+            saving += rule_saving
+            names = names + [rule.name]
+        line = {
+            "barcode": barcode,
+            "name": product["name"],
+            "price": product["sell_price"],
+            "discount": product["discount"],
+            "unit_price": unit,
+            "quantity": quantity,
+            "savings": saving,
+            "promotions": names,
+            "total": unit * quantity - saving,
+        }
+        lines.append(line)
+        total += line["total"]
+    return lines, total
+
+
+def linked(barcode, barcodes):
+    """barcode plus the barcodes in `barcodes` whose price can move with it through a bundle."""
+    index = promotions.current()
+    group, frontier = {barcode}, [barcode]
+    while frontier:
+        for rule in index.bundles.get(frontier.pop(), ()):
+            for member, _ in rule.items:
+                if member in barcodes and member not in group:
+                    group.add(member)
+                    frontier.append(member)
+    return group
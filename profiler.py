@@ -0,0 +1,94 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Wall-clock sampling profiler that can be switched on in a running server. A daemon thread snapshots
+# every thread's stack with sys._current_frames() and counts identical stacks; the result is in the
+# collapsed format flamegraph.pl and speedscope read. Idle threads (waiting on sockets or queues) are
+# sampled too, rooted at their thread name so they are easy to filter out.
+
+DEFAULT_INTERVAL = 0.005  # seconds between samples
+MIN_INTERVAL = 0.001
+MAX_DURATION = 600        # seconds; a forgotten profiler stops on its own
+MAX_STACKS = 20000        # distinct stacks kept; further new stacks are counted as dropped
+MAX_DEPTH = 64
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.stacks = Counter()
+        self.samples = 0
+        self.dropped = 0
+        self.interval = DEFAULT_INTERVAL
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=DEFAULT_INTERVAL, duration=None):
+        """Start sampling (clearing previous results). Returns False if already running."""
+        with self._lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = self.dropped = 0
+            self.interval = max(interval, MIN_INTERVAL)
+            self.started_at = time.time()
+            self._stop.clear()
+            deadline = time.monotonic() + min(duration or MAX_DURATION, MAX_DURATION)
+            self._thread = threading.Thread(target=self._run, args=(deadline,), name="profiler", daemon=True)
+            self._thread.start()
+        logger.info("Sampling profiler started, interval %.1f ms", self.interval * 1000)
+        return True
+
+    def stop(self):
+        with self._lock:
+            thread = self._thread
+            self._stop.set()
+        if thread is not None:
+            thread.join()
+        return self.samples
+
+    def _run(self, deadline):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(stack))
+                with self._lock:
+                    if key in self.stacks or len(self.stacks) < MAX_STACKS:
+                        self.stacks[key] += 1
+                    else:
+                        self.dropped += 1
+            self.samples += 1
+        logger.info("Sampling profiler stopped after %d samples", self.samples)
+
+    def collapsed(self, limit=None):
+        """One 'frame;frame;frame count' line per distinct stack, most frequent first."""
+        with self._lock:
+            stacks = self.stacks.most_common(limit)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def status(self):
+        return {"running": self.running, "interval_ms": self.interval * 1000, "samples": self.samples,
+                "stacks": len(self.stacks), "dropped": self.dropped, "started_at": self.started_at}
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,282 @@
+import bisect
+import json
+import logging
+import threading
+import time
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Promotions are stored as rows and compiled into a PromotionIndex: line rules keyed by barcode,
+# manufacturer_code and product_type, bundles keyed by each member barcode. Time windows are resolved
+# once per minute into LiveRules, where a product's candidate rules are merged and pruned on first
+# use, so pricing a line is one dict lookup and a rule or two, whatever the number of promotions. The index
+# is rebuilt when promotions_version moves (a trigger bumps it on every write), checked at most
+# every RELOAD_CHECK seconds so workers and other processes pick up edits made elsewhere.
+
+KINDS = ("percent", "multibuy", "bundle")
+SCOPES = ("barcode", "manufacturer_code", "product_type")
+RELOAD_CHECK = 1.0  # seconds
+COLUMNS = ["name", "kind", "scope", "target", "percent", "buy", "pay", "items", "price",
+           "starts_at", "ends_at", "daily_from", "daily_to", "weekdays", "active"]
+
+SELECT_PROMOTIONS = f"SELECT id, {', '.join(COLUMNS)} FROM promotions"
+INSERT_PROMOTION = f"INSERT INTO promotions ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+UPDATE_PROMOTION = f"UPDATE promotions SET {', '.join(f'{c} = ?' for c in COLUMNS)} WHERE id = ?"
+
+
+def init_schema(conn):
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS promotions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            kind TEXT NOT NULL,       -- percent, multibuy (buy N pay M) or bundle
+            scope TEXT,               -- barcode, manufacturer_code or product_type; NULL for bundles
+            target TEXT,
+            percent REAL,
+            buy INTEGER,
+            pay INTEGER,
+            items TEXT,               -- bundle: JSON {barcode: quantity per set}
+            price REAL,               -- bundle: price per set
+            starts_at INTEGER,        -- epoch seconds, NULL for open-ended
+            ends_at INTEGER,
+            daily_from TEXT,          -- "HH:MM" local time; a window past midnight wraps
+            daily_to TEXT,
+            weekdays TEXT,            -- e.g. "0,1,2,3,4", Monday = 0; NULL for every day
+            active INTEGER NOT NULL DEFAULT 1
+        );
+        CREATE TABLE IF NOT EXISTS promotions_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO promotions_version (id, value) VALUES (1, 0);
+        CREATE TRIGGER IF NOT EXISTS promotions_versioned_insert AFTER INSERT ON promotions BEGIN
+            UPDATE promotions_version SET value = value + 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS promotions_versioned_update AFTER UPDATE ON promotions BEGIN
+            UPDATE promotions_version SET value = value + 1 WHERE id = 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS promotions_versioned_delete AFTER DELETE ON promotions BEGIN
+            UPDATE promotions_version SET value = value + 1 WHERE id = 1;
+        END;
+    ''')
+
+
+def minutes(value):
+    hours, mins = value.split(":")
+    if not (0 <= int(hours) < 24 and 0 <= int(mins) < 60):
+        raise ValueError
+    return int(hours) * 60 + int(mins)
+
+
+def parse(data):
+    """Validate a promotion from the API. Returns column values in COLUMNS order; raises ValueError."""
+    if not isinstance(data, dict):
+        raise ValueError("Promotion must be an object")
+    kind = data.get("kind")
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {', '.join(KINDS)}")
+    if not data.get("name"):
+        raise ValueError("name required")
+    row = dict.fromkeys(COLUMNS)
+    row.update(name=str(data["name"]), kind=kind, active=1 if data.get("active", True) else 0)
+    try:
+        if kind == "bundle":
+            items = data.get("items")
+            if not isinstance(items, dict) or len(items) < 2:
+                raise ValueError("a bundle needs items {barcode: quantity} with at least two products")
+            items = {str(barcode): int(quantity) for barcode, quantity in items.items()}
+            if min(items.values()) <= 0 or float(data["price"]) < 0:
+                raise ValueError("bundle quantities must be positive and price not negative")
+            row.update(items=json.dumps(items), price=float(data["price"]))
+        else:
+            if data.get("scope") not in SCOPES or not data.get("target"):
+                raise ValueError(f"scope ({', '.join(SCOPES)}) and target required")
+            row.update(scope=data["scope"], target=str(data["target"]))
+            if kind == "percent":
+                row["percent"] = float(data["percent"])
+                if not 0 < row["percent"] <= 100:
+                    raise ValueError("percent must be in (0, 100]")
+            else:
+                row.update(buy=int(data["buy"]), pay=int(data["pay"]))
+                if not 0 <= row["pay"] < row["buy"]:
+                    raise ValueError("multibuy needs 0 <= pay < buy")
+        for key in ("starts_at", "ends_at"):
+            if data.get(key) is not None:
+                row[key] = int(data[key])
+        if (data.get("daily_from") is None) != (data.get("daily_to") is None):
+            raise ValueError("daily_from and daily_to go together")
+        if data.get("daily_from") is not None:
+            minutes(data["daily_from"]), minutes(data["daily_to"])
+            row.update(daily_from=data["daily_from"], daily_to=data["daily_to"])
+        if data.get("weekdays") is not None:
+            days = sorted({int(day) for day in data["weekdays"]})
+            if not days or days[0] < 0 or days[-1] > 6:
+                raise ValueError("weekdays are 0 (Monday) to 6")
+            row["weekdays"] = ",".join(map(str, days))
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Missing or invalid field for a {kind} promotion: {e}")
+    return [row[c] for c in COLUMNS]
+
+
+def to_dict(row):
+    promotion = dict(row)
+    if promotion["items"]:
+        promotion["items"] = json.loads(promotion["items"])
+    if promotion["weekdays"]:
+        promotion["weekdays"] = [int(day) for day in promotion["weekdays"].split(",")]
+    promotion["active"] = bool(promotion["active"])
+    return {key: value for key, value in promotion.items() if value is not None}
+
+
+class Rule:
+    __slots__ = ("id", "name", "kind", "percent", "buy", "pay", "items", "price",
+                 "starts_at", "ends_at", "daily_from", "daily_to", "weekdays", "timed")
+
+    def __init__(self, row):
+        self.id = row["id"]
+        self.name = row["name"]
+        self.kind = row["kind"]
+        self.percent = row["percent"]
+        self.buy = row["buy"]
+        self.pay = row["pay"]
+        self.items = tuple(json.loads(row["items"]).items()) if row["items"] else ()
+        self.price = row["price"]
+        self.starts_at = row["starts_at"]
+        self.ends_at = row["ends_at"]
+        self.daily_from = minutes(row["daily_from"]) if row["daily_from"] else None
+        self.daily_to = minutes(row["daily_to"]) if row["daily_to"] else None
+        self.weekdays = frozenset(int(day) for day in row["weekdays"].split(",")) if row["weekdays"] else None
+        self.timed = any(value is not None for value in (self.starts_at, self.ends_at, self.weekdays, self.daily_from))
+
+    def applies(self, clock):
+        """clock is (epoch seconds, weekday, minute of day) in local time."""
+        ts, weekday, minute = clock
+        if self.starts_at is not None and ts < self.starts_at:
+            return False
+        if self.ends_at is not None and ts >= self.ends_at:
+            return False
+        if self.weekdays is not None and weekday not in self.weekdays:
+            return False
+        if self.daily_from is not None:
+            if self.daily_from <= self.daily_to:
+                return self.daily_from <= minute < self.daily_to
+            return minute >= self.daily_from or minute < self.daily_to
+        return True
+
+    def savings(self, unit, quantity):
+        if self.kind == "percent":
+            return unit * quantity * self.percent / 100
+        return (quantity // self.buy) * (self.buy - self.pay) * unit
+
+
+class PromotionIndex:
+    def __init__(self, rows=()):
+        self.by_scope = {scope: {} for scope in SCOPES}
+        self.bundles = {}  # member barcode -> bundle rules
+        self.timed = []
+        self.size = 0
+        for row in rows:
+            if not row["active"]:
+                continue
+            rule = Rule(row)
+            self.size += 1
+            if rule.timed:
+                self.timed.append(rule)
+            if rule.kind == "bundle":
+                for barcode, _ in rule.items:
+                    self.bundles.setdefault(barcode, []).append(rule)
+            else:
+                self.by_scope[row["scope"]].setdefault(row["target"], []).append(rule)
+        self.by_barcode = self.by_scope["barcode"]
+        self.by_manufacturer = self.by_scope["manufacturer_code"]
+        self.by_type = self.by_scope["product_type"]
+        # Moments a start or end date switches a rule on or off
+        self.edges = sorted({edge for rule in self.timed for edge in (rule.starts_at, rule.ends_at) if edge is not None})
+        self._live = None
+
+    def at(self, clock):
+        """The rules running at clock, reused until the next minute or start/end date."""
+        live = self._live
+        if live is None or not live.start <= clock[0] < live.end:
+            live = self._live = LiveRules(self, clock)
+        return live
+
+
+class LiveRules:
+    """The index as it stands at one moment: timed rules are resolved once, and each product's
+    candidate line rules are merged and pruned on first use."""
+
+    def __init__(self, index, clock):
+        ts = clock[0]
+        self.index = index
+        self.bundles = index.bundles
+        self.active = frozenset(rule.id for rule in index.timed if rule.applies(clock))
+        if index.timed:
+            # Daily windows move on whole local minutes; start and end dates move on their own second
+            self.start, self.end = ts - ts % 60, ts - ts % 60 + 60
+            i = bisect.bisect_right(index.edges, ts)
+            if i:
+                self.start = max(self.start, index.edges[i - 1])
+            if i < len(index.edges):
+                self.end = min(self.end, index.edges[i])
+        else:
+            self.start, self.end = float("-inf"), float("inf")
+        self._lines = {}  # (barcode, manufacturer_code, product_type) -> candidate line rules
+
+    def live(self, rule):
+        return not rule.timed or rule.id in self.active
+
+    def line_rules(self, product):
+        """The line rules that can win for product: the best percent off and, per multibuy size,
+        the one paying least. Anything else is beaten whatever the quantity."""
+        key = (product["barcode"], product["manufacturer_code"], product["product_type"])
+        rules = self._lines.get(key)
+        if rules is None:
+            percent, multibuys = None, {}
+            index = self.index
+            for rule in (index.by_barcode.get(key[0], []) + index.by_manufacturer.get(key[1], [])
+                         + index.by_type.get(key[2], [])):
+                if not self.live(rule):
+                    continue
+                if rule.kind == "percent":
+                    if percent is None or rule.percent > percent.percent:
+                        percent = rule
+                elif rule.buy not in multibuys or rule.pay < multibuys[rule.buy].pay:
+                    multibuys[rule.buy] = rule
+            rules = self._lines[key] = ([percent] if percent else []) + list(multibuys.values())
+        return rules
+
+
+_lock = threading.Lock()
+_index = PromotionIndex()
+_version = None
+_checked = 0.0
+
+
+def version(conn):
+    row = conn.execute("SELECT value FROM promotions_version WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+
+def reload(conn):
+    global _index, _version
+    with _lock:
+        current = version(conn)
+        _index = PromotionIndex(conn.execute(SELECT_PROMOTIONS).fetchall())
+        _version = current
+    logger.info("Promotion index compiled: %d active promotions", _index.size)
+    return _index
+
+
+def current():
+    """The compiled index, recompiled if promotions changed since the last check."""
+    global _checked
+    now = time.monotonic()
+    if now - _checked >= RELOAD_CHECK:
+        _checked = now
+        with db.pool.connection() as conn:
+            if version(conn) != _version:
+                reload(conn)
+    return _index
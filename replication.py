@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import threading
+import uuid
+
+import cache
+import db
+import events
+
+logger = logging.getLogger(__name__)
+
+# Every product write lands in change_log (by trigger, so routes, till, imports and checkout are all
+# covered): inserts and catalog edits as product.upsert, deletes as product.delete, and any stock
+# change as a stock.delta. Deltas commute, so nodes that sell independently still converge.
+# A follower pulls another node's log from /api/sync/changes and applies it in batches; applied
+# changes keep their origin node and origin sequence and are re-logged, so they propagate further,
+# while the per-origin high-water marks in sync_applied stop a change from applying twice.
+
+NODE_ID = os.environ.get("SUPERMARKET_NODE_ID")
+CHANGES_PAGE = 5000       # changes served per /api/sync/changes request
+APPLY_BATCH = 500         # changes applied per follower transaction
+POLL_INTERVAL = float(os.environ.get("SUPERMARKET_SYNC_INTERVAL", "2"))
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = 30
+
+CATALOG_COLUMNS = ["product_type", "manufacturer_code", "product_code", "name", "buy_price", "sell_price", "discount"]
+_PRODUCT_JSON = ", ".join(f"'{c}', NEW.{c}" for c in CATALOG_COLUMNS)
+LOCAL_WRITE = "WHEN (SELECT applying FROM sync_context WHERE id = 1) = 0"
+
+SELECT_CHANGES = """
+    SELECT seq, origin, COALESCE(origin_seq, seq) AS origin_seq, kind, barcode, data, created_at
+    FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?
+"""
+INSERT_RELAYED = """
+    INSERT INTO change_log (origin, origin_seq, kind, barcode, data, created_at) VALUES (?, ?, ?, ?, ?, ?)
+"""
+APPLY_SQL = {
+    "product.upsert": f"""
+        INSERT INTO products (barcode, {", ".join(CATALOG_COLUMNS)}, stock) VALUES (?, {", ".join("?" * len(CATALOG_COLUMNS))}, ?)
+        ON CONFLICT(barcode) DO UPDATE SET {", ".join(f"{c} = excluded.{c}" for c in CATALOG_COLUMNS)}
+    """,
+    "stock.delta": "UPDATE products SET stock = stock + ? WHERE barcode = ?",
+    "product.delete": "DELETE FROM products WHERE barcode = ?",
+}
+
+
+def init_schema(conn):
+    conn.executescript(f'''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            origin TEXT NOT NULL,
+            origin_seq INTEGER,          -- NULL for changes made on this node: their seq is the origin seq
+            kind TEXT NOT NULL,
+            barcode TEXT NOT NULL,
+            data TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS sync_context (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            node_id TEXT NOT NULL,
+            applying INTEGER NOT NULL DEFAULT 0  -- set while a follower batch writes, muting the triggers
+        );
+        CREATE TABLE IF NOT EXISTS sync_applied (
+            origin TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS sync_peers (
+            url TEXT PRIMARY KEY,
+            last_seq INTEGER NOT NULL
+        );
+        CREATE TRIGGER IF NOT EXISTS change_log_product_insert AFTER INSERT ON products {LOCAL_WRITE} BEGIN
+            INSERT INTO change_log (origin, kind, barcode, data, created_at)
+            VALUES ((SELECT node_id FROM sync_context WHERE id = 1), 'product.upsert', NEW.barcode,
+                    json_object({_PRODUCT_JSON}, 'stock', NEW.stock), CAST(strftime('%s', 'now') AS INTEGER));
+        END;
+        CREATE TRIGGER IF NOT EXISTS change_log_product_update
+        AFTER UPDATE OF {", ".join(CATALOG_COLUMNS)} ON products {LOCAL_WRITE} BEGIN
+            INSERT INTO change_log (origin, kind, barcode, data, created_at)
+            VALUES ((SELECT node_id FROM sync_context WHERE id = 1), 'product.upsert', NEW.barcode,
+                    json_object({_PRODUCT_JSON}, 'stock', NEW.stock), CAST(strftime('%s', 'now') AS INTEGER));
+        END;
+        CREATE TRIGGER IF NOT EXISTS change_log_stock AFTER UPDATE OF stock ON products
+        WHEN NEW.stock != OLD.stock AND (SELECT applying FROM sync_context WHERE id = 1) = 0 BEGIN
+            INSERT INTO change_log (origin, kind, barcode, data, created_at)
+            VALUES ((SELECT node_id FROM sync_context WHERE id = 1), 'stock.delta', NEW.barcode,
+                    json_object('delta', NEW.stock - OLD.stock), CAST(strftime('%s', 'now') AS INTEGER));
+        END;
+        CREATE TRIGGER IF NOT EXISTS change_log_product_delete AFTER DELETE ON products {LOCAL_WRITE} BEGIN
+            INSERT INTO change_log (origin, kind, barcode, data, created_at)
+            VALUES ((SELECT node_id FROM sync_context WHERE id = 1), 'product.delete', OLD.barcode, '{{}}',
+                    CAST(strftime('%s', 'now') AS INTEGER));
+        END;
+    ''')
+    row = conn.execute("SELECT node_id FROM sync_context WHERE id = 1").fetchone()
+    if row is None:
+        conn.execute("INSERT INTO sync_context (id, node_id) VALUES (1, ?)", (NODE_ID or uuid.uuid4().hex[:12],))
+    elif NODE_ID and row['node_id'] != NODE_ID:
+        conn.execute("UPDATE sync_context SET node_id = ? WHERE id = 1", (NODE_ID,))
+    # A crash mid-batch rolls back, but clear the flag in case the database was copied while applying
+    conn.execute("UPDATE sync_context SET applying = 0 WHERE id = 1")
+
+
+def node_id(conn):
+    return conn.execute("SELECT node_id FROM sync_context WHERE id = 1").fetchone()[0]
+
+
+def head(conn):
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+
+
+def stream_changes(since, limit=CHANGES_PAGE):
+    """NDJSON lines for changes after since, in log order; holds its own pooled connection."""
+    with db.pool.connection() as conn:
+        for row in conn.execute(SELECT_CHANGES, (since, limit)):
+            yield (f'{{"seq": {row["seq"]}, "origin": {json.dumps(row["origin"])}, "origin_seq": {row["origin_seq"]}, '
+                   f'"kind": {json.dumps(row["kind"])}, "barcode": {json.dumps(row["barcode"])}, '
+                   f'"data": {row["data"]}, "created_at": {row["created_at"]}}}\n')
+
+
+def apply_changes(conn, peer, changes):
+    """Apply a batch pulled from peer in one transaction and advance its cursor.
+    Returns the number of changes applied (changes already seen are skipped)."""
+    if not changes:
+        return 0
+    touched = set()
+    applied = 0
+    with db.transaction(conn):
+        local = node_id(conn)
+        marks = dict(conn.execute("SELECT origin, seq FROM sync_applied").fetchall())
+        fresh = []
+        for change in changes:
+            origin, origin_seq = change["origin"], change["origin_seq"]
+            if origin == local or origin_seq <= marks.get(origin, 0):
+                continue
+            marks[origin] = origin_seq
+            fresh.append(change)
+        conn.execute("UPDATE sync_context SET applying = 1 WHERE id = 1")
+        # Consecutive changes of one kind go in one executemany; order across kinds is preserved
+        run_kind, run = None, []
+        for change in fresh + [None]:
+            kind = change["kind"] if change else None
+            if run and kind != run_kind:
+                conn.executemany(APPLY_SQL[run_kind], run)
+                run = []
+            if change is None:
+                break
+            run_kind = kind
+            data, barcode = change["data"], change["barcode"]
+            if kind == "product.upsert":
+                run.append((barcode, *(data.get(c) for c in CATALOG_COLUMNS), data.get("stock", 0)))
+            elif kind == "stock.delta":
+                run.append((data["delta"], barcode))
+            elif kind == "product.delete":
+                run.append((barcode,))
+            else:
+                raise ValueError(f"Unknown change kind: {kind}")
+            touched.add(barcode)
+        conn.executemany(INSERT_RELAYED, [(c["origin"], c["origin_seq"], c["kind"], c["barcode"], json.dumps(c["data"]),
+                                           c["created_at"]) for c in fresh])
+        conn.execute("UPDATE sync_context SET applying = 0 WHERE id = 1")
+        conn.executemany("INSERT INTO sync_applied (origin, seq) VALUES (?, ?) ON CONFLICT(origin) DO UPDATE SET seq = excluded.seq",
+                         [(origin, seq) for origin, seq in marks.items()])
+        conn.execute("INSERT INTO sync_peers (url, last_seq) VALUES (?, ?) ON CONFLICT(url) DO UPDATE SET last_seq = excluded.last_seq",
+                     (peer, changes[-1]["seq"]))
+        applied = len(fresh)
+    for barcode in touched:
+        cache.products.invalidate(barcode)
+    return applied
+
+
+def status(conn):
+    return {
+        "node_id": node_id(conn),
+        "head": head(conn),
+        "applied": dict(conn.execute("SELECT origin, seq FROM sync_applied ORDER BY origin").fetchall()),
+        "peers": dict(conn.execute("SELECT url, last_seq FROM sync_peers ORDER BY url").fetchall()),
+    }
+
+
+class Follower:
+    """Pulls a peer's change log and applies it here, APPLY_BATCH changes per transaction."""
+
+    def __init__(self, peer_url, interval=POLL_INTERVAL):
+        import requests
+        self.peer = peer_url.rstrip("/")
+        self.interval = interval
+        self.session = requests.Session()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"follow {self.peer}", daemon=True)
+        self._thread.start()
+        logger.info("Following %s", self.peer)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.session.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                pulled = self.sync_once()
+            except Exception as e:
+                logger.error("Sync from %s failed: %s", self.peer, e)
+                pulled = 0
+            # A full page means more is waiting; otherwise idle until the next poll
+            if pulled < CHANGES_PAGE:
+                self._stop.wait(self.interval)
+
+    def sync_once(self):
+        """Pull one page of changes and apply it. Returns how many changes the peer sent."""
+        with db.pool.connection() as conn:
+            row = conn.execute("SELECT last_seq FROM sync_peers WHERE url = ?", (self.peer,)).fetchone()
+            since = row['last_seq'] if row else 0
+            # verify per request: a session-level False is overridden by REQUESTS_CA_BUNDLE
+            with self.session.get(f"{self.peer}/api/sync/changes", params={"since": since, "limit": CHANGES_PAGE},
+                                  stream=True, verify=False, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as response:
+                response.raise_for_status()
+                pulled = applied = 0
+                batch = []
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    batch.append(json.loads(line))
+                    if len(batch) >= APPLY_BATCH:
+                        applied += apply_changes(conn, self.peer, batch)
+                        pulled += len(batch)
+                        batch = []
+                applied += apply_changes(conn, self.peer, batch)
+                pulled += len(batch)
+        if applied:
+            events.bus.publish("catalog.synced", {"peer": self.peer, "applied": applied})
+            logger.info("Applied %d changes from %s", applied, self.peer)
+        return pulled
+
+
+def start_followers(peers):
+    return [Follower(peer).start() for peer in peers]
@@ -0,0 +1,247 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import cache
+import db
+
+logger = logging.getLogger(__name__)
+
+# Carts hold stock while they are open, so two lanes cannot both put the last unit in a basket.
+# Holds live in an in-memory ledger: available = products.stock - sold but not yet flushed - held.
+# Checkout confirms a cart's holds and writes the order plus stock_pending rows; a background
+# flusher subtracts the pending quantities from products.stock in one batched transaction, so
+# checkouts of a hot product no longer each rewrite its row. Pending rows survive a crash and are
+# applied at startup. Holds are released when the cart is cleared, checked out or idle for TTL.
+
+RESERVATION_TTL = float(os.environ.get("SUPERMARKET_RESERVATION_TTL", "900"))     # seconds idle before a cart's holds lapse
+FLUSH_INTERVAL = float(os.environ.get("SUPERMARKET_STOCK_FLUSH_INTERVAL", "1.0"))  # seconds between stock flushes
+MAX_CART_ID = 64
+
+INSERT_PENDING = "INSERT INTO stock_pending (barcode, quantity) VALUES (?, ?)"
+
+
+class InsufficientStock(Exception):
+    def __init__(self, barcode, available):
+        super().__init__(f"Insufficient stock: {barcode}")
+        self.barcode = barcode
+        self.available = available
+
+
+class UnknownProduct(Exception):
+    def __init__(self, barcode):
+        super().__init__(f"Invalid product: {barcode}")
+        self.barcode = barcode
+
+
+def init_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock_pending (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            barcode TEXT NOT NULL,
+            quantity INTEGER NOT NULL
+        )
+    ''')
+    # Sales a previous process confirmed but never flushed; nothing is held in memory yet
+    with db.transaction(conn):
+        applied = apply_pending(conn)
+    if applied:
+        logger.info("Applied unflushed stock for %d products", len(applied))
+
+
+def apply_pending(conn):
+    """Subtract pending sales from products.stock inside the caller's transaction.
+    Returns {barcode: quantity} applied."""
+    last = conn.execute("SELECT MAX(id) FROM stock_pending").fetchone()[0]
+    if last is None:
+        return {}
+    applied = dict(conn.execute("SELECT barcode, SUM(quantity) FROM stock_pending WHERE id <= ? GROUP BY barcode",
+                                (last,)).fetchall())
+    conn.executemany("UPDATE products SET stock = stock - ? WHERE barcode = ?", [(q, b) for b, q in applied.items()])
+    conn.execute("DELETE FROM stock_pending WHERE id <= ?", (last,))
+    return applied
+
+
+def stock_levels(conn, barcodes):
+    placeholders = ",".join("?" * len(barcodes))
+    return dict(conn.execute(f"SELECT barcode, stock FROM products WHERE barcode IN ({placeholders})", barcodes).fetchall())
+
+
+class Ledger:
+    def __init__(self, ttl=RESERVATION_TTL, flush_interval=FLUSH_INTERVAL):
+        self.enabled = True  # off in multi-worker servers, where checkout decrements stock directly
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._settled = threading.Condition(self._lock)
+        self._carts = {}      # cart_id -> {"items": {barcode: quantity}, "expires": monotonic deadline}
+        self._held = {}       # barcode -> quantity held by all carts
+        self._unflushed = {}  # barcode -> quantity sold but not yet subtracted from products.stock
+        self._generation = 0  # odd while pending stock is being applied
+        self._thread = None
+        self._pid = None
+
+    def _available(self, barcode, stock, cart):
+        # Caller holds the lock
+        return stock - self._unflushed.get(barcode, 0) - self._held.get(barcode, 0) + cart.get(barcode, 0)
+
+    def _snapshot(self, conn, barcodes):
+        # products.stock and the unflushed counts change together when pending stock is applied,
+        # so re-read if a flush committed in between; returns with the lock held
+        while True:
+            with self._settled:
+                while self._generation % 2:
+                    self._settled.wait()
+                generation = self._generation
+            stock = stock_levels(conn, barcodes)
+            self._lock.acquire()
+            if generation == self._generation:
+                return stock
+            self._lock.release()
+
+    def reserve(self, conn, cart_id, quantities, replace=False):
+        """Set cart_id's holds to quantities ({barcode: quantity}, 0 releases). With replace,
+        barcodes not listed are released too. All or nothing: raises UnknownProduct or
+        InsufficientStock without changing any hold. Returns {barcode: quantity still available to other carts}."""
+        self._ensure_worker()
+        stock = self._snapshot(conn, list(quantities))
+        try:
+            cart = self._carts.get(cart_id, {}).get("items", {})
+            for barcode, quantity in quantities.items():
+                if barcode not in stock:
+                    if quantity > 0:
+                        raise UnknownProduct(barcode)
+                    continue
+                available = self._available(barcode, stock[barcode], cart)
+                if quantity > available:
+                    raise InsufficientStock(barcode, max(available, 0))
+            items = {} if replace else dict(cart)
+            items.update(quantities)
+            self._set(cart_id, {barcode: quantity for barcode, quantity in items.items() if quantity > 0})
+            return {barcode: stock.get(barcode, 0) - self._unflushed.get(barcode, 0) - self._held.get(barcode, 0)
+                    for barcode in quantities}
+        finally:
+            self._lock.release()
+
+    def _set(self, cart_id, items):
+        # Caller holds the lock
+        old = self._carts.pop(cart_id, None)
+        if old:
+            for barcode, quantity in old["items"].items():
+                self._release_held(barcode, quantity)
+        if items:
+            self._carts[cart_id] = {"items": items, "expires": time.monotonic() + self.ttl}
+            for barcode, quantity in items.items():
+                self._held[barcode] = self._held.get(barcode, 0) + quantity
+
+    def _release_held(self, barcode, quantity):
+        left = self._held.get(barcode, 0) - quantity
+        if left > 0:
+            self._held[barcode] = left
+        else:
+            self._held.pop(barcode, None)
+
+    def holds(self, cart_id):
+        with self._lock:
+            cart = self._carts.get(cart_id)
+            return dict(cart["items"]) if cart else {}
+
+    def release(self, cart_id):
+        with self._lock:
+            self._set(cart_id, {})
+
+    def confirm(self, cart_id, quantities):
+        """The cart's sale committed: its holds become unflushed sales."""
+        with self._lock:
+            self._set(cart_id, {})
+            for barcode, quantity in quantities.items():
+                self._unflushed[barcode] = self._unflushed.get(barcode, 0) + quantity
+
+    def expire(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [cart_id for cart_id, cart in self._carts.items() if cart["expires"] <= now]
+            for cart_id in expired:
+                self._set(cart_id, {})
+        if expired:
+            logger.info("Released stock held by %d idle carts", len(expired))
+        return len(expired)
+
+    @contextmanager
+    def settling(self, conn=None):
+        """Write transaction that first applies pending sales to products.stock. Use it for any
+        write that sets stock outright, so sales confirmed before it are not subtracted again after.
+        Reservations wait only from just before the commit until the ledger has caught up."""
+        conn = conn or db.get_db()
+        applied = {}
+        marked = committed = False
+        try:
+            with db.transaction(conn):
+                applied = apply_pending(conn)
+                yield conn
+                with self._lock:
+                    self._generation += 1
+                marked = True
+            committed = True
+        finally:
+            if marked:
+                with self._settled:
+                    if committed:
+                        for barcode, quantity in applied.items():
+                            left = self._unflushed.get(barcode, 0) - quantity
+                            if left:
+                                self._unflushed[barcode] = left
+                            else:
+                                self._unflushed.pop(barcode, None)
+                    self._generation += 1
+                    self._settled.notify_all()
+        # Dropped rather than adjusted: a lookup that missed after the commit may already have cached
+        # the flushed row, and subtracting again would leave it too low
+        for barcode in applied:
+            cache.products.invalidate(barcode)
+
+    def flush(self, conn):
+        with self.settling(conn):
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {"carts": len(self._carts), "held": sum(self._held.values()),
+                    "unflushed": sum(self._unflushed.values())}
+
+    def _ensure_worker(self):
+        # Started on first use, and again in a forked worker, where the thread did not survive
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="stock-flush", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.expire()
+                with db.pool.connection() as conn:
+                    self.flush(conn)
+            except Exception as e:
+                logger.error("Stock flush failed: %s", e)
+
+    def shutdown(self):
+        if self._thread is None or self._pid != os.getpid():
+            return
+        try:
+            with db.pool.connection() as conn:
+                self.flush(conn)
+        except Exception as e:
+            logger.error("Final stock flush failed: %s", e)
+
+
+ledger = Ledger()
+atexit.register(ledger.shutdown)
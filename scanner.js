@@ -29,10 +29,47 @@ document.addEventListener("DOMContentLoaded", () => {
     const cartBody = document.getElementById("cart-body");
     const totalDiv = document.getElementById("total");
     let isScanning = false;
-    let cart = [];
+    // The basket is a server-side cart: each scan sends one line and gets back that line priced plus
+    // the cart's running subtotal, so only one table row is redrawn. Opening the page with ?cart=<id>
+    // (the id the till shows) scans into the till's cart. Offline scans are kept here unpriced and
+    // are priced when the sale reaches the server.
+    const cart = new Map(); // barcode -> { barcode, name, price, quantity, total, pending }
+    const cartRows = new Map(); // barcode -> table row
+    const sharedCartId = new URLSearchParams(window.location.search).get("cart");
+    let cartId = sharedCartId;
+    let cartSubtotal = 0;
+    let cartVersion = 0;
     let currentStream = null; // Track the camera stream to stop it properly
+    let pendingBarcodes = []; // Detections waiting for the next batched lookup
+    const detectedFormats = {}; // barcode -> Quagga format, sent so the server validates the right symbology
+    let lookupTimer = null;
+    const LOOKUP_BATCH_DELAY = 150; // ms to collect detections before one lookup request
 
-    // Fetch server IP dynamically
+    // A code is accepted after CONFIRM_READS identical low-error reads within CONFIRM_WINDOW, which
+    // filters the one-frame misreads a single read lets through. While an accepted code keeps being
+    // read (the item is still in view) it is suppressed, until it has been out of view for REPEAT_COOLDOWN.
+    const CONFIRM_READS = 3;
+    const CONFIRM_WINDOW = 1000; // ms
+    const REPEAT_COOLDOWN = 2500; // ms
+    const MAX_READ_ERROR = 0.2; // median per-character decode error above which a read is ignored
+    const continuousToggle = document.getElementById("continuous-toggle");
+    const candidateReads = new Map(); // barcode -> timestamps of recent unconfirmed reads
+    const recentlyAccepted = new Map(); // barcode -> last time an accepted code was read
+
+    // Offline-first: scans resolve against an IndexedDB copy of the catalog kept current with
+    // updated_since deltas, and sales / new products go through an outbox replayed in order.
+    // Each queued sale carries a client_txn_id so the server records it once however often it is sent.
+    const DB_NAME = "supermarket-scanner";
+    const DB_VERSION = 1;
+    const SYNC_INTERVAL = 30000; // ms between catalog syncs and outbox replays
+    const MAX_STOCK_RETRIES = 20; // replays a sale short of stock gets (about 10 minutes of syncs) before it is dropped
+    const SYNC_PAGE_SIZE = 2000;
+    const SYNC_FIELDS = "id,barcode,name,sell_price,discount,stock";
+    const dbPromise = openDatabase();
+    let syncPromise = null;
+    let replayPromise = Promise.resolve([]);
+
+    // Fetch server IP dynamically; fall back to the last known server when the network is down
     fetch('/api/server-ip')
         .then(response => {
             if (!response.ok) throw new Error("Failed to fetch server IP");
@@ -41,17 +78,24 @@ document.addEventListener("DOMContentLoaded", () => {
         .then(data => {
             const SERVER_IP = data.ip;
             BASE_URL = `https://${SERVER_IP}:5000`;
+            localStorage.setItem("baseUrl", BASE_URL);
             statusDiv.textContent = "Server IP detected: " + SERVER_IP;
             console.log("Server IP:", SERVER_IP);
             initializeScanner();
         })
         .catch(err => {
-            statusDiv.textContent = "Error fetching IP: " + err.message;
+            BASE_URL = localStorage.getItem("baseUrl") || "";
+            statusDiv.textContent = "Offline - using saved catalog (" + err.message + ")";
             statusDiv.classList.add("error");
             console.error("IP fetch error:", err);
+            initializeScanner();
         });
 
     function initializeScanner() {
+        continuousToggle.checked = localStorage.getItem("continuousScan") !== "false";
+        continuousToggle.addEventListener("change", () => {
+            localStorage.setItem("continuousScan", continuousToggle.checked);
+        });
         startBtn.addEventListener("click", () => {
             if (!isScanning) {
                 statusDiv.textContent = "Requesting camera...";
@@ -76,6 +120,148 @@ document.addEventListener("DOMContentLoaded", () => {
         stopBtn.addEventListener("click", stopScanner);
         checkoutBtn.addEventListener("click", checkout);
         clearBtn.addEventListener("click", clearCart);
+
+        window.addEventListener("online", syncAndReplay);
+        setInterval(syncAndReplay, SYNC_INTERVAL);
+        syncAndReplay();
+    }
+
+    function openDatabase() {
+        return new Promise((resolve, reject) => {
+            const request = indexedDB.open(DB_NAME, DB_VERSION);
+            request.onupgradeneeded = () => {
+                const database = request.result;
+                database.createObjectStore("products", { keyPath: "barcode" });
+                database.createObjectStore("meta");
+                database.createObjectStore("outbox", { keyPath: "id", autoIncrement: true });
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        });
+    }
+
+    // Run fn against one object store in a transaction; resolves with the result of the request fn returns
+    async function idb(storeName, mode, fn) {
+        const database = await dbPromise;
+        return new Promise((resolve, reject) => {
+            const tx = database.transaction(storeName, mode);
+            const request = fn(tx.objectStore(storeName));
+            tx.oncomplete = () => resolve(request ? request.result : undefined);
+            tx.onerror = () => reject(tx.error);
+            tx.onabort = () => reject(tx.error);
+        });
+    }
+
+    function syncAndReplay() {
+        syncCatalog().catch(err => console.warn("Catalog sync failed:", err.message));
+        replayOutbox();
+    }
+
+    function syncCatalog() {
+        if (!syncPromise) {
+            syncPromise = pullCatalogChanges().finally(() => { syncPromise = null; });
+        }
+        return syncPromise;
+    }
+
+    async function pullCatalogChanges() {
+        if (!BASE_URL) return;
+        const since = await idb("meta", "readonly", store => store.get("catalogVersion"));
+        const params = new URLSearchParams({ fields: SYNC_FIELDS, limit: SYNC_PAGE_SIZE });
+        if (since !== undefined) params.set("updated_since", since);
+        // The first page's version is the resume point: anything changed mid-walk is newer and comes next time
+        let version = null;
+        let headers = since !== undefined ? { "If-None-Match": `"v${since}"` } : {};
+        while (true) {
+            const response = await fetch(`${BASE_URL}/api/products?${params}`, { headers });
+            if (response.status === 304) return;
+            if (!response.ok) throw new Error("Server error");
+            version = version ?? response.headers.get("X-Catalog-Version");
+            const page = await response.json();
+            await idb("products", "readwrite", store => {
+                page.forEach(product => product.deleted ? store.delete(product.barcode) : store.put(product));
+            });
+            const cursor = response.headers.get("X-Next-Cursor");
+            if (!cursor) break;
+            params.set("after", cursor);
+            headers = {};
+        }
+        await idb("meta", "readwrite", store => store.put(Number(version), "catalogVersion"));
+    }
+
+    async function lookupLocal(barcodes) {
+        const products = {};
+        await idb("products", "readonly", store => {
+            barcodes.forEach(barcode => {
+                store.get(barcode).onsuccess = event => {
+                    if (event.target.result) products[barcode] = event.target.result;
+                };
+            });
+        });
+        return products;
+    }
+
+    function enqueue(kind, body) {
+        return idb("outbox", "readwrite", store => store.add({ kind, body, queuedAt: Date.now() }));
+    }
+
+    function pendingCount() {
+        return idb("outbox", "readonly", store => store.count());
+    }
+
+    // Replays queued writes oldest first. Network and 5xx failures stop the run and keep the entry.
+    // A sale refused for a stock shortfall (409) stays queued, without holding up later entries,
+    // for up to MAX_STOCK_RETRIES replays in case stock comes back, then is dropped; other
+    // rejections drop it at once, since retrying cannot succeed.
+    function replayOutbox() {
+        replayPromise = replayPromise.then(() => sendOutbox()).catch(error => {
+            console.error("Outbox replay failed:", error);
+            return [];
+        });
+        return replayPromise;
+    }
+
+    async function sendOutbox() {
+        const completed = [];
+        if (!BASE_URL) return completed;
+        const entries = await idb("outbox", "readonly", store => store.getAll());
+        for (const entry of entries) {
+            const url = entry.kind === "transaction" ? "/api/transaction" : "/api/products";
+            let response;
+            try {
+                response = await fetch(`${BASE_URL}${url}`, {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    body: JSON.stringify(entry.body)
+                });
+            } catch (err) {
+                break;
+            }
+            if (response.status >= 500) break;
+            const data = await response.json().catch(() => ({}));
+            if (entry.kind === "transaction" && response.status === 409) {
+                entry.conflicts = (entry.conflicts || 0) + 1;
+                if (entry.conflicts < MAX_STOCK_RETRIES) {
+                    // Out of stock right now: the sale stays queued for a later replay
+                    await idb("outbox", "readwrite", store => store.put(entry));
+                    completed.push({ entry, ok: false, conflict: true, data });
+                    continue;
+                }
+            }
+            if (!response.ok && !(entry.kind === "product" && response.status === 409)) {
+                console.error(`Dropped queued ${entry.kind}:`, data.error || response.status);
+                statusDiv.textContent = `Queued ${entry.kind} rejected: ${data.error || response.status}`;
+                statusDiv.classList.add("error");
+            }
+            await idb("outbox", "readwrite", store => store.delete(entry.id));
+            completed.push({ entry, ok: response.ok, data });
+        }
+        return completed;
+    }
+
+    function newTxnId() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
     }
 
     function startScanner(stream) {
@@ -91,34 +277,65 @@ document.addEventListener("DOMContentLoaded", () => {
                 currentStream = null;
                 return;
             }
+            if (!continuousToggle.checked) {
+                recentlyAccepted.clear(); // A deliberate restart may be for another of the same item
+            }
             Quagga.start();
             isScanning = true;
             resultDiv.textContent = "Scanning for barcodes...";
-            statusDiv.textContent = "Scanning...";
+            statusDiv.textContent = continuousToggle.checked ? "Scanning continuously..." : "Scanning...";
             statusDiv.classList.remove("error", "success");
             console.log("Scanner started successfully");
         });
 
-        Quagga.onDetected((data) => {
-            const barcode = data.codeResult.code;
-            resultDiv.textContent = `Detected: ${barcode}`;
-            statusDiv.textContent = "Barcode detected!";
-            statusDiv.classList.add("success");
-            console.log("Detected barcode:", barcode, "Format:", data.codeResult.format);
-            addToCart(barcode);
-            stopScanner(); // Stop scanning after detection
-        });
+        Quagga.onDetected(handleDetection);
+    }
 
-        Quagga.onProcessed((result) => {
-            if (!result || !result.codeResult) {
-                console.log("Processing frame: No barcode detected yet");
-            }
-        });
+    function handleDetection(data) {
+        const barcode = data.codeResult.code;
+        if (!barcode || readError(data.codeResult) > MAX_READ_ERROR) return;
+        const now = Date.now();
+        for (const [code, seenAt] of recentlyAccepted) {
+            if (now - seenAt >= REPEAT_COOLDOWN) recentlyAccepted.delete(code);
+        }
+        if (recentlyAccepted.has(barcode)) {
+            recentlyAccepted.set(barcode, now);
+            return;
+        }
+        for (const [code, reads] of candidateReads) {
+            if (now - reads[reads.length - 1] >= CONFIRM_WINDOW) candidateReads.delete(code);
+        }
+        const reads = (candidateReads.get(barcode) || []).filter(t => now - t < CONFIRM_WINDOW);
+        reads.push(now);
+        if (reads.length < CONFIRM_READS) {
+            candidateReads.set(barcode, reads);
+            return;
+        }
+        candidateReads.clear();
+        recentlyAccepted.set(barcode, now);
+
+        resultDiv.textContent = `Detected: ${barcode}`;
+        statusDiv.textContent = "Barcode detected!";
+        statusDiv.classList.add("success");
+        addToCart(barcode, data.codeResult.format);
+        if (!continuousToggle.checked) {
+            stopScanner(); // Single-scan mode stops after each item
+        }
+    }
+
+    function readError(codeResult) {
+        const errors = (codeResult.decodedCodes || [])
+            .filter(code => code.error !== undefined)
+            .map(code => code.error)
+            .sort((a, b) => a - b);
+        return errors.length ? errors[Math.floor(errors.length / 2)] : 0;
     }
 
     function stopScanner() {
         if (isScanning) {
+            Quagga.offDetected(handleDetection);
             Quagga.stop();
+            candidateReads.clear();
             isScanning = false;
             if (currentStream) {
                 currentStream.getTracks().forEach(track => track.stop());
@@ -131,96 +348,205 @@ document.addEventListener("DOMContentLoaded", () => {
         }
     }
 
-    function addToCart(barcode) {
-        fetch(`${BASE_URL}/api/products/barcode/${barcode}`)
-            .then(response => {
-                if (!response.ok && response.status !== 404) throw new Error("Server error");
-                return response.json();
-            })
-            .then(data => {
-                if (data.error) {
-                    fetch(`${BASE_URL}/api/products`, {
-                        method: "POST",
-                        headers: { "Content-Type": "application/json" },
-                        body: JSON.stringify({ barcode })
-                    }).then(() => console.log("New product queued"));
-                    return;
-                }
-                const product = { barcode, name: data.name, price: data.sell_price, quantity: 1 };
-                const existing = cart.find(item => item.barcode === barcode);
-                if (existing) {
-                    existing.quantity += 1;
+    function addToCart(barcode, format) {
+        if (format) detectedFormats[barcode] = format;
+        pendingBarcodes.push(barcode);
+        if (!lookupTimer) {
+            lookupTimer = setTimeout(flushLookups, LOOKUP_BATCH_DELAY);
+        }
+    }
+
+    async function flushLookups() {
+        const barcodes = pendingBarcodes;
+        pendingBarcodes = [];
+        lookupTimer = null;
+        const products = await lookupLocal([...new Set(barcodes)]).catch(() => ({}));
+        const missing = [...new Set(barcodes.filter(barcode => !products[barcode]))];
+        if (missing.length && BASE_URL) {
+            // Not in the snapshot yet (or no snapshot): ask the server, offline falls through to the outbox
+            try {
+                const response = await fetch(`${BASE_URL}/api/products/barcodes`, {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    body: JSON.stringify({ barcodes: missing })
+                });
+                if (!response.ok) throw new Error("Server error");
+                const data = await response.json();
+                missing.forEach(barcode => {
+                    const product = data.results[barcode];
+                    if (product && !product.error) products[barcode] = product;
+                });
+                await idb("products", "readwrite", store => {
+                    missing.forEach(barcode => products[barcode] && store.put(products[barcode]));
+                });
+            } catch (error) {
+                console.warn("Lookup failed, queueing unknown barcodes:", error.message);
+            }
+        }
+        const unknown = new Set();
+        barcodes.forEach(barcode => {
+            if (products[barcode]) {
+                addProductToCart(barcode, products[barcode]);
+            } else {
+                unknown.add(barcode);
+            }
+        });
+        if (unknown.size) {
+            // New products are priced on the till; queue them so they reach it once we are back online
+            await Promise.all([...unknown].map(barcode => enqueue("product", { barcode, symbology: detectedFormats[barcode] })));
+            resultDiv.textContent += " | New product sent for pricing";
+            replayOutbox();
+        }
+    }
+
+    async function addProductToCart(barcode, data) {
+        const line = cart.get(barcode);
+        if (BASE_URL) {
+            cartId = cartId || newTxnId();
+            let response;
+            try {
+                response = await fetch(`${BASE_URL}/api/carts/${cartId}/items`, {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    body: JSON.stringify({ barcode, quantity: 1 + (line ? line.pending : 0) })
+                });
+            } catch (err) {
+                response = null;
+            }
+            if (response && response.status < 500) {
+                const result = await response.json().catch(() => ({}));
+                if (response.ok) {
+                    applyCartChange(result);
+                    statusDiv.textContent = "Added to cart - Ready for next scan";
+                    statusDiv.classList.add("success");
+                    statusDiv.classList.remove("error");
                 } else {
-                    cart.push(product);
+                    statusDiv.textContent = `${data.name}: ${result.error || "could not add"}`;
+                    statusDiv.classList.remove("success");
+                    statusDiv.classList.add("error");
                 }
-                updateCartDisplay();
-                statusDiv.textContent = "Added to cart - Ready for next scan";
-                statusDiv.classList.add("success");
-                statusDiv.classList.remove("error");
-            })
-            .catch(error => {
-                resultDiv.textContent += ` | Error: ${error.message}`;
-                statusDiv.textContent = "Failed";
-                statusDiv.classList.add("error");
-                console.error("Fetch error:", error);
-            });
+                return;
+            }
+        }
+        // Offline: count the scan here; the server prices it when the sale or the next scan gets through
+        const offline = line || { barcode, name: data.name, price: data.sell_price, quantity: 0, total: null, pending: 0 };
+        offline.quantity += 1;
+        offline.pending += 1;
+        offline.total = null;
+        cart.set(barcode, offline);
+        renderCartLine(offline);
+        renderCartTotal();
+        statusDiv.textContent = "Added to cart (offline) - Ready for next scan";
+        statusDiv.classList.add("success");
+        statusDiv.classList.remove("error");
     }
 
-    function updateCartDisplay() {
-        cartBody.innerHTML = "";
-        let total = 0;
-        cart.forEach(item => {
-            const subtotal = item.price * item.quantity;
-            total += subtotal;
-            const tr = document.createElement("tr");
-            tr.innerHTML = `
-                <td>${item.barcode}</td>
-                <td>${item.name}</td>
-                <td>$${item.price.toFixed(2)}</td>
-                <td>${item.quantity}</td>
-                <td>$${subtotal.toFixed(2)}</td>
-            `;
+    function applyCartChange(change) {
+        if (change.version <= cartVersion) return; // an older response overtaken by a newer one
+        cartVersion = change.version;
+        const line = { ...change.line, pending: 0 };
+        if (line.quantity > 0) {
+            cart.set(line.barcode, line);
+        } else {
+            cart.delete(line.barcode);
+        }
+        renderCartLine(line);
+        // Lines a bundle promotion ties to this one, repriced with it
+        for (const other of change.repriced || []) {
+            const repriced = { ...other, pending: cart.get(other.barcode)?.pending || 0 };
+            cart.set(repriced.barcode, repriced);
+            renderCartLine(repriced);
+        }
+        cartSubtotal = change.subtotal;
+        renderCartTotal();
+    }
+
+    function renderCartLine(line) {
+        let tr = cartRows.get(line.barcode);
+        if (line.quantity <= 0) {
+            if (tr) tr.remove();
+            cartRows.delete(line.barcode);
+            return;
+        }
+        if (!tr) {
+            tr = document.createElement("tr");
+            cartRows.set(line.barcode, tr);
             cartBody.appendChild(tr);
-        });
-        totalDiv.textContent = `Total: $${total.toFixed(2)}`;
+        }
+        tr.innerHTML = `
+            <td>${line.barcode}</td>
+            <td>${line.name}</td>
+            <td>$${line.price.toFixed(2)}</td>
+            <td>${line.quantity}</td>
+            <td>${line.total === null ? "pending" : "$" + line.total.toFixed(2)}</td>
+        `;
     }
 
-    function checkout() {
-        if (!cart.length) {
+    function renderCartTotal() {
+        const unpriced = [...cart.values()].some(line => line.total === null);
+        totalDiv.textContent = `Total: $${cartSubtotal.toFixed(2)}${unpriced ? " + offline items" : ""}`;
+    }
+
+    function resetCart() {
+        cart.clear();
+        cartRows.clear();
+        cartBody.innerHTML = "";
+        cartSubtotal = 0;
+        renderCartTotal();
+        if (!sharedCartId) cartId = null; // the next basket gets its own cart
+    }
+
+    async function checkout() {
+        if (!cart.size) {
             alert("Cart is empty!");
             return;
         }
-        fetch(`${BASE_URL}/api/transaction`, {
-            method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ items: cart })
-        })
-        .then(response => {
-            if (!response.ok) throw new Error("Checkout failed");
-            return response.json();
-        })
-        .then(data => {
-            showPaymentQR(data.qr_code, data.total);
-            cart = [];
-            updateCartDisplay();
-            statusDiv.textContent = "Checkout complete";
-            statusDiv.classList.add("success");
-        })
-        .catch(error => {
+        // The quantities travel with the sale, so it can be replayed from the outbox even if the cart expires
+        const items = [...cart.values()];
+        const sale = { client_txn_id: newTxnId(), cart_id: cartId, items: items.map(({ barcode, quantity }) => ({ barcode, quantity })) };
+        try {
+            await enqueue("transaction", sale);
+        } catch (error) {
             statusDiv.textContent = "Checkout error: " + error.message;
             statusDiv.classList.add("error");
             console.error("Checkout error:", error);
-        });
+            return;
+        }
+        resetCart();
+        const completed = await replayOutbox();
+        const result = completed.find(({ entry }) => entry.body.client_txn_id === sale.client_txn_id);
+        if (result && result.ok) {
+            showPaymentQR(result.data.qr_url, result.data.total);
+            statusDiv.textContent = "Checkout complete";
+            statusDiv.classList.remove("error");
+            statusDiv.classList.add("success");
+        } else if (result) {
+            // Rejected, or short of stock: give the basket back to fix up instead of leaving the sale queued
+            if (result.conflict) await idb("outbox", "readwrite", store => store.delete(result.entry.id));
+            cartId = cartId || sale.cart_id;
+            items.forEach(line => {
+                const current = cart.get(line.barcode);
+                const restored = current ? { ...current, quantity: current.quantity + line.quantity, total: null } : line;
+                cart.set(line.barcode, restored);
+                renderCartLine(restored);
+            });
+            renderCartTotal();
+            statusDiv.textContent = "Checkout error: " + (result.data.error || "Checkout failed");
+            statusDiv.classList.add("error");
+        } else {
+            statusDiv.textContent = `Offline - sale saved, ${await pendingCount()} waiting to sync`;
+            statusDiv.classList.add("error");
+        }
     }
 
-    function showPaymentQR(qrBase64, total) {
+    function showPaymentQR(qrUrl, total) {
         const popup = window.open("", "Payment", "width=300,height=400");
         popup.document.write(`
             <html>
             <body style="text-align: center; font-family: Arial;">
                 <h2>Payment</h2>
                 <p>Total: $${total.toFixed(2)}</p>
-                <img src="data:image/png;base64,${qrBase64}" style="width: 200px; height: 200px;">
+                <img src="${BASE_URL}${qrUrl}" style="width: 200px; height: 200px;">
                 <p>Scan with your payment app</p>
                 <button onclick="window.close()">Close</button>
             </body>
@@ -229,8 +555,11 @@ document.addEventListener("DOMContentLoaded", () => {
     }
 
     function clearCart() {
-        cart = [];
-        updateCartDisplay();
+        if (cartId && BASE_URL) {
+            // Releases the stock the cart holds; offline, the holds lapse on their own
+            fetch(`${BASE_URL}/api/carts/${cartId}`, { method: "DELETE" }).catch(() => {});
+        }
+        resetCart();
         statusDiv.textContent = "Cart cleared";
     }
-});
\ No newline at end of file
+});
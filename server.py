@@ -0,0 +1,160 @@
+import logging
+import os
+import signal
+import threading
+
+import cache
+import carts
+import db
+import events
+import logs
+import payment_qr
+import reservations
+
+logger = logging.getLogger(__name__)
+
+# dev: Werkzeug with TLS, fine for a single lane. waitress: threaded production server, plain HTTP
+# behind a TLS-terminating proxy. gunicorn: pre-forked workers with gthread pools, TLS in-process.
+SERVER_MODES = ("dev", "waitress", "gunicorn")
+HOST = os.environ.get("SUPERMARKET_HOST", "0.0.0.0")
+PORT = int(os.environ.get("SUPERMARKET_PORT", "5000"))
+WORKERS = int(os.environ.get("SUPERMARKET_WORKERS", "1"))
+THREADS = int(os.environ.get("SUPERMARKET_THREADS", "16"))  # each open SSE stream holds one
+GRACEFUL_TIMEOUT = 10
+TLS_CERT = "cert.pem"
+TLS_KEY = "key.pem"
+
+
+class DevServer:
+    def __init__(self, app, host, port, threads=None):
+        from werkzeug.serving import make_server
+        self.server = make_server(host, port, app, threaded=True, ssl_context=(TLS_CERT, TLS_KEY))
+
+    def serve(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class WaitressServer:
+    def __init__(self, app, host, port, threads=THREADS):
+        from waitress import create_server
+        self.server = create_server(app, host=host, port=port, threads=threads,
+                                    cleanup_interval=5, channel_timeout=events.HEARTBEAT_SECONDS * 2)
+
+    def serve(self):
+        self.server.run()
+
+    def stop(self):
+        self.server.close()
+
+
+def make_server(app, mode, host=HOST, port=PORT, threads=THREADS):
+    if mode == "dev":
+        return DevServer(app, host, port)
+    if mode == "waitress":
+        logger.warning("waitress serves plain HTTP; terminate TLS in a proxy, browsers only allow the camera over HTTPS")
+        return WaitressServer(app, host, port, threads)
+    raise ValueError(f"Server mode {mode} cannot run in a background thread")
+
+
+def start(app, mode, host=HOST, port=PORT, threads=THREADS):
+    """Start the API on a daemon thread; returns the server so the caller can stop() it."""
+    server = make_server(app, mode, host, port, threads)
+    threading.Thread(target=server.serve, name="http", daemon=True).start()
+    scheme = "https" if mode == "dev" else "http"
+    logger.info("Serving API (%s) on %s://%s:%s", mode, scheme, host, port)
+    return server
+
+
+def stop(server):
+    # End open event streams first so in-flight requests can drain, then release shared resources
+    events.bus.close()
+    server.stop()
+    shutdown_resources()
+
+
+def shutdown_resources():
+    payment_qr.shutdown()
+    db.pool.close_all()
+    logger.info("Server stopped")
+
+
+def serve_forever(app, mode, host=HOST, port=PORT, workers=WORKERS, threads=THREADS, on_worker_start=None):
+    """Headless serving: blocks until SIGINT/SIGTERM, then shuts down gracefully."""
+    if mode == "gunicorn":
+        run_gunicorn(app, host, port, workers, threads, on_worker_start)
+        return
+    if on_worker_start:
+        on_worker_start()
+    server = start(app, mode, host, port, threads)
+    stopping = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stopping.set())
+    while not stopping.wait(1):
+        pass
+    logger.info("Shutting down")
+    stop(server)
+
+
+def run_gunicorn(app, host, port, workers, threads, on_worker_start=None):
+    from gunicorn.app.base import BaseApplication
+
+    if workers > 1:
+        # The product cache and event bus live in each worker's memory. A cache entry in one worker
+        # would go stale after an edit served by another, so multi-worker mode reads through to SQLite.
+        logger.warning("Event streams only carry events raised in the same worker, and the cart API is off "
+                       "(checkout takes the items and checks stock itself); run one worker for tills that "
+                       "use server-side carts, reservations or live scan events")
+
+    def post_fork(arbiter, worker):
+        # Connections opened in the master must not be shared across processes, and the log
+        # writer thread does not survive the fork
+        logs.configure()
+        db.pool.close_all()
+        if workers > 1:
+            cache.products.capacity = 0
+            cache.products.clear()
+            # Stock holds and carts are per process too: the cart API answers 503 and checkout goes
+            # back to selling the items it is sent, decrementing stock itself
+            reservations.ledger.enabled = False
+            carts.store.enabled = False
+        elif on_worker_start:
+            on_worker_start()
+
+    def post_worker_init(worker):
+        handle_exit = worker.handle_exit
+
+        def closing(signum, frame):
+            threading.Thread(target=events.bus.close, daemon=True).start()
+            handle_exit(signum, frame)
+        signal.signal(signal.SIGTERM, closing)
+
+    def worker_exit(arbiter, worker):
+        shutdown_resources()
+
+    class Gunicorn(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "worker_class": "gthread",
+                "threads": threads,
+                "graceful_timeout": GRACEFUL_TIMEOUT,
+                "timeout": events.HEARTBEAT_SECONDS * 4,
+                "certfile": TLS_CERT,
+                "keyfile": TLS_KEY,
+                "post_fork": post_fork,
+                "post_worker_init": post_worker_init,
+                "worker_exit": worker_exit,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    db.pool.close_all()
+    Gunicorn().run()
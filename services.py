@@ -0,0 +1,666 @@
+import logging
+import re
+import itertools
+import time
+
+import db
+import events
+import cache
+import payment_qr
+import analytics
+import barcodes
+import carts
+import pricing
+import promotions
+import reservations
+
+logger = logging.getLogger(__name__)
+
+# Product, inventory and checkout operations shared by the Flask routes and the in-process Tk till.
+# Functions take and return plain Python data and signal client errors with ServiceError.
+
+PRODUCT_COLUMNS = ["id", "barcode", "product_type", "manufacturer_code", "product_code", "name",
+                   "buy_price", "sell_price", "discount", "stock", "version"]
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+LOW_STOCK_THRESHOLD = 5
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 500
+MAX_BATCH_LOOKUP = 500
+SQLITE_MAX_VARIABLES = 900  # Stay under the default host-parameter limit of older SQLite builds
+MAX_CLIENT_TXN_ID = 64
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 200
+DEFAULT_SELL_PRICE = 5.0  # Placeholder until someone prices the product
+
+# Statements are kept as constants so each pooled connection reuses its prepared copy
+SELECT_CATALOG_VERSION = "SELECT value FROM catalog_version WHERE id = 1"
+SELECT_PRODUCT_BY_BARCODE = "SELECT * FROM products WHERE barcode = ?"
+SELECT_PRODUCT_BY_ID = "SELECT * FROM products WHERE id = ?"
+INSERT_PRODUCT = """
+    INSERT INTO products (barcode, product_type, manufacturer_code, product_code, name, buy_price, sell_price, discount, stock)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+UPDATE_PRODUCT = """
+    UPDATE products SET name = ?, buy_price = ?, sell_price = ?, discount = ?, stock = ?
+    WHERE id = ?
+"""
+DELETE_PRODUCT = "DELETE FROM products WHERE id = ?"
+SEARCH_PRODUCTS = """
+    SELECT {columns} FROM products_fts JOIN products p ON p.id = products_fts.rowid
+    WHERE products_fts MATCH ? AND products_fts.rowid > ? ORDER BY products_fts.rowid LIMIT ?
+"""
+DECREMENT_STOCK = "UPDATE products SET stock = stock - ? WHERE barcode = ? AND stock >= ?"
+INSERT_ORDER = "INSERT INTO orders (created_at, total, item_count, client_txn_id) VALUES (?, ?, ?, ?)"
+SELECT_ORDER_BY_CLIENT_TXN = "SELECT id, total FROM orders WHERE client_txn_id = ?"
+INSERT_ORDER_LINE = """
+    INSERT INTO order_lines (order_id, barcode, name, quantity, unit_price, total, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+class ServiceError(Exception):
+    status = 400
+
+
+class NotFound(ServiceError):
+    status = 404
+
+
+class Conflict(ServiceError):
+    status = 409
+
+
+class Unavailable(ServiceError):
+    status = 503
+
+
+def product_defaults(decoded):
+    # Starting values for a newly scanned product; the till or importer overrides them
+    return dict(decoded, buy_price=1.0, stock=10)
+
+
+def decode_barcode(barcode, symbology=None):
+    """Decoded fields plus defaults for a new product. Raises ServiceError for a code that fails
+    its check digit, so a misread never becomes a product."""
+    try:
+        return product_defaults(barcodes.decode(barcode, symbology))
+    except barcodes.InvalidBarcode as e:
+        raise ServiceError(str(e))
+
+
+def decode_barcodes(codes, symbologies=None):
+    """Bulk decode_barcode for imports: an InvalidBarcode in place of each code that fails."""
+    return [decoded if isinstance(decoded, Exception) else product_defaults(decoded)
+            for decoded in barcodes.decode_many(codes, symbologies)]
+
+
+def fetch_products_by_barcodes(conn, barcodes, columns="*"):
+    # One IN (...) query per chunk instead of a round trip per barcode
+    rows = {}
+    for start in range(0, len(barcodes), SQLITE_MAX_VARIABLES):
+        chunk = barcodes[start:start + SQLITE_MAX_VARIABLES]
+        placeholders = ",".join("?" * len(chunk))
+        for row in conn.execute(f"SELECT {columns} FROM products WHERE barcode IN ({placeholders})", chunk):
+            rows[row['barcode']] = row
+    return rows
+
+
+def fetch_orders(conn, limit, before=None, since=None, until=None, order_id=None):
+    where, params = [], []
+    if order_id is not None:
+        where.append("id = ?")
+        params.append(order_id)
+    if before is not None:
+        where.append("id < ?")
+        params.append(before)
+    if since is not None:
+        where.append("created_at >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("created_at < ?")
+        params.append(until)
+    sql = "SELECT id, created_at, total, item_count FROM orders"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    orders = [dict(row, lines=[]) for row in conn.execute(sql + " ORDER BY id DESC LIMIT ?", params + [limit])]
+    by_id = {order['id']: order for order in orders}
+    ids = list(by_id)
+    for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+        chunk = ids[start:start + SQLITE_MAX_VARIABLES]
+        placeholders = ",".join("?" * len(chunk))
+        for line in conn.execute(f"SELECT order_id, barcode, name, quantity, unit_price, total FROM order_lines "
+                                 f"WHERE order_id IN ({placeholders}) ORDER BY id", chunk):
+            line = dict(line)
+            by_id[line.pop('order_id')]['lines'].append(line)
+    return orders
+
+
+def add_product(data):
+    if not data or 'barcode' not in data:
+        raise ServiceError("Barcode required")
+    barcode = str(data['barcode']).strip()
+
+    # Decode barcode for initial data; the scanner passes its detected symbology when it knows it
+    decoded = decode_barcode(barcode, data.get('symbology'))
+    name = data.get('name', decoded['name'])
+    buy_price = float(data.get('buy_price', decoded['buy_price']))
+    sell_price = float(data.get('sell_price', DEFAULT_SELL_PRICE))
+    discount = float(data.get('discount', 0.0))      # Default to 0
+    stock = int(data.get('stock', decoded['stock']))
+
+    with db.transaction() as conn:
+        if conn.execute(SELECT_PRODUCT_BY_BARCODE, (barcode,)).fetchone():
+            raise Conflict("Product exists")
+        c = conn.execute(INSERT_PRODUCT, (barcode, decoded['product_type'], decoded['manufacturer_code'], decoded['product_code'],
+                                          name, buy_price, sell_price, discount, stock))
+        product = dict(conn.execute(SELECT_PRODUCT_BY_ID, (c.lastrowid,)).fetchone())
+    cache.products.put(product)
+    events.bus.publish("product.created", product)
+    logger.info("Added product: %s", barcode)
+    return product
+
+
+def catalog_version():
+    return db.get_db().execute(SELECT_CATALOG_VERSION).fetchone()[0]
+
+
+def check_fields(fields):
+    fields = fields or PRODUCT_COLUMNS
+    unknown = [f for f in fields if f not in PRODUCT_COLUMNS]
+    if unknown:
+        raise ServiceError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def list_products(fields=None, limit=DEFAULT_PAGE_SIZE, after=None, updated_since=None, low_stock=None,
+                  product_type=None, manufacturer_code=None, name_prefix=None):
+    """Keyset-paginated listing ordered by id. Returns (products, next_cursor)."""
+    fields = check_fields(fields)
+    limit = min(limit, MAX_PAGE_SIZE)
+    if limit <= 0:
+        raise ServiceError("limit must be positive")
+
+    where, params = [], []
+    if after is not None:
+        where.append("id > ?")
+        params.append(after)
+    if updated_since is not None:
+        where.append("version > ?")
+        params.append(updated_since)
+    if low_stock is not None:
+        where.append("stock < ?")
+        params.append(low_stock)
+    if product_type:
+        where.append("product_type = ?")
+        params.append(product_type)
+    if manufacturer_code:
+        where.append("manufacturer_code = ?")
+        params.append(manufacturer_code)
+    if name_prefix:
+        escaped = name_prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        where.append("name LIKE ? ESCAPE '\\'")
+        params.append(escaped + '%')
+
+    conn = db.get_db()
+    columns = fields if 'id' in fields else ['id'] + fields
+    sql = f"SELECT {', '.join(columns)} FROM products"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id LIMIT ?"
+    rows = conn.execute(sql, params + [limit + 1]).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    products = [{f: row[f] for f in fields} for row in rows]
+
+    if updated_since is not None and not has_more:
+        # The last delta page ends with deletions since the token so clients can drop stale rows
+        tombstones = conn.execute("SELECT id, barcode FROM product_tombstones WHERE version > ? ORDER BY version",
+                                  (updated_since,))
+        products.extend({"id": t['id'], "barcode": t['barcode'], "deleted": True} for t in tombstones)
+    return products, (rows[-1]['id'] if has_more else None)
+
+
+def match_expression(query):
+    # Every word must prefix-match some indexed column; quoting keeps FTS5 operators in user input inert
+    return " ".join(f'"{term}"*' for term in re.findall(r"\w+", query or ""))
+
+
+def search_products(query, fields=None, limit=SEARCH_PAGE_SIZE, after=None):
+    """Type-ahead search over name, barcode, manufacturer_code and product_code.
+
+    Matches come in id order rather than by rank, which keeps one- and two-letter prefixes cheap
+    on large catalogs; an exact barcode match is moved to the front. Keyset-paginated on id like
+    list_products. Returns (products, next_cursor)."""
+    fields = check_fields(fields)
+    limit = min(limit, MAX_SEARCH_PAGE_SIZE)
+    if limit <= 0:
+        raise ServiceError("limit must be positive")
+    expression = match_expression(query)
+    if not expression:
+        return [], None
+    columns = fields if 'id' in fields else ['id'] + fields
+    sql = SEARCH_PRODUCTS.format(columns=", ".join(f"p.{c}" for c in columns))
+    rows = db.get_db().execute(sql, (expression, after or 0, limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    products = [{f: row[f] for f in fields} for row in rows]
+    if 'barcode' in fields and after is None:
+        barcode = query.strip()
+        exact = [p for p in products if p['barcode'] == barcode]
+        if exact:
+            products = exact + [p for p in products if p['barcode'] != barcode]
+    return products, (rows[-1]['id'] if has_more else None)
+
+
+def update_product(id, data):
+    if not data:
+        raise ServiceError("No data provided")
+    # Stock is set outright, so sales still pending are applied first rather than subtracted after
+    with reservations.ledger.settling() as conn:
+        c = conn.execute(UPDATE_PRODUCT, (data['name'], float(data['buy_price']), float(data['sell_price']),
+                                          float(data.get('discount', 0.0)), int(data['stock']), id))
+        if c.rowcount == 0:
+            raise NotFound("Product not found")
+        product = dict(conn.execute(SELECT_PRODUCT_BY_ID, (id,)).fetchone())
+    cache.products.put(product)
+    logger.info("Updated product ID: %s", id)
+    return product
+
+
+def delete_product(id):
+    with db.transaction() as conn:
+        row = conn.execute(SELECT_PRODUCT_BY_ID, (id,)).fetchone()
+        if not row:
+            raise NotFound("Product not found")
+        conn.execute(DELETE_PRODUCT, (id,))
+    cache.products.invalidate(row['barcode'])
+    logger.info("Deleted product ID: %s", id)
+    return dict(row)
+
+
+def get_product(barcode):
+    """Scan lookup: cache first, then SQLite; publishes product.scanned on a hit."""
+    product = cache.products.get(barcode)
+    if product is None:
+        row = db.get_db().execute(SELECT_PRODUCT_BY_BARCODE, (barcode,)).fetchone()
+        if row:
+            product = dict(row)
+            cache.products.put(product)
+    if not product:
+        raise NotFound("Product not found")
+    events.bus.publish("product.scanned", product)
+    return product
+
+
+def get_products_by_barcodes(barcodes):
+    """Batch scan lookup. Returns (results, not_found) with a not-found marker per missing barcode."""
+    barcodes = list(dict.fromkeys(str(b).strip() for b in barcodes))
+    if len(barcodes) > MAX_BATCH_LOOKUP:
+        raise ServiceError(f"At most {MAX_BATCH_LOOKUP} barcodes per request")
+    found = {}
+    missing = []
+    for barcode in barcodes:
+        product = cache.products.get(barcode)
+        if product is None:
+            missing.append(barcode)
+        else:
+            found[barcode] = product
+    for barcode, row in fetch_products_by_barcodes(db.get_db(), missing).items():
+        product = dict(row)
+        cache.products.put(product)
+        found[barcode] = product
+    results = {}
+    for barcode in barcodes:
+        if barcode in found:
+            results[barcode] = found[barcode]
+            events.bus.publish("product.scanned", found[barcode])
+        else:
+            results[barcode] = {"error": "Product not found"}
+    return results, [b for b in barcodes if b not in found]
+
+
+def list_promotions():
+    rows = db.get_db().execute(promotions.SELECT_PROMOTIONS + " ORDER BY id").fetchall()
+    return [promotions.to_dict(row) for row in rows]
+
+
+def parse_promotion(data):
+    try:
+        return promotions.parse(data)
+    except ValueError as e:
+        raise ServiceError(str(e))
+
+
+def add_promotions(data):
+    """Create one promotion, or a list of them all or nothing. Returns what was created."""
+    rows = [parse_promotion(item) for item in (data if isinstance(data, list) else [data])]
+    if not rows:
+        raise ServiceError("No promotions provided")
+    conn = db.get_db()
+    with db.transaction(conn):
+        first = conn.execute("SELECT COALESCE(MAX(id), 0) FROM promotions").fetchone()[0]
+        conn.executemany(promotions.INSERT_PROMOTION, rows)
+        created = conn.execute(promotions.SELECT_PROMOTIONS + " WHERE id > ? ORDER BY id", (first,)).fetchall()
+    promotions.reload(conn)
+    logger.info("Added %d promotions", len(created))
+    return [promotions.to_dict(row) for row in created]
+
+
+def update_promotion(id, data):
+    row = parse_promotion(data)
+    conn = db.get_db()
+    with db.transaction(conn):
+        if conn.execute(promotions.UPDATE_PROMOTION, (*row, id)).rowcount == 0:
+            raise NotFound("Promotion not found")
+        promotion = conn.execute(promotions.SELECT_PROMOTIONS + " WHERE id = ?", (id,)).fetchone()
+    promotions.reload(conn)
+    logger.info("Updated promotion ID: %s", id)
+    return promotions.to_dict(promotion)
+
+
+def delete_promotion(id):
+    conn = db.get_db()
+    with db.transaction(conn):
+        if conn.execute("DELETE FROM promotions WHERE id = ?", (id,)).rowcount == 0:
+            raise NotFound("Promotion not found")
+    promotions.reload(conn)
+    logger.info("Deleted promotion ID: %s", id)
+
+
+def payment_payload(total, transaction_id):
+    return f"Payment: ${total:.2f}|TransactionID:{transaction_id}"
+
+
+_checkout_holds = itertools.count()  # hold ids for checkouts that come without a cart
+
+
+def check_client_id(value, name, limit=MAX_CLIENT_TXN_ID):
+    if value is not None and (not isinstance(value, str) or not 0 < len(value) <= limit):
+        raise ServiceError(f"{name} must be a string of 1-{limit} characters")
+
+
+def reserve(cart_id, items):
+    """Set a cart's stock holds ({barcode: quantity}; 0 releases). Returns the cart's holds and
+    what remains available to other carts for the barcodes given."""
+    check_client_id(cart_id, "cart_id", reservations.MAX_CART_ID)
+    quantities = {}
+    for barcode, quantity in items.items():
+        if not isinstance(quantity, int) or quantity < 0:
+            raise ServiceError(f"Invalid quantity for product: {barcode}")
+        quantities[barcode] = quantity
+    conn = db.get_db()
+    if not reservations.ledger.enabled:
+        # Multi-worker server: nothing is held, but the lane still learns what is in stock
+        stock = reservations.stock_levels(conn, list(quantities))
+        for barcode, quantity in quantities.items():
+            if barcode not in stock and quantity > 0:
+                raise ServiceError(f"Invalid product: {barcode}")
+            if quantity > stock.get(barcode, 0):
+                raise Conflict(f"Insufficient stock: {barcode}")
+        return {"cart_id": cart_id, "holds": {}, "available": stock}
+    try:
+        available = reservations.ledger.reserve(conn, cart_id, quantities)
+    except reservations.UnknownProduct as e:
+        raise ServiceError(str(e))
+    except reservations.InsufficientStock as e:
+        raise Conflict(str(e))
+    return {"cart_id": cart_id, "holds": reservations.ledger.holds(cart_id), "available": available}
+
+
+def release_cart(cart_id):
+    reservations.ledger.release(cart_id)
+
+
+def cart_store():
+    if not carts.store.enabled:
+        raise Unavailable("Carts need a single-worker server; check out with the items instead")
+    return carts.store
+
+
+def create_cart(cart_id=None):
+    check_client_id(cart_id, "cart_id", reservations.MAX_CART_ID)
+    return cart_store().create(cart_id).snapshot()
+
+
+def get_cart(cart_id):
+    cart = cart_store().get(cart_id)
+    if cart is None:
+        raise NotFound("Cart not found")
+    with cart.lock:
+        return cart.snapshot()
+
+
+def add_to_cart(cart_id, barcode, quantity=1):
+    """Scan quantity more of barcode into the cart (negative takes some back out), creating the
+    cart on first use. Returns the changed line, any lines a bundle repriced with it, and the
+    cart's new totals."""
+    check_client_id(cart_id, "cart_id", reservations.MAX_CART_ID)
+    if not isinstance(quantity, int) or quantity == 0:
+        raise ServiceError("quantity must be a non-zero integer")
+    store = cart_store()
+    product = get_product(str(barcode).strip())
+    cart = store.create(cart_id)
+    with cart.lock:
+        line = cart.lines.get(product['barcode'])
+        return set_cart_line(cart, product, max((line['quantity'] if line else 0) + quantity, 0))
+
+
+def remove_from_cart(cart_id, barcode):
+    cart = cart_store().get(cart_id)
+    if cart is None:
+        raise NotFound("Cart not found")
+    with cart.lock:
+        line = cart.lines.get(barcode)
+        if line is None:
+            raise NotFound("Item not in cart")
+        return set_cart_line(cart, cart.products[barcode], 0)
+
+
+def set_cart_line(cart, product, quantity):
+    # Caller holds cart.lock; the hold is taken first, so a refused scan leaves the line as it was
+    reserve(cart.id, {product['barcode']: quantity})
+    line, repriced = cart.set_line(product, quantity)
+    change = dict(line=line, repriced=repriced, **cart.totals())
+    events.bus.publish("cart.updated", change)
+    return change
+
+
+def discard_cart(cart_id):
+    cart_store().discard(cart_id)
+    release_cart(cart_id)
+    events.bus.publish("cart.cleared", {"cart_id": cart_id})
+
+
+def settle_cart(cart, sold):
+    """After a checkout, take what sold off the cart. Anything scanned while the sale was in flight
+    stays, holding stock again; an emptied cart is dropped."""
+    with cart.lock:
+        for barcode, quantity in sold.items():
+            line = cart.lines.get(barcode)
+            if line:
+                cart.set_line(cart.products[barcode], max(line['quantity'] - quantity, 0))
+        remaining = cart.quantities()
+        snapshot = cart.snapshot()
+        if remaining:
+            try:
+                reserve(cart.id, remaining)
+            except ServiceError as e:
+                logger.info("Cart %s left with unheld items: %s", cart.id, e)
+        else:
+            carts.store.discard(cart.id)
+    return snapshot
+
+
+def replayed_transaction(client_txn_id, existing):
+    logger.info("Transaction %s already recorded as %s", client_txn_id, existing['id'])
+    return {"total": existing['total'], "transaction_id": existing['id'], "replayed": True,
+            "qr_token": payment_qr.submit(payment_payload(existing['total'], existing['id']))}
+
+
+def record_transaction(items=None, client_txn_id=None, cart_id=None):
+    """Commit a sale atomically. Returns total, transaction_id, the payment QR token and whether
+    client_txn_id matched an already recorded sale, in which case nothing new is written.
+    With cart_id the cart's stock holds are confirmed (topped up or trimmed to the items first);
+    without items, the server-side cart is what is sold."""
+    check_client_id(client_txn_id, "client_txn_id")
+    check_client_id(cart_id, "cart_id", reservations.MAX_CART_ID)
+    # Offline clients replay queued sales until acknowledged; the first commit wins. Checked before
+    # any stock is held, so a replay neither fails on stock it already took nor touches a cart's holds
+    if client_txn_id is not None:
+        existing = db.get_db().execute(SELECT_ORDER_BY_CLIENT_TXN, (client_txn_id,)).fetchone()
+        if existing:
+            return replayed_transaction(client_txn_id, existing)
+    cart = carts.store.get(cart_id) if cart_id and carts.store.enabled else None
+    if not items and cart is not None:
+        with cart.lock:
+            items = [{"barcode": barcode, "quantity": quantity} for barcode, quantity in cart.quantities().items()]
+    if not items:
+        raise ServiceError("Items required")
+    # Aggregate duplicate scans so each barcode is one decrement and one transaction line
+    quantities = {}
+    for item in items:
+        quantity = int(item['quantity'])
+        if quantity <= 0:
+            raise ServiceError(f"Invalid quantity for product: {item['barcode']}")
+        quantities[item['barcode']] = quantities.get(item['barcode'], 0) + quantity
+
+    # Stock is held in the ledger before the write lock is taken; the sale then only appends
+    # stock_pending rows, which the ledger's flusher applies to products.stock in batches
+    ledger = reservations.ledger
+    hold_id = None
+    if ledger.enabled:
+        hold_id = cart_id or f"checkout:{next(_checkout_holds)}"
+        try:
+            ledger.reserve(db.get_db(), hold_id, quantities, replace=True)
+        except reservations.UnknownProduct as e:
+            raise ServiceError(str(e))
+        except reservations.InsufficientStock as e:
+            raise Conflict(str(e))
+
+    try:
+        with db.transaction() as conn:
+            if client_txn_id is not None:
+                # A replay that raced the first send past the check above
+                existing = conn.execute(SELECT_ORDER_BY_CLIENT_TXN, (client_txn_id,)).fetchone()
+                if existing:
+                    if hold_id is not None and cart_id is None:
+                        ledger.release(hold_id)
+                    return replayed_transaction(client_txn_id, existing)
+            products = fetch_products_by_barcodes(conn, list(quantities),
+                                                  "barcode, name, product_type, manufacturer_code, buy_price, sell_price, discount, stock")
+            for barcode, quantity in quantities.items():
+                row = products.get(barcode)
+                if not row:
+                    raise ServiceError(f"Invalid product: {barcode}")
+                if hold_id is None and row['stock'] < quantity:
+                    raise Conflict(f"Insufficient stock: {barcode}")
+            lines, total = pricing.price_basket(products, quantities)
+            if hold_id is None:
+                c = conn.executemany(DECREMENT_STOCK, [(quantity, barcode, quantity) for barcode, quantity in quantities.items()])
+                if c.rowcount != len(lines):
+                    raise RuntimeError("Stock changed during checkout")
+            else:
+                conn.executemany(reservations.INSERT_PENDING, quantities.items())
+            created_at = int(time.time())
+            transaction_id = conn.execute(INSERT_ORDER, (created_at, total, sum(quantities.values()), client_txn_id)).lastrowid
+            conn.executemany(INSERT_ORDER_LINE, [(transaction_id, line['barcode'], line['name'], line['quantity'],
+                                                  line['total'] / line['quantity'], line['total'], created_at) for line in lines])
+            analytics.record_sale(conn, created_at, [
+                {"barcode": line['barcode'], "name": line['name'], "manufacturer_code": products[line['barcode']]['manufacturer_code'],
+                 "quantity": line['quantity'], "revenue": line['total'],
+                 "cost": products[line['barcode']]['buy_price'] * line['quantity']}
+                for line in lines
+            ])
+    except BaseException:
+        # A cart keeps its holds to retry; a one-off checkout gives them back
+        if hold_id is not None and cart_id is None:
+            ledger.release(hold_id)
+        raise
+    if hold_id is None:
+        for barcode in quantities:
+            cache.products.invalidate(barcode)
+    else:
+        ledger.confirm(hold_id, quantities)
+    if cart is not None:
+        events.bus.publish("cart.checked_out", dict(settle_cart(cart, quantities), transaction_id=transaction_id))
+    # The sale is durable; the QR renders in the background
+    qr_token = payment_qr.submit(payment_payload(total, transaction_id))
+    logger.info("Transaction recorded, total: $%.2f", total)
+    return {"total": total, "transaction_id": transaction_id, "qr_token": qr_token, "replayed": False}
+
+
+def list_orders(limit=HISTORY_PAGE_SIZE, before=None, since=None, until=None):
+    """Newest first, keyset-paginated on order id. Returns (orders, next_cursor)."""
+    limit = min(limit, MAX_HISTORY_PAGE_SIZE)
+    if limit <= 0:
+        raise ServiceError("limit must be positive")
+    orders = fetch_orders(db.get_db(), limit + 1, before=before, since=since, until=until)
+    return orders[:limit], (orders[limit - 1]['id'] if len(orders) > limit else None)
+
+
+def get_order(id):
+    orders = fetch_orders(db.get_db(), 1, order_id=id)
+    if not orders:
+        raise NotFound("Order not found")
+    return orders[0]
+
+
+class LocalBackend:
+    """Till backend that calls the services directly, for a GUI sharing the server's process."""
+
+    def products(self, etag=None):
+        version_tag = f'"v{catalog_version()}"'
+        if etag == version_tag:
+            return None, etag
+        products, cursor = list_products(limit=MAX_PAGE_SIZE)
+        while cursor is not None:
+            page, cursor = list_products(limit=MAX_PAGE_SIZE, after=cursor)
+            products.extend(page)
+        return products, version_tag
+
+    def search(self, query, limit=SEARCH_PAGE_SIZE):
+        return search_products(query, limit=limit)[0]
+
+    def add_product(self, data):
+        return add_product(data)
+
+    def update_product(self, id, data):
+        return update_product(id, data)
+
+    def delete_product(self, id):
+        return delete_product(id)
+
+    def get_cart(self, cart_id):
+        return get_cart(cart_id)
+
+    def add_to_cart(self, cart_id, barcode, quantity=1):
+        return add_to_cart(cart_id, barcode, quantity)
+
+    def remove_from_cart(self, cart_id, barcode):
+        return remove_from_cart(cart_id, barcode)
+
+    def discard_cart(self, cart_id):
+        discard_cart(cart_id)
+
+    def checkout(self, items=None, cart_id=None):
+        result = record_transaction(items, cart_id=cart_id)
+        return {"total": result["total"], "transaction_id": result["transaction_id"],
+                "qr_url": f"/api/qr/{result['qr_token']}"}
+
+    def payment_qr(self, qr_url):
+        return payment_qr.get_png(payment_qr.payload_for(qr_url.rsplit("/", 1)[-1]))
+
+    def orders(self, limit=HISTORY_PAGE_SIZE, before=None):
+        return list_orders(limit, before=before)
+
+    def events(self, last_id=None):
+        q = events.bus.subscribe(last_id)
+        try:
+            while True:
+                event = q.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            events.bus.unsubscribe(q)
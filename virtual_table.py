@@ -0,0 +1,144 @@
+import tkinter as tk
+from tkinter import ttk
+
+
+class VirtualTable:
+    """Treeview that only materializes the rows in view and diffs updates by key.
+
+    The full data set lives in Python (an ordered key list plus a key -> values map); the
+    Treeview holds one item per visible slot, and scrolling or refreshing only rewrites the
+    slots whose (key, values) changed. Tens of thousands of rows cost the same to redraw as
+    a screenful.
+    """
+
+    def __init__(self, parent, columns, widths=None, row_height=25):
+        self.columns = columns
+        self.row_height = row_height
+        self.frame = tk.Frame(parent, bg="#ffffff")
+        self.tree = ttk.Treeview(self.frame, columns=columns, show="headings", selectmode="browse")
+        for col in columns:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=(widths or {}).get(col, 150))
+        self.scrollbar = ttk.Scrollbar(self.frame, orient="vertical", command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill="both", expand=True)
+
+        self.keys = []
+        self.values = {}
+        self._positions = {}
+        self.offset = 0
+        self.visible_rows = 20
+        self._slots = []          # Treeview item ids, one per rendered row
+        self._rendered = {}       # slot iid -> (key, values) currently shown
+        self._selected_key = None
+
+        self.tree.bind("<Configure>", self._on_resize)
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1) or "break")
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-1) or "break")
+        self.tree.bind("<Button-5>", lambda e: self.scroll(1) or "break")
+        self.tree.bind("<<TreeviewSelect>>", self._on_select, add="+")
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def set_rows(self, rows):
+        """Replace the data set with (key, values) pairs; only changed visible slots are redrawn."""
+        self.keys = []
+        self.values = {}
+        for key, values in rows:
+            if key not in self.values:
+                self.keys.append(key)
+            self.values[key] = tuple(values)
+        self._reindex()
+        self._render()
+
+    def append_rows(self, rows):
+        for key, values in rows:
+            if key not in self.values:
+                self._positions[key] = len(self.keys)
+                self.keys.append(key)
+            self.values[key] = tuple(values)
+        self._render()
+
+    def upsert(self, key, values):
+        if key not in self.values:
+            self._positions[key] = len(self.keys)
+            self.keys.append(key)
+        self.values[key] = tuple(values)
+        self._render()
+
+    def remove(self, key):
+        if key in self.values:
+            del self.values[key]
+            self.keys.pop(self._positions[key])
+            self._reindex()
+            if self._selected_key == key:
+                self._selected_key = None
+            self._render()
+
+    def clear(self):
+        self.set_rows([])
+
+    def selected_key(self):
+        return self._selected_key
+
+    def scroll(self, rows):
+        self.offset += rows
+        self._render()
+
+    def _reindex(self):
+        self._positions = {key: i for i, key in enumerate(self.keys)}
+
+    def _render(self):
+        self.offset = max(0, min(self.offset, len(self.keys) - self.visible_rows))
+        needed = max(0, min(self.visible_rows, len(self.keys) - self.offset))
+        while len(self._slots) < needed:
+            self._slots.append(self.tree.insert("", "end"))
+        while len(self._slots) > needed:
+            iid = self._slots.pop()
+            self._rendered.pop(iid, None)
+            self.tree.delete(iid)
+
+        selected_slot = None
+        for i, iid in enumerate(self._slots):
+            key = self.keys[self.offset + i]
+            state = (key, self.values[key])
+            if self._rendered.get(iid) != state:
+                self.tree.item(iid, values=state[1])
+                self._rendered[iid] = state
+            if key == self._selected_key:
+                selected_slot = iid
+        current = self.tree.selection()
+        wanted = (selected_slot,) if selected_slot else ()
+        if tuple(current) != wanted:
+            self.tree.selection_set(wanted)
+
+        total = len(self.keys)
+        if total:
+            self.scrollbar.set(self.offset / total, (self.offset + needed) / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _on_select(self, event):
+        selection = self.tree.selection()
+        if selection and selection[0] in self._rendered:
+            self._selected_key = self._rendered[selection[0]][0]
+
+    def _on_resize(self, event):
+        # Heading row takes roughly one row of height
+        rows = max(1, event.height // self.row_height - 1)
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self._render()
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.offset = int(float(amount) * len(self.keys))
+        elif unit == "pages":
+            self.offset += int(amount) * self.visible_rows
+        else:
+            self.offset += int(amount)
+        self._render()